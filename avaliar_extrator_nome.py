@@ -0,0 +1,74 @@
+# avaliar_extrator_nome.py
+"""
+Mede o extrator de nomes local (sem IA) contra um corpus de respostas reais ao
+"como posso chamá-lo(a)?". Use `--llm` para rodar também o caminho atual via OpenAI
+e comparar a precisão dos dois.
+"""
+import sys
+import time
+
+from sarah_bot.extrator_nome import extrair_nome_localmente
+
+# (mensagem do cliente, nome esperado ou None quando não há nome na frase)
+CORPUS = [
+    ("Meu nome é Gabriel", "Gabriel"),
+    ("meu nome e gabriel", "Gabriel"),
+    ("Pode me chamar de Ana Clara", "Ana Clara"),
+    ("pode me chamar de zé", "Zé"),
+    ("Sou o João", "João"),
+    ("sou a Marcela, da fazenda Boa Vista", "Marcela"),
+    ("Marcela", "Marcela"),
+    ("marcos", "Marcos"),
+    ("João Pedro", "João Pedro"),
+    ("Oi, sou o Carlos", "Carlos"),
+    ("Boa tarde! Me chamo Roberto", "Roberto"),
+    ("Bom dia, meu nome é José da Silva", "José da Silva"),
+    ("me chamo luiz fernando", "Luiz Fernando"),
+    ("Aqui é o Tiago", "Tiago"),
+    ("aqui é a dona Rosa", "Rosa"),
+    ("Seu Antônio", "Antônio"),
+    ("Pode chamar de Paulo mesmo", "Paulo"),
+    ("Eu sou o Renato, produtor em Cristalina", "Renato"),
+    ("Sou Valdir", "Valdir"),
+    ("Fernanda aqui", "Fernanda"),
+    ("oi, Rafael", "Rafael"),
+    ("Claudio Ribeiro", "Claudio Ribeiro"),
+    ("Edivaldo", "Edivaldo"),
+    ("quem fala é o Sebastião", "Sebastião"),
+    ("meu nome é Wellington, tenho 4 pivôs", "Wellington"),
+    ("Quanto custa o produto?", None),
+    ("sim", None),
+    ("Bom dia", None),
+    ("Tudo bem?", None),
+    ("Sou produtor de soja", None),
+    ("sou de Goiás", None),
+    ("quero saber o preço", None),
+    ("tenho interesse", None),
+    ("Fazenda Santa Rita", None),
+    ("ok", None),
+]
+
+
+def avaliar(extrator, rotulo: str):
+    confiantes = corretos = 0
+    inicio = time.perf_counter()
+    for frase, esperado in CORPUS:
+        nome, confiante = extrator(frase)
+        if not confiante:
+            continue
+        confiantes += 1
+        if nome == esperado:
+            corretos += 1
+        else:
+            print(f"  ❌ [{rotulo}] '{frase}' -> {nome!r} (esperado {esperado!r})")
+    duracao_ms = (time.perf_counter() - inicio) * 1000
+    print(f"{rotulo}: cobertura {confiantes}/{len(CORPUS)} ({confiantes / len(CORPUS):.0%}), "
+          f"precisão {corretos}/{confiantes} ({corretos / confiantes if confiantes else 0:.0%}), "
+          f"tempo total {duracao_ms:.1f} ms")
+
+
+if __name__ == "__main__":
+    avaliar(extrair_nome_localmente, "local")
+    if "--llm" in sys.argv:
+        from sarah_bot.vendedora import extrair_nome_da_mensagem
+        avaliar(lambda frase: (extrair_nome_da_mensagem(frase), True), "llm")
@@ -0,0 +1,375 @@
+# benchmark_carga.py
+"""
+Teste de carga offline do bot: N clientes simulados percorrem o roteiro completo do `bot.responder`
+(INICIANTE -> AGUARDANDO_NOME -> AGUARDANDO_DOR -> CONFIRMANDO_INTERESSE -> orçamento -> FECHAMENTO)
+ao mesmo tempo, com Updates/Context falsos no lugar do Telegram e um servidor local no lugar da OpenAI
+(latência e variação configuráveis). Nenhuma chamada sai da máquina e o banco é criado numa pasta temporária.
+
+O relatório sai em JSON (stdout e, opcionalmente, `--saida`): latência por mensagem (p50/p95/p99),
+vazão, tempo gasto no banco e pico de memória (RSS), para cada nível de concorrência.
+
+Exemplos:
+    python benchmark_carga.py --usuarios 50
+    python benchmark_carga.py --usuarios 10 50 100 200 --latencia-ms 800 --jitter-ms 300 --saida carga.json
+    python benchmark_carga.py --usuarios 100 --limite-p95-ms 3000   # sai com código 1 se o p95 passar do limite
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import re
+import resource
+import sys
+import tempfile
+import time
+import types
+
+PASTA_PROJETO = os.path.dirname(os.path.abspath(__file__))
+
+# (etapa, mensagem do cliente) — o roteiro que cada cliente simulado segue, uma mensagem depois da outra
+ROTEIRO = [
+    ("saudacao", "oi, boa tarde"),
+    ("nome", "meu nome é {nome}"),
+    ("dor", "{dor}"),
+    ("interesse", "sim, pode mostrar"),
+    ("pergunta_preco", "quanto custa?"),
+    ("quantidade", "tenho {pivos} pivôs"),
+    ("fechamento", "quero fechar negócio"),
+]
+
+NOMES = ["Gabriel", "Ana", "João", "Marcela", "Carlos", "Roberto", "Fernanda", "Tiago", "Rosa", "Paulo"]
+DORES = [
+    "roubaram os cabos do meu pivô duas vezes esse ano",
+    "tenho medo de furto na casa de bombas, a região está perigosa",
+    "já levaram o transformador do vizinho e estou preocupado",
+    "perdi dias de irrigação por causa de furto de cobre",
+]
+
+RESPOSTA_SARAH = (
+    "Entendo perfeitamente a sua preocupação. O SAF monitora seus equipamentos 24 horas por dia, "
+    "mesmo sem sinal de celular, e avisa na hora qualquer movimento suspeito. Posso te mostrar como funciona?"
+)
+
+
+# --- SERVIDOR FALSO DA OPENAI (processo separado) ---
+
+def _percentil(valores, p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+def _resposta_analise(prompt: str) -> str:
+    encontrada = re.search(r'Mensagem do Cliente: "(.*)"', prompt)
+    mensagem = (encontrada.group(1) if encontrada else "").lower()
+    tags, entidades = [], {"qtd_pivos": None, "qtd_bombas": None}
+    numero = re.search(r"\d+", mensagem)
+    if "custa" in mensagem or "preço" in mensagem or numero:
+        tags.append("INTENCAO_ORCAMENTO")
+        if numero:
+            entidades["qtd_pivos"] = int(numero.group())
+    if "fechar" in mensagem:
+        tags.append("INTENCAO_FECHAMENTO")
+    if "roub" in mensagem or "furto" in mensagem:
+        tags.append("DOR_INSEGURANCA_REGIAO")
+    return json.dumps({"perfil_detectado": "produtor", "sentimento_principal": "neutro", "tags_relevantes": tags, "entidades_extraidas": entidades})
+
+
+def _servidor_openai(latencia_ms: float, jitter_ms: float, intervalo_token_ms: float, porta_pronta):
+    """Responde `POST /v1/chat/completions` (com e sem stream) e `GET /stats`, com a latência pedida."""
+    estatisticas = {"requisicoes": 0, "streams": 0, "em_andamento_max": 0}
+    em_andamento = 0
+
+    async def atraso():
+        await asyncio.sleep(max(0.0, random.gauss(latencia_ms, jitter_ms)) / 1000)
+
+    def conteudo_para(corpo):
+        prompt = "\n".join(str(m.get("content", "")) for m in corpo.get("messages", []))
+        if "tags_relevantes" in prompt:
+            return _resposta_analise(prompt)
+        if "extraia APENAS o nome" in prompt:
+            return json.dumps({"nome": "Cliente"})
+        return RESPOSTA_SARAH
+
+    async def escrever_json(writer, status, dados):
+        corpo = json.dumps(dados).encode()
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(corpo)}\r\n\r\n".encode() + corpo)
+        await writer.drain()
+
+    async def escrever_stream(writer, modelo, texto):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n")
+        palavras = texto.split(" ")
+        for i, palavra in enumerate(palavras):
+            pedaco = {"id": "bench", "object": "chat.completion.chunk", "created": 0, "model": modelo,
+                      "choices": [{"index": 0, "delta": {"content": palavra + (" " if i < len(palavras) - 1 else "")}, "finish_reason": None}]}
+            dados = f"data: {json.dumps(pedaco)}\n\n".encode()
+            writer.write(f"{len(dados):x}\r\n".encode() + dados + b"\r\n")
+            await writer.drain()
+            await asyncio.sleep(intervalo_token_ms / 1000)
+        fim = b"data: [DONE]\n\n"
+        writer.write(f"{len(fim):x}\r\n".encode() + fim + b"\r\n0\r\n\r\n")
+        await writer.drain()
+
+    async def atender(reader, writer):
+        nonlocal em_andamento
+        try:
+            while True:
+                linha = await reader.readline()
+                if not linha:
+                    return
+                metodo, caminho, _ = linha.decode().split(" ", 2)
+                cabecalhos = {}
+                while (linha := await reader.readline()) not in (b"\r\n", b""):
+                    chave, _, valor = linha.decode().partition(":")
+                    cabecalhos[chave.strip().lower()] = valor.strip()
+                corpo = json.loads(await reader.readexactly(int(cabecalhos.get("content-length", 0))) or b"{}")
+
+                if metodo == "GET" and caminho == "/stats":
+                    await escrever_json(writer, "200 OK", estatisticas)
+                    continue
+                estatisticas["requisicoes"] += 1
+                em_andamento += 1
+                estatisticas["em_andamento_max"] = max(estatisticas["em_andamento_max"], em_andamento)
+                try:
+                    await atraso()
+                    modelo = corpo.get("model", "bench")
+                    texto = conteudo_para(corpo)
+                    if corpo.get("stream"):
+                        estatisticas["streams"] += 1
+                        await escrever_stream(writer, modelo, texto)
+                    else:
+                        await escrever_json(writer, "200 OK", {
+                            "id": "bench", "object": "chat.completion", "created": 0, "model": modelo,
+                            "choices": [{"index": 0, "message": {"role": "assistant", "content": texto}, "finish_reason": "stop"}],
+                            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+                        })
+                finally:
+                    em_andamento -= 1
+        except (ConnectionError, asyncio.IncompleteReadError):
+            return
+        finally:
+            writer.close()
+
+    async def principal():
+        servidor = await asyncio.start_server(atender, "127.0.0.1", 0, backlog=1024)
+        porta_pronta.put(servidor.sockets[0].getsockname()[1])
+        async with servidor:
+            await servidor.serve_forever()
+
+    asyncio.run(principal())
+
+
+# --- TELEGRAM FALSO ---
+
+class MensagemFalsa:
+    """O suficiente de `telegram.Message` para o `responder` e o stream de respostas."""
+
+    def __init__(self, texto: str, latencia_s: float):
+        self.text = texto
+        self._latencia_s = latencia_s
+
+    async def _chamada_api(self):
+        if self._latencia_s:
+            await asyncio.sleep(self._latencia_s)
+
+    async def reply_text(self, texto, **kwargs):
+        await self._chamada_api()
+        return MensagemFalsa(texto, self._latencia_s)
+
+    async def edit_text(self, texto, **kwargs):
+        await self._chamada_api()
+        self.text = texto
+        return self
+
+    async def reply_video(self, **kwargs):
+        await self._chamada_api()
+
+
+class BotFalso:
+    def __init__(self, latencia_s: float):
+        self._latencia_s = latencia_s
+
+    async def send_chat_action(self, **kwargs):
+        if self._latencia_s:
+            await asyncio.sleep(self._latencia_s)
+
+    async def send_message(self, **kwargs):
+        if self._latencia_s:
+            await asyncio.sleep(self._latencia_s)
+
+
+def _update_falso(user_id: int, nome: str, texto: str, latencia_s: float):
+    usuario = types.SimpleNamespace(id=user_id, first_name=nome)
+    return types.SimpleNamespace(message=MensagemFalsa(texto, latencia_s), effective_user=usuario, effective_chat=types.SimpleNamespace(id=user_id))
+
+
+# --- CARGA ---
+
+class Cronometro:
+    """Soma o tempo gasto numa função (usado para medir o banco sem mexer no código do bot)."""
+
+    def __init__(self):
+        self.duracoes = []
+
+    def envolver(self, funcao):
+        def medida(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                return funcao(*args, **kwargs)
+            finally:
+                self.duracoes.append(time.perf_counter() - inicio)
+        return medida
+
+
+def _resumo_ms(valores):
+    return {
+        "p50": round(_percentil(valores, 50) * 1000, 2),
+        "p95": round(_percentil(valores, 95) * 1000, 2),
+        "p99": round(_percentil(valores, 99) * 1000, 2),
+        "max": round(max(valores, default=0.0) * 1000, 2),
+        "media": round(sum(valores) / len(valores) * 1000, 2) if valores else 0.0,
+    }
+
+
+async def _rodada(bot, memoria, args, usuarios: int, primeiro_id: int):
+    contexto = types.SimpleNamespace(bot=BotFalso(args.latencia_telegram_ms / 1000))
+    vagas = asyncio.Semaphore(bot.MAX_UPDATES_CONCORRENTES)
+    latencias, por_etapa, erros = [], {etapa: [] for etapa, _ in ROTEIRO}, []
+    banco_leitura, banco_escrita = Cronometro(), Cronometro()
+    get_cliente, salvar = memoria.get_cliente, memoria.SessaoCliente.salvar
+    memoria.get_cliente = banco_leitura.envolver(get_cliente)
+    memoria.SessaoCliente.salvar = banco_escrita.envolver(salvar)
+
+    async def cliente_simulado(indice: int):
+        await asyncio.sleep(random.uniform(0, args.rampa_s))
+        user_id = primeiro_id + indice
+        dados = {"nome": random.choice(NOMES), "dor": random.choice(DORES), "pivos": random.randint(1, 8)}
+        for etapa, modelo in ROTEIRO:
+            update = _update_falso(user_id, dados["nome"], modelo.format(**dados), args.latencia_telegram_ms / 1000)
+            inicio = time.perf_counter()
+            try:
+                async with vagas:
+                    await bot.responder(update, contexto)
+            except Exception as e:
+                erros.append(f"{etapa}: {type(e).__name__}: {e}")
+                return
+            duracao = time.perf_counter() - inicio
+            latencias.append(duracao)
+            por_etapa[etapa].append(duracao)
+            await asyncio.sleep(args.pausa_ms / 1000)
+
+    inicio = time.perf_counter()
+    try:
+        await asyncio.gather(*(cliente_simulado(i) for i in range(usuarios)))
+    finally:
+        memoria.get_cliente, memoria.SessaoCliente.salvar = get_cliente, salvar
+    duracao = time.perf_counter() - inicio
+
+    tempo_banco = sum(banco_leitura.duracoes) + sum(banco_escrita.duracoes)
+    return {
+        "usuarios": usuarios,
+        "mensagens": len(latencias),
+        "erros": len(erros),
+        "exemplos_de_erro": erros[:5],
+        "duracao_s": round(duracao, 3),
+        "vazao_msg_s": round(len(latencias) / duracao, 2) if duracao else 0.0,
+        "latencia_ms": _resumo_ms(latencias),
+        "latencia_por_etapa_ms": {etapa: _resumo_ms(valores) for etapa, valores in por_etapa.items()},
+        "banco": {
+            "tempo_total_s": round(tempo_banco, 4),
+            "por_mensagem_ms": round(tempo_banco / len(latencias) * 1000, 3) if latencias else 0.0,
+            "leitura_ms": _resumo_ms(banco_leitura.duracoes),
+            "gravacao_ms": _resumo_ms(banco_escrita.duracoes),
+        },
+        "rss_pico_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+async def _executar(args, porta: int):
+    # O bot é importado só agora: as variáveis de ambiente (OpenAI local) precisam estar definidas antes
+    sys.path.insert(0, PASTA_PROJETO)
+    import httpx
+    import bot
+    from sarah_bot import memoria, metricas, notificacoes, streaming
+
+    # Logs do bot só no arquivo (data/sarah_bot.log da pasta temporária), não no terminal
+    for handler in list(bot.logger.handlers):
+        if not hasattr(handler, "baseFilename"):
+            bot.logger.removeHandler(handler)
+
+    memoria.init_db()
+    await notificacoes.iniciar(BotFalso(args.latencia_telegram_ms / 1000))
+    rodadas = []
+    primeiro_id = 1_000_000
+    try:
+        for usuarios in args.usuarios:
+            rodadas.append(await _rodada(bot, memoria, args, usuarios, primeiro_id))
+            primeiro_id += usuarios
+            print(f"{usuarios} usuários: p95 {rodadas[-1]['latencia_ms']['p95']} ms, {rodadas[-1]['vazao_msg_s']} msg/s", file=sys.stderr)
+    finally:
+        await notificacoes.encerrar()
+
+    async with httpx.AsyncClient() as cliente_http:
+        llm = (await cliente_http.get(f"http://127.0.0.1:{porta}/stats")).json()
+    return {
+        "parametros": {chave: valor for chave, valor in vars(args).items() if chave != "saida"},
+        "rodadas": rodadas,
+        "llm_local": llm,
+        "streaming": streaming.obter_estatisticas(),
+        "especulacao": bot.obter_estatisticas_especulacao(),
+        # Filas por usuário, cache da IA, alertas, tokens do prompt, resumos... (as mesmas séries do /metrics)
+        "contadores": metricas.obter_fontes(),
+        "rss_pico_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga offline do bot.responder.")
+    parser.add_argument("--usuarios", type=int, nargs="+", default=[50], help="clientes simultâneos (um ou mais níveis, rodados em sequência)")
+    parser.add_argument("--latencia-ms", type=float, default=500, help="latência média da OpenAI local até o primeiro token")
+    parser.add_argument("--jitter-ms", type=float, default=150, help="desvio padrão da latência da OpenAI local")
+    parser.add_argument("--intervalo-token-ms", type=float, default=15, help="intervalo entre os pedaços da resposta em stream")
+    parser.add_argument("--latencia-telegram-ms", type=float, default=0, help="latência de cada chamada ao Telegram falso")
+    parser.add_argument("--pausa-ms", type=float, default=0, help="tempo que o cliente leva para responder cada mensagem")
+    parser.add_argument("--rampa-s", type=float, default=1.0, help="os clientes começam espalhados neste intervalo")
+    parser.add_argument("--com-cache-llm", action="store_true", help="mantém o cache de respostas da IA ligado (desligado por padrão)")
+    parser.add_argument("--limite-p95-ms", type=float, help="termina com código 1 se o p95 de alguma rodada passar deste valor")
+    parser.add_argument("--saida", help="grava o relatório JSON também neste arquivo")
+    args = parser.parse_args()
+
+    porta_pronta = multiprocessing.Queue()
+    servidor = multiprocessing.Process(
+        target=_servidor_openai, args=(args.latencia_ms, args.jitter_ms, args.intervalo_token_ms, porta_pronta), daemon=True
+    )
+    servidor.start()
+    porta = porta_pronta.get(timeout=30)
+
+    saida = os.path.abspath(args.saida) if args.saida else None
+    os.environ.update({
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{porta}/v1",
+        "OPENAI_API_KEY": "benchmark",
+        "BOT_TOKEN": "benchmark",
+        "GERENTE_CHAT_ID": "0",
+        "CACHE_LLM_ATIVO": "1" if args.com_cache_llm else "0",
+    })
+    # Banco, cache e log vão para uma pasta descartável (o caminho do banco é relativo à pasta atual)
+    os.chdir(tempfile.mkdtemp(prefix="sarah_carga_"))
+    try:
+        relatorio = asyncio.run(_executar(args, porta))
+    finally:
+        servidor.terminate()
+
+    texto = json.dumps(relatorio, indent=2, ensure_ascii=False)
+    print(texto)
+    if saida:
+        with open(saida, "w", encoding="utf-8") as arquivo:
+            arquivo.write(texto)
+    if args.limite_p95_ms is not None and any(r["latencia_ms"]["p95"] > args.limite_p95_ms for r in relatorio["rodadas"]):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+# benchmark_webhook.py
+"""
+Teste de vazão offline do modo webhook: o servidor de `sarah_bot.webhook` (com a fila limitada) roda num
+processo separado e este script faz POSTs de updates gravados (ou sintéticos) em várias conexões keep-alive,
+como o Telegram faz. Nada sai da máquina; o processamento de cada update é simulado com `--custo-ms`.
+
+O relatório sai em JSON (stdout e, opcionalmente, `--saida`): respostas por status, vazão aceita,
+latência de cada POST (p50/p95/p99), o maior tamanho da fila e quanto tempo ela levou para esvaziar.
+
+Exemplos:
+    python benchmark_webhook.py --total 20000
+    python benchmark_webhook.py --conexoes 100 --taxa 3000 --custo-ms 50 --trabalhadores 64 --fila-max 500
+    python benchmark_webhook.py --updates updates_gravados.jsonl --min-vazao 2000   # código 1 abaixo de 2000 updates/s
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+PASTA_PROJETO = os.path.dirname(os.path.abspath(__file__))
+CAMINHO = "/telegram"
+SEGREDO = "benchmark_segredo"
+
+TEXTOS = ["oi, boa tarde", "meu nome é Ana", "roubaram os cabos do meu pivô", "quanto custa?", "tenho 3 pivôs", "quero fechar negócio"]
+
+
+# --- SERVIDOR DO WEBHOOK (processo separado) ---
+
+def _servidor_webhook(trabalhadores: int, fila_max: int, custo_ms: float, conexao):
+    sys.path.insert(0, PASTA_PROJETO)
+    from telegram import Bot, Update
+    from sarah_bot.webhook import FilaUpdates, iniciar_servidor
+
+    async def principal():
+        bot = Bot("123456:benchmark")
+        processados = 0
+
+        async def processar(dados):
+            nonlocal processados
+            # Mesmo custo de conversão do bot de verdade; o resto do processamento vira uma espera
+            Update.de_json(dados, bot)
+            if custo_ms:
+                await asyncio.sleep(custo_ms / 1000)
+            processados += 1
+
+        fila = FilaUpdates(processar, trabalhadores, fila_max)
+        fila.iniciar()
+        servidor = await iniciar_servidor(fila.aceitar, "127.0.0.1", 0, CAMINHO, SEGREDO)
+        conexao.send(servidor.sockets[0].getsockname()[1])
+        await asyncio.get_running_loop().run_in_executor(None, conexao.recv)
+        servidor.close()
+        inicio = time.perf_counter()
+        await fila.encerrar(tempo_limite=300)
+        conexao.send({
+            "processados": processados,
+            "recusados_fila_cheia": fila.recusados,
+            "maior_tamanho_fila": fila.maior_tamanho,
+            "tempo_para_esvaziar_s": round(time.perf_counter() - inicio, 3),
+        })
+
+    asyncio.run(principal())
+
+
+# --- CLIENTES (este processo) ---
+
+def _percentil(valores, p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return round(ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))], 3)
+
+
+def _carregar_updates(caminho):
+    """Updates gravados: um JSON por linha, uma lista JSON ou a resposta de getUpdates ({"result": [...]})."""
+    if not caminho:
+        return [
+            {"message": {
+                "message_id": i, "date": int(time.time()), "text": TEXTOS[i % len(TEXTOS)],
+                "chat": {"id": 1_000_000 + i % 5000, "type": "private", "first_name": "Cliente"},
+                "from": {"id": 1_000_000 + i % 5000, "is_bot": False, "first_name": "Cliente"},
+            }}
+            for i in range(len(TEXTOS) * 50)
+        ]
+    with open(caminho, encoding="utf-8") as arquivo:
+        conteudo = arquivo.read().strip()
+    try:
+        dados = json.loads(conteudo)
+    except ValueError:
+        return [json.loads(linha) for linha in conteudo.splitlines() if linha.strip()]
+    if isinstance(dados, dict):
+        return dados.get("result", [dados])
+    return dados
+
+
+def _requisicoes(updates, total: int, porta: int, segredo: str):
+    requisicoes = []
+    for i in range(total):
+        corpo = json.dumps({**updates[i % len(updates)], "update_id": i + 1}, ensure_ascii=False).encode()
+        requisicoes.append(
+            f"POST {CAMINHO} HTTP/1.1\r\nHost: 127.0.0.1:{porta}\r\nContent-Type: application/json\r\n"
+            f"X-Telegram-Bot-Api-Secret-Token: {segredo}\r\nContent-Length: {len(corpo)}\r\n\r\n".encode() + corpo
+        )
+    return requisicoes
+
+
+async def _cliente(porta: int, requisicoes, proxima, taxa: float, inicio: float, status, latencias):
+    leitor, escritor = await asyncio.open_connection("127.0.0.1", porta)
+    try:
+        while True:
+            i = next(proxima, None)
+            if i is None:
+                return
+            if taxa:
+                # Envio agendado: a i-ésima requisição sai em inicio + i/taxa, qualquer que seja a conexão
+                espera = inicio + i / taxa - time.perf_counter()
+                if espera > 0:
+                    await asyncio.sleep(espera)
+            enviado = time.perf_counter()
+            escritor.write(requisicoes[i])
+            linha = await leitor.readline()
+            while (await leitor.readline()) not in (b"\r\n", b""):
+                pass
+            latencias.append((time.perf_counter() - enviado) * 1000)
+            codigo = int(linha.split()[1])
+            status[codigo] = status.get(codigo, 0) + 1
+    finally:
+        escritor.close()
+
+
+async def _disparar(args, porta: int):
+    requisicoes = _requisicoes(_carregar_updates(args.updates), args.total, porta, "errado" if args.segredo_errado else SEGREDO)
+    status, latencias = {}, []
+    proxima = iter(range(args.total))
+    inicio = time.perf_counter()
+    await asyncio.gather(*(
+        _cliente(porta, requisicoes, proxima, args.taxa, inicio, status, latencias) for _ in range(args.conexoes)
+    ))
+    duracao = time.perf_counter() - inicio
+    return {
+        "duracao_s": round(duracao, 3),
+        "status": {str(codigo): quantidade for codigo, quantidade in sorted(status.items())},
+        "vazao_enviada_req_s": round(len(latencias) / duracao, 1),
+        "vazao_aceita_updates_s": round(status.get(200, 0) / duracao, 1),
+        "latencia_ms": {
+            "p50": _percentil(latencias, 0.50), "p95": _percentil(latencias, 0.95),
+            "p99": _percentil(latencias, 0.99), "max": round(max(latencias, default=0.0), 3),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de vazão offline do webhook (servidor + fila limitada).")
+    parser.add_argument("--total", type=int, default=20000, help="quantidade de updates enviados")
+    parser.add_argument("--conexoes", type=int, default=40, help="conexões keep-alive simultâneas (o Telegram usa até 100)")
+    parser.add_argument("--taxa", type=float, default=0, help="updates por segundo (0 = o mais rápido possível)")
+    parser.add_argument("--custo-ms", type=float, default=0, help="tempo simulado de processamento de cada update")
+    parser.add_argument("--trabalhadores", type=int, default=256, help="updates processados em paralelo (MAX_UPDATES_CONCORRENTES)")
+    parser.add_argument("--fila-max", type=int, default=1000, help="tamanho da fila de updates (FILA_UPDATES_MAX)")
+    parser.add_argument("--updates", help="arquivo com updates gravados (JSONL, lista JSON ou resposta do getUpdates)")
+    parser.add_argument("--segredo-errado", action="store_true", help="envia um segredo inválido (todas as respostas devem ser 403)")
+    parser.add_argument("--min-vazao", type=float, help="termina com código 1 se a vazão aceita ficar abaixo deste valor")
+    parser.add_argument("--saida", help="grava o relatório JSON também neste arquivo")
+    args = parser.parse_args()
+
+    conexao, conexao_servidor = multiprocessing.Pipe()
+    servidor = multiprocessing.Process(
+        target=_servidor_webhook, args=(args.trabalhadores, args.fila_max, args.custo_ms, conexao_servidor), daemon=True
+    )
+    servidor.start()
+    try:
+        porta = conexao.recv()
+        relatorio = {"parametros": {chave: valor for chave, valor in vars(args).items() if chave != "saida"}}
+        relatorio["clientes"] = asyncio.run(_disparar(args, porta))
+        conexao.send("parar")
+        relatorio["servidor"] = conexao.recv()
+    finally:
+        servidor.terminate()
+
+    texto = json.dumps(relatorio, indent=2, ensure_ascii=False)
+    print(texto)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as arquivo:
+            arquivo.write(texto)
+    if args.min_vazao is not None and relatorio["clientes"]["vazao_aceita_updates_s"] < args.min_vazao:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
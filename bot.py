@@ -1,14 +1,26 @@
 # bot.py (v13.1 - Corrigido e Otimizado)
 import os
 import logging
-import requests
+import time
 from telegram import Update
 from telegram.ext import ApplicationBuilder, MessageHandler, ContextTypes, filters, CommandHandler
 from telegram.constants import ChatAction
 from dotenv import load_dotenv
-from sarah_bot.memoria import init_db, recuperar_ou_criar_cliente, atualizar_cliente, adicionar_mensagem_historico, get_cliente, deletar_cliente
+
+# Antes dos módulos do sarah_bot, que leem as variáveis de ambiente ao serem importados
+load_dotenv()
+
+from sarah_bot.memoria import init_db, abrir_sessao, deletar_cliente
 from sarah_bot.orcamento import gerar_orcamento, formatar_resposta_orcamento, formatar_resposta_orcamento_inicial
-from sarah_bot.vendedora import analisar_mensagem_com_ia, gerar_resposta_sarah, extrair_nome_da_mensagem, extrair_quantidade_da_mensagem
+from sarah_bot.despachante import ordenado_por_usuario
+from sarah_bot import metricas, notificacoes, shard, uso_llm, webhook
+from sarah_bot.notificacoes import notificar_vendedor_humano
+from sarah_bot.pontuacao import eventos_da_mensagem
+from sarah_bot.classificador import classificar_mensagem
+from sarah_bot.resumo import precisa_resumir, agendar_resumo
+from sarah_bot.manutencao import agendar_manutencao
+from sarah_bot.streaming import enviar_resposta_em_stream
+from sarah_bot.vendedora import analisar_mensagem_async, iniciar_geracao_sarah, extrair_nome_async, extrair_quantidade_da_mensagem
 
 
 # --- Configuração de Logging ---
@@ -26,64 +38,28 @@ stream_handler.setFormatter(formatter)
 logger.addHandler(stream_handler)
 
 # --- Carregamento de Variáveis de Ambiente ---
-load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
-GERENTE_CHAT_ID = os.getenv("GERENTE_CHAT_ID")
 LIMITE_LEAD_QUENTE = int(os.getenv("LIMITE_LEAD_QUENTE", 40))
 VIDEO_DEMO_FILE_ID = os.getenv("VIDEO_DEMO_FILE_ID")
+# Quantos updates podem ser processados ao mesmo tempo (usuários diferentes; cada usuário segue em ordem)
+MAX_UPDATES_CONCORRENTES = int(os.getenv("MAX_UPDATES_CONCORRENTES", 256))
+# Gera a resposta do ramo mais provável enquanto a análise da mensagem ainda está rodando
+RESPOSTA_ESPECULATIVA = os.getenv("RESPOSTA_ESPECULATIVA", "1") not in ("0", "false", "False")
+# Mostra a resposta enquanto ela é gerada (mensagem provisória editada aos poucos)
+RESPOSTA_STREAMING = os.getenv("RESPOSTA_STREAMING", "1") not in ("0", "false", "False")
 
-def escape_markdown(text: str) -> str:
-    """
-    Escapa caracteres especiais para o modo MarkdownV2 do Telegram.
-    Isso previne o erro '400 Bad Request' por formatação inválida.
-    """
-    if not isinstance(text, str):
-        return ""
-    # Caracteres que precisam ser escapados no modo MarkdownV2
-    escape_chars = r'_*[]()~`>#+-=|{}.!'
-    return "".join(f'\\{char}' if char in escape_chars else char for char in text)
-
-def notificar_vendedor_humano(cliente, motivo="LEAD QUENTE"):
-    """Envia uma notificação formatada e segura para o gerente."""
-    if not GERENTE_CHAT_ID:
-        logger.warning("GERENTE_CHAT_ID não definido. Não é possível enviar alerta.")
-        return
-        
-    titulo = "🔥 ALERTA DE LEAD QUENTE\\! 🔥"
-    acao_recomendada = "Ação recomendada: Entrar em contato com o cliente\\."
-    if motivo == "FECHAMENTO":
-        titulo = "✅ CLIENTE PRONTO PARA FECHAR\\! ✅"
-        acao_recomendada = "Ação recomendada: Entrar em contato IMEDIATAMENTE para finalizar o contrato\\."
-
-    # Usando escape_markdown para garantir que a mensagem não quebre
-    nome_cliente = escape_markdown(cliente.get('nome', 'N/A'))
-    nome_fazenda = escape_markdown(cliente.get('nome_fazenda', 'N/A'))
-    localizacao = escape_markdown(cliente.get('localizacao', 'N/A'))
-    dor_mencionada = escape_markdown(cliente.get('dor_mencionada', 'Não informada'))
-    tags_str = escape_markdown(", ".join(cliente.get('tags_detectadas', [])))
-
-    # A construção da mensagem agora usa as strings corrigidas
-    mensagem = (
-        f"*{titulo}*\n\n"
-        f"👤 *Cliente:* {nome_cliente} \\(ID: {cliente.get('user_id')}\\)\n"
-        f"🏡 *Propriedade:* {nome_fazenda} em {localizacao}\n"
-        f"⭐ *Score:* {cliente.get('lead_score')}\n"
-        f"🎯 *Tags:* `{tags_str}`\n"
-        f"😟 *Principal Dor:* {dor_mencionada}\n\n"
-        f"_{acao_recomendada}_"
-    )
+_estatisticas_especulacao = {"acertos": 0, "erros": 0, "latencia_economizada_s": 0.0}
 
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-    payload = {"chat_id": GERENTE_CHAT_ID, "text": mensagem, "parse_mode": "MarkdownV2"}
-    try:
-        response = requests.post(url, json=payload, timeout=10)
-        response.raise_for_status()
-        logger.info(f"Alerta de '{motivo}' enviado com sucesso para o cliente {cliente.get('user_id')}")
-    except requests.exceptions.RequestException as e:
-        error_details = e.response.json() if e.response else str(e)
-        logger.error(f"Falha ao enviar notificação de '{motivo}': {e} - Detalhes: {error_details}")
+def obter_estatisticas_especulacao():
+    """Quantas vezes a resposta especulativa foi aproveitada e quanto tempo isso economizou."""
+    total = _estatisticas_especulacao["acertos"] + _estatisticas_especulacao["erros"]
+    return {
+        **_estatisticas_especulacao,
+        "taxa_acerto": _estatisticas_especulacao["acertos"] / total if total else 0.0,
+    }
 
 
+@ordenado_por_usuario
 async def reset_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     logger.info(f"Recebido comando /reset do usuário {user_id}. Apagando dados.")
@@ -93,21 +69,43 @@ async def reset_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Hmm, parece que não consegui encontrar seu registro para apagar ou ocorreu um erro.")
 
 
+@ordenado_por_usuario
+@metricas.rastrear_update
 async def responder(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # --- CORREÇÃO 1: Impede o bot de travar com atualizações sem texto ---
     if not update.message or not update.message.text:
         logger.warning("Recebida uma atualização sem texto de mensagem. Ignorando.")
         return
 
+    inicio_update = time.monotonic()
     user_id = update.effective_user.id
     mensagem_usuario = update.message.text
     nome_telegram = update.effective_user.first_name
 
-    cliente = recuperar_ou_criar_cliente(str(user_id), nome_telegram)
-    adicionar_mensagem_historico(str(user_id), "user", mensagem_usuario)
-    
+    # Unidade de trabalho: o cliente é carregado uma vez e as alterações são gravadas juntas
+    sessao = abrir_sessao(str(user_id), nome_telegram)
+    sessao.adicionar_mensagem("user", mensagem_usuario)
+    try:
+        await _conduzir_conversa(update, context, sessao, inicio_update)
+    finally:
+        # Mesmo com erro no meio do caminho (IA, Telegram), a mensagem do cliente e o que já foi feito ficam gravados
+        sessao.salvar()
+
+    # Conversa longa: as mensagens antigas viram resumo em segundo plano, sem atrasar a resposta
+    if precisa_resumir(sessao.cliente):
+        agendar_resumo(user_id)
+
+
+async def _conduzir_conversa(update: Update, context: ContextTypes.DEFAULT_TYPE, sessao, inicio_update: float):
+    user_id = update.effective_user.id
+    mensagem_usuario = update.message.text
+    cliente = sessao.cliente
     estado_atual = cliente.get("estado_conversa")
-    resposta_bot = ""
+    metricas.rotular_update(estado=estado_atual)
+    # Custos e tempos da IA deste update ficam na conta do cliente e do estado em que a conversa estava
+    uso_llm.atribuir(user_id, estado_atual)
+    resposta_bot = ""  # texto fixo da resposta (ou o início dela, quando a IA completa o restante)
+    geracao = None  # resposta da IA em andamento
     enviar_video = False
     dados_para_atualizar = {}
     analise_ia = {} # Inicializa a análise da IA
@@ -120,26 +118,62 @@ async def responder(update: Update, context: ContextTypes.DEFAULT_TYPE):
         dados_para_atualizar['estado_conversa'] = 'AGUARDANDO_NOME'
 
     elif estado_atual == 'AGUARDANDO_NOME':
-        nome_cliente = extrair_nome_da_mensagem(mensagem_usuario) or mensagem_usuario.strip().title()
+        with metricas.medir("etapa", etapa="extrair_nome"):
+            nome_cliente = await extrair_nome_async(mensagem_usuario) or mensagem_usuario.strip().title()
         logger.info(f"Cliente (ID: {user_id}) informou o nome: {nome_cliente}")
         dados_para_atualizar.update({'nome': nome_cliente, 'estado_conversa': 'AGUARDANDO_DOR'})
         cliente_temp = {**cliente, **dados_para_atualizar}
-        resposta_bot = gerar_resposta_sarah(mensagem_usuario, cliente_temp, 'AGUARDANDO_DOR', cliente['historico_conversa'])
+        geracao = iniciar_geracao_sarah(mensagem_usuario, cliente_temp, 'AGUARDANDO_DOR', cliente['historico_conversa'], RESPOSTA_STREAMING)
 
     elif estado_atual == 'AGUARDANDO_DOR':
         logger.info(f"Cliente (ID: {user_id}) descreveu sua dor/preocupação: '{mensagem_usuario}'")
         dados_para_atualizar.update({'dor_mencionada': mensagem_usuario, 'estado_conversa': 'CONFIRMANDO_INTERESSE'})
-        resposta_bot = gerar_resposta_sarah(mensagem_usuario, cliente, 'CONFIRMANDO_INTERESSE', cliente['historico_conversa'])
+        geracao = iniciar_geracao_sarah(mensagem_usuario, cliente, 'CONFIRMANDO_INTERESSE', cliente['historico_conversa'], RESPOSTA_STREAMING)
     
     else:
         # --- FLUXO DINÂMICO PÓS-QUALIFICAÇÃO ---
-        cliente = get_cliente(str(user_id))
-        analise_ia = analisar_mensagem_com_ia(mensagem_usuario, cliente.get("historico_conversa", []))
+        cliente = sessao.cliente
+        historico = cliente['historico_conversa']
+        confirmou_interesse = "sim" in mensagem_usuario.lower() and estado_atual == 'CONFIRMANDO_INTERESSE'
+
+        # Especulação: enquanto a IA classifica a mensagem, já gera a resposta do ramo mais provável
+        # (o estado atual). Se as tags levarem a outro ramo, a geração é cancelada e refeita.
+        estado_previsto = 'APRESENTANDO_SOLUCAO' if confirmou_interesse else estado_atual
+        especulacao = None
+        # Classificada uma vez só: o mesmo resultado decide a especulação e vai para a análise
+        classificacao_local = classificar_mensagem(mensagem_usuario, estado_atual)
+        if RESPOSTA_ESPECULATIVA and not classificacao_local["confiante"]:
+            especulacao = iniciar_geracao_sarah(mensagem_usuario, cliente, estado_previsto, historico, RESPOSTA_STREAMING)
+
+        inicio_analise = time.monotonic()
+        with metricas.medir("etapa", etapa="analise", estado=estado_atual):
+            analise_ia = await analisar_mensagem_async(mensagem_usuario, historico, estado_atual, cliente.get('resumo_conversa'), classificacao_local)
+        duracao_analise = time.monotonic() - inicio_analise
         tags_da_mensagem_atual = set(analise_ia.get("tags_relevantes", []))
+
+        def descartar_especulacao():
+            nonlocal especulacao
+            if especulacao is not None:
+                especulacao.cancelar()
+                especulacao = None
+                _estatisticas_especulacao["erros"] += 1
+                logger.info(f"Especulação descartada para o cliente {user_id}: as tags {sorted(tags_da_mensagem_atual)} mudaram o ramo.")
+
+        def iniciar_resposta(estado, pergunta=mensagem_usuario):
+            nonlocal especulacao
+            if especulacao is not None and estado == estado_previsto and pergunta == mensagem_usuario:
+                aproveitada, especulacao = especulacao, None
+                economia = min(duracao_analise, aproveitada.duracao())
+                _estatisticas_especulacao["acertos"] += 1
+                _estatisticas_especulacao["latencia_economizada_s"] += economia
+                logger.info(f"Especulação aproveitada para o cliente {user_id} ({estado}): {economia:.2f}s economizados.")
+                return aproveitada
+            descartar_especulacao()
+            return iniciar_geracao_sarah(pergunta, cliente, estado, historico, RESPOSTA_STREAMING)
         
-        if "sim" in mensagem_usuario.lower() and estado_atual == 'CONFIRMANDO_INTERESSE':
+        if confirmou_interesse:
             dados_para_atualizar['estado_conversa'] = 'APRESENTANDO_SOLUCAO'
-            resposta_bot = gerar_resposta_sarah(mensagem_usuario, cliente, 'APRESENTANDO_SOLUCAO', cliente['historico_conversa'])
+            geracao = iniciar_resposta('APRESENTANDO_SOLUCAO')
             if not cliente.get('video_enviado'):
                 enviar_video = True
                 dados_para_atualizar['video_enviado'] = 1
@@ -150,75 +184,126 @@ async def responder(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 qtd_pivos, qtd_bombas = (0, quantidade) if "bomba" in mensagem_usuario.lower() else (quantidade, 0)
                 _, val_eqp, val_inst, total_geral = gerar_orcamento(qtd_pivos, qtd_bombas)
                 resposta_bot = formatar_resposta_orcamento(cliente['nome'], qtd_pivos, qtd_bombas, val_eqp, val_inst, total_geral)
-                resposta_bot += "\n\n" + gerar_resposta_sarah("Ok, enviei o orçamento.", cliente, 'ORCAMENTO_APRESENTADO', cliente['historico_conversa'])
+                geracao = iniciar_resposta('ORCAMENTO_APRESENTADO', "Ok, enviei o orçamento.")
                 dados_para_atualizar.update({'estado_conversa': 'ORCAMENTO_APRESENTADO', 'orcamento_enviado': total_geral})
             else:
                 resposta_bot = formatar_resposta_orcamento_inicial(cliente['nome'])
                 dados_para_atualizar['estado_conversa'] = 'AGUARDANDO_QUANTIDADE_ORCAMENTO'
 
         elif "INTENCAO_ADIAR_DECISAO" in tags_da_mensagem_atual:
-            resposta_bot = gerar_resposta_sarah(mensagem_usuario, cliente, 'INTENCAO_ADIAR_DECISAO', cliente['historico_conversa'])
+            geracao = iniciar_resposta('INTENCAO_ADIAR_DECISAO')
             dados_para_atualizar['estado_conversa'] = 'FOLLOW_UP_POS_ORCAMENTO'
         
         elif "OBJECÃO_PRECO" in tags_da_mensagem_atual:
-            resposta_bot = gerar_resposta_sarah(mensagem_usuario, cliente, 'OBJECÃO_PRECO', cliente['historico_conversa'])
+            geracao = iniciar_resposta('OBJECÃO_PRECO')
         
         elif "INTENCAO_FECHAMENTO" in tags_da_mensagem_atual:
-            resposta_bot = gerar_resposta_sarah(mensagem_usuario, cliente, 'FECHAMENTO', cliente['historico_conversa'])
+            geracao = iniciar_resposta('FECHAMENTO')
             dados_para_atualizar['estado_conversa'] = 'FECHAMENTO'
 
         else: 
-            resposta_bot = gerar_resposta_sarah(mensagem_usuario, cliente, estado_atual, cliente['historico_conversa'])
+            geracao = iniciar_resposta(estado_atual)
+
+        descartar_especulacao()
         
-        tags_acumuladas = list(set(cliente.get("tags_detectadas", [])).union(tags_da_mensagem_atual))
-        dados_para_atualizar.update({"perfil": analise_ia.get("perfil_detectado", cliente.get("perfil")), "tags_detectadas": tags_acumuladas})
+        # A lista de tags do cliente só é regravada quando aparece uma tag nova; as contagens ficam em cliente_tags
+        tags_novas = tags_da_mensagem_atual - set(cliente.get("tags_detectadas", []))
+        if tags_novas:
+            dados_para_atualizar["tags_detectadas"] = list(cliente.get("tags_detectadas", [])) + sorted(tags_novas)
+        perfil = analise_ia.get("perfil_detectado", cliente.get("perfil"))
+        if perfil != cliente.get("perfil"):
+            dados_para_atualizar["perfil"] = perfil
+        sessao.registrar_tags(tags_da_mensagem_atual)
 
-    # --- FINALIZAÇÃO, ENVIO E ATUALIZAÇÃO ---
+    # --- FINALIZAÇÃO, ATUALIZAÇÃO E ENVIO ---
     if dados_para_atualizar:
-        atualizar_cliente(str(user_id), dados_para_atualizar)
-    
-    if resposta_bot:
-        await update.message.reply_text(resposta_bot, parse_mode="Markdown")
-        adicionar_mensagem_historico(str(user_id), "assistant", resposta_bot)
+        sessao.atualizar(dados_para_atualizar)
 
-    if enviar_video and VIDEO_DEMO_FILE_ID:
-        logger.info(f"Enviando vídeo de demonstração para o cliente {user_id}.")
-        await context.bot.send_chat_action(chat_id=update.effective_chat.id, action=ChatAction.UPLOAD_VIDEO)
-        await update.message.reply_video(video=VIDEO_DEMO_FILE_ID, caption="Para ilustrar, veja a robustez do nosso sistema em ação! 💪")
-        adicionar_mensagem_historico(str(user_id), "assistant", "[VÍDEO DE DEMONSTRAÇÃO ENVIADO]")
-    
     # --- LÓGICA DE LEAD SCORE E NOTIFICAÇÃO ---
-    cliente_atualizado = get_cliente(str(user_id))
-    score_anterior = cliente.get('lead_score', 0)
+    cliente_atualizado = sessao.cliente
     
     tags_da_mensagem_atual = set(analise_ia.get("tags_relevantes", []))
-    score_analise = len(tags_da_mensagem_atual) * 5 
-    score_orcamento = 25 if "ORCAMENTO_APRESENTADO" in dados_para_atualizar.get("estado_conversa", "") else 0
-    novo_score = score_anterior + score_analise + score_orcamento
-    if "INTENCAO_FECHAMENTO" in tags_da_mensagem_atual: novo_score += 50
-    
-    if novo_score != score_anterior:
-        atualizar_cliente(str(user_id), {"lead_score": novo_score})
-        cliente_atualizado["lead_score"] = novo_score
+    # Pesos por tag de sarah_bot.config; cada variação vira um evento em lead_score_eventos
+    orcamento_apresentado = "ORCAMENTO_APRESENTADO" in dados_para_atualizar.get("estado_conversa", "")
+    eventos_score = eventos_da_mensagem(tags_da_mensagem_atual, orcamento_apresentado)
+    sessao.registrar_eventos_score(eventos_score)
 
     # --- CORREÇÃO 2: Lógica de notificação para evitar duplicatas ---
     notificacao_ja_enviada = cliente_atualizado.get('notificacao_enviada', 0)
 
+    # Os alertas só entram na fila aqui; o envio ao gerente acontece em segundo plano
     if "INTENCAO_FECHAMENTO" in tags_da_mensagem_atual:
         notificar_vendedor_humano(cliente_atualizado, motivo="FECHAMENTO")
     elif cliente_atualizado.get('lead_score', 0) >= LIMITE_LEAD_QUENTE and not notificacao_ja_enviada:
         notificar_vendedor_humano(cliente_atualizado, motivo="LEAD QUENTE")
         # Marca que a notificação foi enviada para não repetir
-        atualizar_cliente(str(user_id), {"notificacao_enviada": 1})
+        sessao.atualizar({"notificacao_enviada": 1})
+
+    # Mensagem do cliente, estado, tags e score ficam gravados antes de qualquer envio ao Telegram:
+    # se o envio falhar, a próxima mensagem não roda contra um estado velho
+    sessao.salvar()
+
+    # Inclui a espera pela IA; o tempo das chamadas ao Telegram fica no histograma "telegram"
+    with metricas.medir("etapa", etapa="resposta", estado=estado_atual, ia=geracao is not None):
+        if geracao is not None and RESPOSTA_STREAMING:
+            # Só o texto final vai para o histórico, não as versões parciais exibidas durante o stream
+            resposta_bot = await enviar_resposta_em_stream(update, context, geracao, prefixo=resposta_bot, inicio=inicio_update)
+            sessao.adicionar_mensagem("assistant", resposta_bot)
+        else:
+            if geracao is not None:
+                texto_gerado = await geracao.texto()
+                resposta_bot = f"{resposta_bot}\n\n{texto_gerado}" if resposta_bot else texto_gerado
+            if resposta_bot:
+                with metricas.medir("telegram", operacao="enviar"):
+                    await update.message.reply_text(resposta_bot, parse_mode="Markdown")
+                sessao.adicionar_mensagem("assistant", resposta_bot)
+
+    if enviar_video and VIDEO_DEMO_FILE_ID:
+        logger.info(f"Enviando vídeo de demonstração para o cliente {user_id}.")
+        await context.bot.send_chat_action(chat_id=update.effective_chat.id, action=ChatAction.UPLOAD_VIDEO)
+        with metricas.medir("telegram", operacao="video"):
+            await update.message.reply_video(video=VIDEO_DEMO_FILE_ID, caption="Para ilustrar, veja a robustez do nosso sistema em ação! 💪")
+        sessao.adicionar_mensagem("assistant", "[VÍDEO DE DEMONSTRAÇÃO ENVIADO]")
+
+
+async def _ao_iniciar(application):
+    await notificacoes.iniciar(application.bot)
+
+
+async def _ao_encerrar(application):
+    await notificacoes.encerrar()
+    uso_llm.descarregar()
+
+
+def criar_aplicacao(com_updater: bool = True):
+    """Application com os handlers e as rotinas agendadas. Sem Updater, os updates vêm do webhook ou da entrada dos shards."""
+    builder = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(MAX_UPDATES_CONCORRENTES)
+        .post_init(_ao_iniciar)
+        .post_shutdown(_ao_encerrar)
+    )
+    if not com_updater:
+        builder.updater(None)
+    app = builder.build()
+    # Decaimento de score e follow-ups rodam aqui mesmo, só para os clientes com ação vencida
+    agendar_manutencao(app)
+    uso_llm.agendar_consolidacao(app)
+    app.add_handler(CommandHandler("reset", reset_command))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, responder))
+    return app
 
 
 if __name__ == "__main__":
     init_db()
+    metricas.iniciar_servidor()
     logger.info("🤖 Sarah Bot (v13.1 - Corrigido e Otimizado) está no ar!")
     if not BOT_TOKEN:
         logger.critical("BOT_TOKEN não encontrado! Verifique o arquivo .env.")
+    elif shard.ATIVO:
+        shard.rodar(criar_aplicacao, BOT_TOKEN)
+    elif webhook.ATIVO:
+        webhook.rodar(criar_aplicacao(com_updater=False))
     else:
-        app = ApplicationBuilder().token(BOT_TOKEN).build()
-        app.add_handler(CommandHandler("reset", reset_command))
-        app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, responder))
-        app.run_polling()
\ No newline at end of file
+        criar_aplicacao().run_polling()
@@ -3,65 +3,164 @@ import streamlit as st
 import pandas as pd
 import sqlite3
 import json
-from collections import Counter
 import plotly.express as px
 import plotly.graph_objects as go
+from datetime import datetime, timedelta
 from wordcloud import WordCloud
-import matplotlib.pyplot as plt
 
 # --- Importação da Configuração Centralizada ---
-from sarah_bot.config import LIMITE_LEAD_QUENTE
+from sarah_bot.config import LIMITE_LEAD_QUENTE, PRECOS_LLM_POR_MILHAO
+from sarah_bot.memoria import (
+    DB_PATH, obter_conexao, obter_historico, contar_tags_por_performance, obter_frequencias_dores, obter_versao_dados,
+    obter_eventos_score,
+)
 
-# Caminho para o banco de dados
-DB_PATH = "data/sarah_bot.db"
+# Consultas agregadas no próprio SQLite (com cache): o painel não carrega a tabela inteira em memória
+def _consultar(sql: str, params: tuple = ()) -> pd.DataFrame:
+    return pd.read_sql_query(sql, obter_conexao(), params=params)
+
+ERROS_BANCO = (sqlite3.OperationalError, pd.io.sql.DatabaseError)
+
+def _avisar_banco_desatualizado():
+    # Banco criado por uma versão anterior do bot: as tabelas novas só aparecem depois do init_db()
+    st.warning(f"O banco em '{DB_PATH}' ainda não tem todas as tabelas deste painel. Rode o bot.py uma vez para atualizá-lo.")
 
-# Função para carregar os dados (com cache para performance)
 @st.cache_data(ttl=60)
-def carregar_dados():
+def carregar_metricas():
     try:
-        conn = sqlite3.connect(DB_PATH, uri=True, check_same_thread=False)
-        df = pd.read_sql_query("SELECT * FROM clientes", conn)
-        conn.close()
-        # Converte colunas JSON e trata valores nulos/inválidos
-        df['historico_conversa'] = df['historico_conversa'].apply(lambda x: json.loads(x) if isinstance(x, str) else [])
-        df['tags_detectadas'] = df['tags_detectadas'].apply(lambda x: json.loads(x) if isinstance(x, str) else [])
-        df['lead_score_historico'] = df['lead_score_historico'].apply(lambda x: json.loads(x) if isinstance(x, str) else [])
-        df['dor_mencionada'] = df['dor_mencionada'].fillna('')
-        df['etapa_jornada'] = df['etapa_jornada'].fillna('DESCONHECIDA')
-        return df
-    except (sqlite3.OperationalError, pd.io.sql.DatabaseError):
+        return _consultar(
+            "SELECT COUNT(*) AS total_leads, COALESCE(SUM(lead_score >= ?), 0) AS leads_quentes, "
+            "COALESCE(SUM(orcamento_enviado > 0), 0) AS orcamentos_enviados, COALESCE(AVG(lead_score), 0) AS score_medio FROM clientes",
+            (LIMITE_LEAD_QUENTE,),
+        ).iloc[0].to_dict()
+    except ERROS_BANCO:
         st.error(f"Banco de dados não encontrado ou corrompido em '{DB_PATH}'. Rode o bot.py primeiro para criá-lo e gerar dados.")
+        return {"total_leads": 0}
+
+@st.cache_data(ttl=60)
+def carregar_funil():
+    try:
+        df = _consultar("SELECT estado_conversa, COUNT(*) AS quantidade FROM clientes GROUP BY estado_conversa")
+    except ERROS_BANCO:
+        _avisar_banco_desatualizado()
+        return {}
+    return dict(zip(df['estado_conversa'], df['quantidade']))
+
+@st.cache_data(ttl=60)
+def carregar_tags_por_performance():
+    # Agregado direto da tabela cliente_tags (quantos clientes tiveram cada tag, quentes vs. frios)
+    try:
+        linhas = contar_tags_por_performance(LIMITE_LEAD_QUENTE)
+    except ERROS_BANCO:
+        _avisar_banco_desatualizado()
+        linhas = []
+    df = pd.DataFrame(linhas, columns=['tag', 'tipo', 'clientes', 'ocorrencias'])
+    return df.rename(columns={'tag': 'Tag', 'tipo': 'Tipo', 'clientes': 'Ocorrências'})
+
+MAX_PONTOS_SCORE = 300
+
+PERIODOS_DORES = {"Todo o período": None, "Últimos 7 dias": 7, "Últimos 30 dias": 30, "Últimos 90 dias": 90}
+
+@st.cache_data(ttl=60)
+def carregar_localizacoes():
+    df = _consultar("SELECT DISTINCT localizacao FROM clientes WHERE localizacao IS NOT NULL AND localizacao != '' ORDER BY localizacao")
+    return list(df['localizacao'])
+
+# Frequências e imagem dependem só dos filtros, do dia e da versão dos dados (muda quando uma dor nova é gravada)
+@st.cache_data(max_entries=64)
+def gerar_nuvem_dores(dias, localizacao, versao, hoje):
+    desde = datetime.combine(hoje - timedelta(days=dias), datetime.min.time()) if dias else None
+    try:
+        frequencias = obter_frequencias_dores(desde, localizacao)
+    except ERROS_BANCO:
+        _avisar_banco_desatualizado()
+        return None
+    if not frequencias:
+        return None
+    return WordCloud(width=800, height=400, background_color='white').generate_from_frequencies(frequencias).to_array()
+
+def versao_dores() -> int:
+    try:
+        return obter_versao_dados("dor_termos")
+    except ERROS_BANCO:
+        return 0
+
+@st.cache_data(ttl=60)
+def carregar_lista_leads(filtro_nome: str = "", limite: int = 500):
+    """Projeção leve para o seletor de leads: só id, nome e score, já filtrada e ordenada no banco."""
+    return _consultar(
+        "SELECT user_id, nome, lead_score FROM clientes WHERE nome LIKE ? ORDER BY lead_score DESC LIMIT ?",
+        (f"%{filtro_nome}%", limite),
+    )
+
+def _com_custo(df: pd.DataFrame) -> pd.DataFrame:
+    """Acrescenta a coluna `custo` (US$) pela tabela de preços; modelos fora da tabela ficam com custo 0."""
+    precos = df['modelo'].map(lambda modelo: PRECOS_LLM_POR_MILHAO.get(modelo, (0.0, 0.0)))
+    df['custo'] = (df['tokens_prompt'] * precos.str[0] + df['tokens_resposta'] * precos.str[1]) / 1_000_000
+    return df
+
+@st.cache_data(ttl=60)
+def carregar_uso_llm_diario():
+    # Agregado por dia, modelo, estado da conversa e operação, mantido pelo bot (tabela uso_llm_diario)
+    try:
+        df = _consultar(
+            "SELECT dia, modelo, estado, operacao, chamadas, erros, acertos_cache, tokens_prompt, tokens_resposta, "
+            "ms_total, ms_max FROM uso_llm_diario"
+        )
+    except ERROS_BANCO:
+        _avisar_banco_desatualizado()
         return pd.DataFrame()
+    return _com_custo(df)
+
+@st.cache_data(ttl=60)
+def carregar_uso_llm_por_lead():
+    return _com_custo(_consultar(
+        "SELECT u.user_id, c.nome, c.lead_score, COALESCE(c.orcamento_enviado, 0) AS orcamento_enviado, u.modelo, u.chamadas, "
+        "u.tokens_prompt, u.tokens_resposta FROM uso_llm_cliente u LEFT JOIN clientes c ON c.user_id = u.user_id"
+    ))
+
+def carregar_lead(user_id: str):
+    """Um único cliente, buscado só quando ele é selecionado."""
+    df = _consultar(
+        "SELECT user_id, nome, estado_conversa, perfil, lead_score, COALESCE(orcamento_enviado, 0) AS orcamento_enviado, localizacao, nome_fazenda, "
+        "tags_detectadas FROM clientes WHERE user_id = ?",
+        (user_id,),
+    )
+    if df.empty:
+        return None
+    cliente = df.iloc[0].to_dict()
+    cliente['tags_detectadas'] = json.loads(cliente['tags_detectadas']) if isinstance(cliente['tags_detectadas'], str) else []
+    return cliente
 
 # Layout da página
 st.set_page_config(layout="wide", page_title="Sarah's Sales Dashboard")
 st.title("🤖 Painel de Inteligência de Vendas da Sarah")
 st.markdown("Análise estratégica de leads, funil de vendas e performance da conversação.")
 
-df_clientes = carregar_dados()
+metricas = carregar_metricas()
 
-if df_clientes.empty:
+if not metricas['total_leads']:
     st.warning("Nenhum dado de cliente para exibir. Interaja com o bot para gerar dados.")
 else:
-    tab1, tab2 = st.tabs(["📊 Análise Estratégica", "💬 Visualizador de Leads"])
+    tab1, tab2, tab3 = st.tabs(["📊 Análise Estratégica", "💬 Visualizador de Leads", "💰 Custos da IA"])
 
     with tab1:
         st.header("📈 Métricas Principais")
         col1, col2, col3, col4 = st.columns(4)
-        total_leads = len(df_clientes)
-        leads_quentes = df_clientes[df_clientes['lead_score'] >= LIMITE_LEAD_QUENTE].shape[0]
-        orcamentos_enviados = df_clientes[df_clientes['orcamento_enviado'] > 0].shape[0]
+        total_leads = int(metricas['total_leads'])
+        leads_quentes = int(metricas['leads_quentes'])
+        orcamentos_enviados = int(metricas['orcamentos_enviados'])
 
         col1.metric("Total de Leads", total_leads)
         col2.metric(f"Leads Quentes (Score >= {LIMITE_LEAD_QUENTE})", f"{leads_quentes} ({leads_quentes/total_leads:.1%})")
         col3.metric("Orçamentos Enviados", f"{orcamentos_enviados} ({orcamentos_enviados/total_leads:.1%})")
-        col4.metric("Lead Score Médio", f"{df_clientes['lead_score'].mean():.2f}")
+        col4.metric("Lead Score Médio", f"{metricas['score_medio']:.2f}")
 
         st.divider()
         st.header("- Funil de Vendas")
         
         estados_funil = ['INICIANTE', 'AGUARDANDO_DOR', 'CONFIRMANDO_INTERESSE', 'ORCAMENTO_APRESENTADO', 'FECHAMENTO']
-        contagem_estados = df_clientes['estado_conversa'].value_counts()
+        contagem_estados = carregar_funil()
         valores_funil = [contagem_estados.get(estado, 0) for estado in estados_funil]
         
         fig_funil = go.Figure(go.Funnel(
@@ -79,25 +178,20 @@ else:
 
         with col_dor:
             st.header("😟 Principais Dores dos Clientes")
-            texto_dores = ' '.join(df_clientes['dor_mencionada'].dropna())
-            if texto_dores:
-                wordcloud = WordCloud(width=800, height=400, background_color='white').generate(texto_dores)
-                fig_wc, ax = plt.subplots()
-                ax.imshow(wordcloud, interpolation='bilinear')
-                ax.axis('off')
-                st.pyplot(fig_wc)
+            filtro_periodo, filtro_regiao = st.columns(2)
+            periodo = filtro_periodo.selectbox("Período", list(PERIODOS_DORES))
+            regiao = filtro_regiao.selectbox("Região", ["Todas"] + carregar_localizacoes())
+            imagem_dores = gerar_nuvem_dores(
+                PERIODOS_DORES[periodo], None if regiao == "Todas" else regiao, versao_dores(), datetime.now().date()
+            )
+            if imagem_dores is not None:
+                st.image(imagem_dores, use_column_width=True)
             else:
                 st.info("Nenhuma dor foi mencionada pelos clientes ainda.")
 
         with col_tags:
             st.header("🎯 Análise de Tags por Performance")
-            tags_quentes = [tag for sublist in df_clientes[df_clientes['lead_score'] >= LIMITE_LEAD_QUENTE]['tags_detectadas'] for tag in sublist]
-            tags_frias = [tag for sublist in df_clientes[df_clientes['lead_score'] < LIMITE_LEAD_QUENTE]['tags_detectadas'] for tag in sublist]
-            
-            df_tags_quentes = pd.DataFrame(Counter(tags_quentes).items(), columns=['Tag', 'Ocorrências']).assign(Tipo='Lead Quente')
-            df_tags_frias = pd.DataFrame(Counter(tags_frias).items(), columns=['Tag', 'Ocorrências']).assign(Tipo='Lead Frio')
-            
-            df_tags_performance = pd.concat([df_tags_quentes, df_tags_frias])
+            df_tags_performance = carregar_tags_por_performance()
             
             fig_tags = px.bar(df_tags_performance, x='Tag', y='Ocorrências', color='Tipo', title='Frequência de Tags (Leads Quentes vs. Frios)', barmode='group')
             st.plotly_chart(fig_tags, use_container_width=True)
@@ -107,44 +201,104 @@ else:
         st.header("🗣️ Análise de Leads Individuais")
         
         filtro_nome = st.text_input("Buscar lead por nome...")
-        df_filtrado = df_clientes
-        if filtro_nome:
-            df_filtrado = df_clientes[df_clientes['nome'].str.contains(filtro_nome, case=False, na=False)]
+        df_leads = carregar_lista_leads(filtro_nome)
+        nomes_por_id = dict(zip(df_leads['user_id'], df_leads['nome']))
 
-        lista_clientes = df_filtrado.sort_values('lead_score', ascending=False)['nome'].unique()
-        cliente_selecionado_nome = st.selectbox("Selecione um Cliente", lista_clientes)
-        
-        if cliente_selecionado_nome:
-            cliente_data = df_filtrado[df_filtrado['nome'] == cliente_selecionado_nome].iloc[0].to_dict()
+        cliente_selecionado_id = st.selectbox(
+            "Selecione um Cliente", list(nomes_por_id), format_func=lambda user_id: f"{nomes_por_id[user_id]} ({user_id})"
+        )
+        cliente_data = carregar_lead(cliente_selecionado_id) if cliente_selecionado_id else None
+
+        if cliente_data:
             
             st.subheader(f"Detalhes de {cliente_data['nome']}")
             c1, c2, c3, c4 = st.columns(4)
             c1.info(f"**Estado da Conversa:** {cliente_data['estado_conversa']}")
             c2.warning(f"**Perfil Detectado:** {cliente_data['perfil']}")
             c3.error(f"**Lead Score:** {cliente_data['lead_score']}")
-            c4.success(f"**Etapa da Jornada:** {cliente_data.get('etapa_jornada', 'N/A')}")
+            c4.success(f"**Orçamento Enviado:** R$ {cliente_data['orcamento_enviado']:,.2f}")
             
             st.write(f"**📍 Localização:** `{cliente_data.get('localizacao') or 'Não informada'}`")
             st.write(f"**🏡 Fazenda:** `{cliente_data.get('nome_fazenda') or 'Não informada'}`")
             st.write(f"**🎯 Tags:** `{', '.join(cliente_data.get('tags_detectadas', []))}`")
             
             st.subheader("Evolução do Lead Score")
-            historico_score = cliente_data.get('lead_score_historico', [])
+            # Leads antigos têm muitos eventos: o gráfico recebe no máximo MAX_PONTOS_SCORE pontos
+            try:
+                historico_score = obter_eventos_score(cliente_data['user_id'], max_pontos=MAX_PONTOS_SCORE)
+            except ERROS_BANCO:
+                _avisar_banco_desatualizado()
+                historico_score = []
             
-            if historico_score and isinstance(historico_score, list) and len(historico_score) > 1:
+            if len(historico_score) > 1:
                 df_score = pd.DataFrame(historico_score)
-                df_score['timestamp'] = pd.to_datetime(df_score['timestamp'])
+                df_score['ts'] = pd.to_datetime(df_score['ts'])
                 
-                fig_score = px.line(df_score, x='timestamp', y='score', title='Linha do Tempo do Score do Lead', markers=True)
+                fig_score = px.line(df_score, x='ts', y='new_score', hover_data=['reason', 'delta'], title='Linha do Tempo do Score do Lead', markers=True)
                 fig_score.update_layout(xaxis_title='Data', yaxis_title='Lead Score')
                 st.plotly_chart(fig_score, use_container_width=True)
             else:
                 st.info("Não há dados históricos de score suficientes para gerar um gráfico.")
 
             st.subheader("Histórico da Conversa")
-            historico_conversa = cliente_data.get('historico_conversa', [])
+            conversa_completa = st.checkbox("Mostrar a conversa completa", value=False)
+            try:
+                historico_conversa = obter_historico(cliente_data['user_id'], limite=None if conversa_completa else 100)
+            except ERROS_BANCO:
+                _avisar_banco_desatualizado()
+                historico_conversa = []
             for msg in historico_conversa:
                 role = msg.get("role", "desconhecido")
                 avatar = "👤" if role == 'user' else "🤖"
                 with st.chat_message(name=role, avatar=avatar):
-                    st.write(msg.get('content'))
\ No newline at end of file
+                    st.write(msg.get('content'))
+
+    with tab3:
+        st.header("💰 Custos e Tempos da IA")
+        df_uso = carregar_uso_llm_diario()
+
+        if df_uso.empty:
+            st.info("Ainda não há uso da IA registrado.")
+        else:
+            df_leads_custo = carregar_uso_llm_por_lead()
+            custo_total = df_uso['custo'].sum()
+            leads_atendidos = df_leads_custo['user_id'].nunique()
+            orcamentos = int(metricas['orcamentos_enviados'])
+            chamadas_totais = df_uso['chamadas'].sum()
+
+            c1, c2, c3, c4 = st.columns(4)
+            c1.metric("Custo Total (US$)", f"{custo_total:,.2f}")
+            c2.metric("Custo por Lead (US$)", f"{custo_total / leads_atendidos:,.4f}" if leads_atendidos else "-")
+            c3.metric("Custo por Orçamento (US$)", f"{custo_total / orcamentos:,.4f}" if orcamentos else "-")
+            c4.metric("Acerto do Cache", f"{df_uso['acertos_cache'].sum() / chamadas_totais:.1%}" if chamadas_totais else "-")
+
+            col_estado, col_tempo = st.columns(2)
+            with col_estado:
+                df_estado = df_uso.groupby(['estado', 'modelo'], as_index=False)['custo'].sum()
+                df_estado['estado'] = df_estado['estado'].replace('', 'SEM_ESTADO')
+                fig_estado = px.bar(df_estado, x='estado', y='custo', color='modelo', title='Custo por Estado da Conversa (US$)')
+                st.plotly_chart(fig_estado, use_container_width=True)
+
+            with col_tempo:
+                # Acertos de cache não chamam a IA e ficariam de fora da média de tempo
+                df_tempo = df_uso.groupby(['estado', 'operacao'], as_index=False).agg(
+                    chamadas=('chamadas', 'sum'), acertos_cache=('acertos_cache', 'sum'), ms_total=('ms_total', 'sum'), ms_max=('ms_max', 'max')
+                )
+                df_tempo['estado'] = df_tempo['estado'].replace('', 'SEM_ESTADO')
+                df_tempo = df_tempo[df_tempo['chamadas'] > df_tempo['acertos_cache']]
+                df_tempo['ms_medio'] = df_tempo['ms_total'] / (df_tempo['chamadas'] - df_tempo['acertos_cache'])
+                st.subheader("🐢 Estados Mais Lentos")
+                st.dataframe(
+                    df_tempo.sort_values('ms_medio', ascending=False)[['estado', 'operacao', 'chamadas', 'ms_medio', 'ms_max']].head(15),
+                    use_container_width=True, hide_index=True,
+                )
+
+            df_dia = df_uso.groupby(['dia', 'modelo'], as_index=False)['custo'].sum()
+            fig_dia = px.bar(df_dia, x='dia', y='custo', color='modelo', title='Custo por Dia (US$)')
+            st.plotly_chart(fig_dia, use_container_width=True)
+
+            st.subheader("🏆 Leads com Maior Custo")
+            df_top = df_leads_custo.groupby(['user_id', 'nome', 'lead_score', 'orcamento_enviado'], dropna=False, as_index=False).agg(
+                chamadas=('chamadas', 'sum'), custo=('custo', 'sum')
+            )
+            st.dataframe(df_top.sort_values('custo', ascending=False).head(20), use_container_width=True, hide_index=True)
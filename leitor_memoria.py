@@ -1,9 +1,7 @@
 # leitor_memoria.py
 import sqlite3
-import json
 
-# Caminho do banco de dados corrigido
-DB_PATH = "data/sarah_bot.db"
+from sarah_bot.memoria import get_cliente, obter_historico
 
 def ler_conversa_cliente():
     """Lê e exibe o histórico e os dados de um cliente específico."""
@@ -14,13 +12,7 @@ def ler_conversa_cliente():
         return
 
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-
-        cursor.execute("SELECT * FROM clientes WHERE user_id = ?", (user_id,))
-        cliente = cursor.fetchone()
-        conn.close()
+        cliente = get_cliente(user_id)
 
         if cliente:
             print("\n" + "="*50)
@@ -30,12 +22,11 @@ def ler_conversa_cliente():
             print(f"  - Estado: {cliente['estado_conversa']}")
             print(f"  - Lead Score: {cliente['lead_score']}")
             
-            tags_json = cliente.get('tags_detectadas', '[]')
-            tags_lista = json.loads(tags_json)
+            tags_lista = cliente.get('tags_detectadas') or []
             print(f"  - Tags Detectadas: {tags_lista if tags_lista else 'Nenhuma'}")
             
-            historico_json = cliente.get('historico_conversa', '[]')
-            historico = json.loads(historico_json)
+            # Histórico completo, lido da tabela de mensagens
+            historico = obter_historico(user_id, limite=None)
 
             print("\n" + "="*50)
             print("💬 HISTÓRICO DA CONVERSA")
@@ -56,12 +47,10 @@ def ler_conversa_cliente():
         else:
             print(f"Nenhum cliente encontrado com o ID: {user_id}")
 
-    except (sqlite3.Error, FileNotFoundError) as e:
-        print(f"Erro de banco de dados ou arquivo não encontrado: {e}")
-    except json.JSONDecodeError as e:
-        print(f"Erro ao ler os dados. O formato JSON parece estar corrompido: {e}")
+    except sqlite3.Error as e:
+        print(f"Erro de banco de dados: {e}")
     except Exception as e:
         print(f"Ocorreu um erro inesperado: {e}")
 
 if __name__ == "__main__":
-    ler_conversa_cliente()
\ No newline at end of file
+    ler_conversa_cliente()
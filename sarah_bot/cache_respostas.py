@@ -0,0 +1,150 @@
+# cache_respostas.py
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List
+
+from sarah_bot.memoria import DATA_DIR, obter_conexao
+from sarah_bot import metricas
+
+logger = logging.getLogger(__name__)
+
+# Cache das chamadas determinísticas à IA (temperatura 0, saída JSON): análise de mensagem e extração de nome
+CACHE_LLM_ATIVO = os.getenv("CACHE_LLM_ATIVO", "1") not in ("0", "false", "False")
+CACHE_LLM_DB_PATH = os.path.join(DATA_DIR, "cache_llm.db")
+CACHE_LLM_TTL_SEGUNDOS = float(os.getenv("CACHE_LLM_TTL_SEGUNDOS", 7 * 24 * 3600))
+CACHE_LLM_MAX_MEMORIA = int(os.getenv("CACHE_LLM_MAX_MEMORIA", 5000))
+CACHE_LLM_MAX_DISCO = int(os.getenv("CACHE_LLM_MAX_DISCO", 100000))
+# A limpeza do disco (TTL e tamanho) roda a cada N gravações, não em todas
+_LIMPEZA_A_CADA = 500
+
+_memoria: "OrderedDict[str, tuple]" = OrderedDict()
+_lock = threading.Lock()
+_tabela_criada = False
+_gravacoes_desde_limpeza = 0
+
+_estatisticas = {"acertos_memoria": 0, "acertos_disco": 0, "falhas": 0, "gravacoes": 0, "removidas_disco": 0}
+
+
+def _conexao():
+    global _tabela_criada
+    conn = obter_conexao(CACHE_LLM_DB_PATH)
+    if not _tabela_criada:
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS respostas (
+            chave TEXT PRIMARY KEY,
+            valor TEXT NOT NULL,
+            criado_em REAL NOT NULL
+        )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_respostas_criado_em ON respostas (criado_em)")
+        _tabela_criada = True
+    return conn
+
+
+def _hash(texto: str) -> str:
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+
+def normalizar_mensagem(mensagem: str) -> str:
+    """Normalização leve: minúsculas e espaços simples (acentos e pontuação são preservados)."""
+    return " ".join((mensagem or "").lower().split())
+
+
+def chave_cache(modelo: str, template_prompt: str, mensagem: str, contexto: Optional[List[Dict[str, str]]] = None) -> str:
+    """Chave endereçada pelo conteúdo: modelo + versão do prompt + mensagem normalizada + resumo do contexto."""
+    digest_contexto = _hash(json.dumps(contexto or [], ensure_ascii=False, sort_keys=True))
+    return _hash("\x1f".join([modelo, _hash(template_prompt), normalizar_mensagem(mensagem), digest_contexto]))
+
+
+def _memoria_guardar(chave: str, valor: Dict[str, Any], criado_em: float):
+    with _lock:
+        _memoria[chave] = (criado_em, valor)
+        _memoria.move_to_end(chave)
+        while len(_memoria) > CACHE_LLM_MAX_MEMORIA:
+            _memoria.popitem(last=False)
+
+
+def obter(chave: str) -> Optional[Dict[str, Any]]:
+    """Busca primeiro na memória (LRU) e depois no SQLite; devolve None em caso de falha ou expiração."""
+    if not CACHE_LLM_ATIVO:
+        return None
+    agora = time.time()
+    with _lock:
+        entrada = _memoria.get(chave)
+        if entrada is not None:
+            criado_em, valor = entrada
+            if agora - criado_em <= CACHE_LLM_TTL_SEGUNDOS:
+                _memoria.move_to_end(chave)
+                _estatisticas["acertos_memoria"] += 1
+                return json.loads(json.dumps(valor))
+            del _memoria[chave]
+
+    try:
+        linha = _conexao().execute(
+            "SELECT valor, criado_em FROM respostas WHERE chave = ? AND criado_em >= ?",
+            (chave, agora - CACHE_LLM_TTL_SEGUNDOS),
+        ).fetchone()
+    except Exception as e:
+        logger.warning(f"Falha ao ler o cache de respostas da IA: {e}")
+        linha = None
+
+    if linha is None:
+        _estatisticas["falhas"] += 1
+        return None
+    valor = json.loads(linha[0])
+    _memoria_guardar(chave, valor, linha[1])
+    _estatisticas["acertos_disco"] += 1
+    return json.loads(linha[0])
+
+
+def guardar(chave: str, valor: Dict[str, Any]):
+    """Grava a resposta nos dois níveis do cache."""
+    global _gravacoes_desde_limpeza
+    if not CACHE_LLM_ATIVO:
+        return
+    agora = time.time()
+    _memoria_guardar(chave, json.loads(json.dumps(valor)), agora)
+    try:
+        conn = _conexao()
+        conn.execute(
+            "INSERT OR REPLACE INTO respostas (chave, valor, criado_em) VALUES (?, ?, ?)",
+            (chave, json.dumps(valor, ensure_ascii=False), agora),
+        )
+        _estatisticas["gravacoes"] += 1
+        _gravacoes_desde_limpeza += 1
+        if _gravacoes_desde_limpeza >= _LIMPEZA_A_CADA:
+            _gravacoes_desde_limpeza = 0
+            _limpar_disco(conn, agora)
+    except Exception as e:
+        logger.warning(f"Falha ao gravar no cache de respostas da IA: {e}")
+
+
+def _limpar_disco(conn, agora: float):
+    removidas = conn.execute("DELETE FROM respostas WHERE criado_em < ?", (agora - CACHE_LLM_TTL_SEGUNDOS,)).rowcount
+    excesso = conn.execute("SELECT COUNT(*) FROM respostas").fetchone()[0] - CACHE_LLM_MAX_DISCO
+    if excesso > 0:
+        removidas += conn.execute(
+            "DELETE FROM respostas WHERE chave IN (SELECT chave FROM respostas ORDER BY criado_em LIMIT ?)", (excesso,)
+        ).rowcount
+    _estatisticas["removidas_disco"] += removidas
+
+
+def obter_estatisticas() -> Dict[str, Any]:
+    """Acertos por nível, falhas e taxa de acerto do cache."""
+    acertos = _estatisticas["acertos_memoria"] + _estatisticas["acertos_disco"]
+    consultas = acertos + _estatisticas["falhas"]
+    return {
+        **_estatisticas,
+        "itens_em_memoria": len(_memoria),
+        "taxa_acerto": acertos / consultas if consultas else 0.0,
+    }
+
+
+metricas.registrar_fonte(
+    "cache_llm", obter_estatisticas, contadores=["acertos_memoria", "acertos_disco", "falhas", "gravacoes", "removidas_disco"]
+)
@@ -0,0 +1,192 @@
+# classificador.py
+import logging
+import re
+from typing import Optional, Dict, Any, List, Iterable
+
+from sarah_bot.texto import normalizar_texto
+from sarah_bot import metricas
+
+logger = logging.getLogger(__name__)
+
+# Mensagens mais longas que isso ficam com a IA: o contexto pesa mais que as palavras-chave
+MAX_PALAVRAS_CONFIANTE = 10
+
+# Tags em que a máquina de estados do bot.py se baseia; a concordância com a IA é medida só nelas
+TAGS_DE_DECISAO = {
+    "INTENCAO_ORCAMENTO",
+    "INTENCAO_ADIAR_DECISAO",
+    "OBJECÃO_PRECO",
+    "INTENCAO_FECHAMENTO",
+    "INTENCAO_PEDIR_VIDEO",
+}
+
+# Tags de objeção: quando aparecem, as demais intenções são descartadas (mesma regra do prompt de análise)
+TAGS_DE_OBJECAO = {"OBJECÃO_PRECO", "INTENCAO_ADIAR_DECISAO"}
+
+
+def _compilar(*padroes: str) -> re.Pattern:
+    return re.compile("|".join(f"(?:{p})" for p in padroes))
+
+
+# Tabela de regras aplicada sobre o texto normalizado (minúsculas, sem acentos e sem pontuação)
+REGRAS_INTENCAO = {
+    "OBJECÃO_PRECO": _compilar(
+        r"\b(muito|ta|esta|achei|meio|bem|mt) caro\b",
+        r"^caro$",
+        r"\bsem (dinheiro|grana|verba)\b",
+        r"\bnao tenho (dinheiro|grana|verba|condicoes)\b",
+        r"\bfora do (meu )?orcamento\b",
+        r"\b(puxado|salgado)\b",
+    ),
+    "INTENCAO_ADIAR_DECISAO": _compilar(
+        r"\bvou (pensar|analisar|avaliar)\b",
+        r"\bpreciso (pensar|analisar|conversar|falar|ver com)\b",
+        r"\bdepois (eu )?(vejo|falo|te falo|retorno|te retorno)\b",
+        r"\bmais (pra|para) frente\b",
+        r"\boutra hora\b",
+        r"\bagora nao\b",
+        r"\bproximo (mes|ano)\b",
+    ),
+    "INTENCAO_FECHAMENTO": _compilar(
+        # "fechado" sozinho também descreve portão, galpão...: só conta como resposta curta ou com "negócio"/"então"
+        r"^(ok |ta |esta |entao )?fechado( entao)?$",
+        r"\bnegocio fechado\b",
+        r"\b(ta|esta) fechado entao\b",
+        r"\b(vamos|bora|quero|pode|podemos) fechar\b",
+        r"\bquero (contratar|comprar|instalar)\b",
+        r"\bpode (instalar|mandar o contrato)\b",
+        r"\bmanda o contrato\b",
+        r"\bcomo (faco|faz) (pra|para) (comprar|contratar|pagar)\b",
+    ),
+    "INTENCAO_PEDIR_VIDEO": _compilar(
+        r"\bvideos?\b",
+        r"\bdemonstracao\b",
+        r"\bfilme\b",
+    ),
+    "INTENCAO_ORCAMENTO": _compilar(
+        r"\bquanto (custa|fica|sai|e|vale|cobra)\b",
+        r"\b(precos?|valor|valores|custo|orcamento|cotacao)\b",
+        r"\b\d+ ?(pivos?|bombas?|casas? de bomba|equipamentos?)\b",
+    ),
+    "INTENCAO_EXPLICACAO_SAF": _compilar(
+        r"\bo que e\b",
+        r"\bcomo funciona\b",
+        r"\bme fal[ae] mais\b",
+        r"\bexplica\b",
+    ),
+}
+
+# Palavra de preço solta ("gostei do valor") não é pedido de orçamento: só pergunta/pedido explícito dispensa a IA
+_PEDIDO_ORCAMENTO = _compilar(
+    r"\bquanto (custa|fica|sai|e|vale|cobra)\b",
+    r"\bqual (e )?(o )?(preco|valor|custo)\b",
+    r"\b(quero|queria|gostaria de|preciso de|manda|mande|me passa|pode (mandar|passar|fazer)) (um |o |uma )?(orcamento|cotacao|preco|valor)\b",
+    r"^(precos?|valor|valores|orcamento|cotacao)$",
+    r"\b\d+ ?(pivos?|bombas?|casas? de bomba|equipamentos?)\b",
+)
+
+_SAUDACAO = re.compile(r"^(oi|ola|opa|bom dia|boa tarde|boa noite|e ai|tudo bem|oi tudo bem|ola tudo bem)$")
+_AFIRMACAO = re.compile(r"^(sim|s|claro|pode|pode sim|quero|quero sim|ok|beleza|blz|bora|manda|pode mandar|com certeza|isso|aham|uhum|tenho interesse)$")
+_NEGACAO = re.compile(r"\bnao\b")
+_NUMERO = re.compile(r"\b(\d+)\b")
+_BOMBA = re.compile(r"\bbombas?\b")
+
+_estatisticas = {
+    "mensagens": 0,
+    "decididas_localmente": 0,
+    "enviadas_para_ia": 0,
+    "validacoes": 0,
+    "concordancias": 0,
+}
+
+
+def _negada(texto: str, tag: str) -> bool:
+    """
+    Se há um "não" fora do trecho que disparou a regra: "não achei caro" nega a objeção,
+    já em "não tenho dinheiro" ou "agora não" o "não" faz parte dela.
+    """
+    return bool(_NEGACAO.search(REGRAS_INTENCAO[tag].sub(" ", texto))) if tag in REGRAS_INTENCAO else bool(_NEGACAO.search(texto))
+
+
+def classificar_mensagem(mensagem: str, estado_conversa: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Classificador determinístico que roda antes da IA.
+
+    Retorna {"tags_relevantes": [...], "entidades_extraidas": {...}, "confiante": bool}.
+    Só quando `confiante` é True o resultado pode substituir a análise da IA.
+    """
+    texto = normalizar_texto(mensagem)
+    palavras = texto.split()
+    tags: List[str] = [tag for tag, padrao in REGRAS_INTENCAO.items() if padrao.search(texto)]
+    entidades = {"qtd_pivos": None, "qtd_bombas": None}
+
+    numero = _NUMERO.search(texto)
+    if numero and estado_conversa == "AGUARDANDO_QUANTIDADE_ORCAMENTO" and "INTENCAO_ORCAMENTO" not in tags:
+        tags.append("INTENCAO_ORCAMENTO")
+    if numero and "INTENCAO_ORCAMENTO" in tags:
+        entidades["qtd_bombas" if _BOMBA.search(texto) else "qtd_pivos"] = int(numero.group(1))
+
+    objecoes = [tag for tag in tags if tag in TAGS_DE_OBJECAO]
+    if objecoes:
+        tags = objecoes
+
+    intencoes = [tag for tag in tags if tag in TAGS_DE_DECISAO]
+    confiante = (
+        0 < len(palavras) <= MAX_PALAVRAS_CONFIANTE
+        and len(intencoes) <= 1
+        and not (intencoes and _negada(texto, intencoes[0]))
+    )
+    pediu_orcamento = _PEDIDO_ORCAMENTO.search(texto) or (numero and estado_conversa == "AGUARDANDO_QUANTIDADE_ORCAMENTO")
+    if "INTENCAO_ORCAMENTO" in intencoes and not pediu_orcamento:
+        confiante = False
+
+    if not tags:
+        if _SAUDACAO.match(texto):
+            tags = ["SAUDACAO"]
+        elif _AFIRMACAO.match(texto) and estado_conversa == "CONFIRMANDO_INTERESSE":
+            # "sim" nesse estado já é tratado pela máquina de estados; a IA não acrescentaria nada
+            pass
+        else:
+            confiante = False
+
+    return {"tags_relevantes": tags, "entidades_extraidas": entidades, "confiante": confiante}
+
+
+def tags_de_decisao(tags: Iterable[str]) -> set:
+    return set(tags or []) & TAGS_DE_DECISAO
+
+
+def registrar_decisao(local: bool):
+    _estatisticas["mensagens"] += 1
+    if local:
+        _estatisticas["decididas_localmente"] += 1
+    else:
+        _estatisticas["enviadas_para_ia"] += 1
+
+
+def registrar_concordancia(tags_locais: Iterable[str], tags_ia: Iterable[str]) -> bool:
+    """Compara a decisão local com a da IA (apenas nas tags que mudam o fluxo do bot)."""
+    concorda = tags_de_decisao(tags_locais) == tags_de_decisao(tags_ia)
+    _estatisticas["validacoes"] += 1
+    if concorda:
+        _estatisticas["concordancias"] += 1
+    else:
+        logger.info(f"Classificador local divergiu da IA: local={sorted(tags_de_decisao(tags_locais))} ia={sorted(tags_de_decisao(tags_ia))}")
+    return concorda
+
+
+def obter_estatisticas() -> Dict[str, Any]:
+    """Taxa de mensagens resolvidas sem IA e concordância com a IA nas amostras validadas."""
+    mensagens = _estatisticas["mensagens"]
+    validacoes = _estatisticas["validacoes"]
+    return {
+        **_estatisticas,
+        "taxa_acerto_local": _estatisticas["decididas_localmente"] / mensagens if mensagens else 0.0,
+        "taxa_concordancia": _estatisticas["concordancias"] / validacoes if validacoes else 0.0,
+    }
+
+
+metricas.registrar_fonte(
+    "classificador", obter_estatisticas,
+    contadores=["mensagens", "decididas_localmente", "enviadas_para_ia", "validacoes", "concordancias"],
+)
@@ -32,24 +32,15 @@ MENSALIDADE = float(os.getenv("MENSALIDADE", 150))
 # --- Lógica de Negócio e Lead Scoring ---
 LIMITE_LEAD_QUENTE = int(os.getenv("LIMITE_LEAD_QUENTE", 40))
 
-# Pesos para o cálculo do Lead Score
-TAG_WEIGHTS = {
-    # PESOS POSITIVOS
-    "INTENCAO_FECHAMENTO": 50,
-    "DOR_FURTO_PROPRIO": 25,
-    "PEDIDO_ORCAMENTO": 20,
-    "DOR_INSEGURANCA_REGIAO": 15,
-    "INFORMOU_QUANTIDADE": 10,
-    "OBJECÃO_PRECO": 10,
-    "PEDIDO_INFORMACOES_GERAIS": 5,
-    "PEDIDO_VIDEO": 5,
-    "OBJECÃO_ADIAMENTO": 2,
-    "SAUDACAO": 1,
-    
-    # PESOS NEGATIVOS
-    "APENAS_CURIOSIDADE": -15,
-    "CONCORRENTE_MENCIONADO": -5,
-    "FORA_DE_ESCOPO": -20,
+# Pesos do Lead Score (tabela de tags, peso padrão e pontos do orçamento) ficam em sarah_bot.pontuacao,
+# que o bot importa sem passar pela validação abaixo
+
+# --- Custos da IA ---
+# Preço em US$ por 1 milhão de tokens (prompt, resposta) de cada modelo, usado no painel de custos
+PRECOS_LLM_POR_MILHAO = {
+    "gpt-4o": (5.00, 15.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-3.5-turbo": (0.50, 1.50),
 }
 
 # Validação para garantir que as chaves essenciais foram carregadas
@@ -0,0 +1,84 @@
+# despachante.py
+import asyncio
+import functools
+import logging
+import time
+from typing import Dict, Any, Callable, Awaitable
+
+from sarah_bot import metricas
+
+logger = logging.getLogger(__name__)
+
+# Uma "fila" por usuário: o lock garante a ordem de chegada (asyncio.Lock é FIFO)
+# e o contador de pendentes permite descartar a entrada assim que o usuário fica ocioso.
+_filas: Dict[str, Dict[str, Any]] = {}
+
+_estatisticas = {
+    "updates_processados": 0,
+    "espera_total_s": 0.0,
+    "espera_maxima_s": 0.0,
+    "profundidade_maxima": 0,
+}
+
+
+def _chave_usuario(update) -> str:
+    usuario = getattr(update, "effective_user", None)
+    if usuario is not None:
+        return str(usuario.id)
+    chat = getattr(update, "effective_chat", None)
+    return str(chat.id) if chat is not None else "desconhecido"
+
+
+def ordenado_por_usuario(handler: Callable[..., Awaitable[Any]]):
+    """
+    Envolve um handler do python-telegram-bot para que as mensagens de um mesmo
+    usuário sejam processadas estritamente em ordem, enquanto usuários diferentes
+    rodam em paralelo (requer `concurrent_updates` ligado no ApplicationBuilder).
+    """
+    @functools.wraps(handler)
+    async def _executar(update, context):
+        user_id = _chave_usuario(update)
+        fila = _filas.get(user_id)
+        if fila is None:
+            fila = {"lock": asyncio.Lock(), "pendentes": 0}
+            _filas[user_id] = fila
+
+        fila["pendentes"] += 1
+        if fila["pendentes"] > _estatisticas["profundidade_maxima"]:
+            _estatisticas["profundidade_maxima"] = fila["pendentes"]
+
+        chegada = time.monotonic()
+        try:
+            async with fila["lock"]:
+                espera = time.monotonic() - chegada
+                _estatisticas["updates_processados"] += 1
+                _estatisticas["espera_total_s"] += espera
+                _estatisticas["espera_maxima_s"] = max(_estatisticas["espera_maxima_s"], espera)
+                if espera > 1:
+                    logger.info(f"Update do usuário {user_id} aguardou {espera:.2f}s na fila (pendentes: {fila['pendentes']}).")
+                return await handler(update, context)
+        finally:
+            fila["pendentes"] -= 1
+            # Despejo por ociosidade: ninguém mais aguarda este usuário
+            if fila["pendentes"] == 0 and _filas.get(user_id) is fila:
+                del _filas[user_id]
+
+    return _executar
+
+
+def obter_estatisticas() -> Dict[str, Any]:
+    """Retorna um retrato das filas por usuário e dos tempos de espera acumulados."""
+    processados = _estatisticas["updates_processados"]
+    profundidades = [fila["pendentes"] for fila in _filas.values()]
+    return {
+        "usuarios_ativos": len(_filas),
+        "updates_pendentes": sum(profundidades),
+        "maior_fila_atual": max(profundidades, default=0),
+        "profundidade_maxima": _estatisticas["profundidade_maxima"],
+        "updates_processados": processados,
+        "espera_media_s": _estatisticas["espera_total_s"] / processados if processados else 0.0,
+        "espera_maxima_s": _estatisticas["espera_maxima_s"],
+    }
+
+
+metricas.registrar_fonte("despachante", obter_estatisticas, contadores=["updates_processados"])
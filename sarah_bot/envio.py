@@ -0,0 +1,157 @@
+# envio.py
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Callable
+
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+
+from sarah_bot.limites import parcela
+from sarah_bot.metricas import medir
+
+logger = logging.getLogger(__name__)
+
+# O Telegram aceita por volta de 30 mensagens/s no total e 1 mensagem/s por chat.
+# A taxa vale para o bot inteiro: com SHARD_WORKERS, cada processo usa a sua parte
+ENVIO_TAXA_GLOBAL = float(os.getenv("ENVIO_TAXA_GLOBAL", 25))
+ENVIO_INTERVALO_POR_CHAT_S = float(os.getenv("ENVIO_INTERVALO_POR_CHAT_S", 1.0))
+ENVIO_TRABALHADORES = int(os.getenv("ENVIO_TRABALHADORES", 8))
+ENVIO_MAX_TENTATIVAS = int(os.getenv("ENVIO_MAX_TENTATIVAS", 5))
+# Quantos envios confirmados são gravados no banco de uma vez
+ENVIO_LOTE_DB = int(os.getenv("ENVIO_LOTE_DB", 50))
+
+
+class BaldeDeFichas:
+    """Limitador de taxa (token bucket) compartilhado por todos os trabalhadores do envio."""
+
+    def __init__(self, taxa: float, capacidade: Optional[float] = None):
+        self.taxa = taxa
+        self.capacidade = capacidade or taxa
+        self.fichas = self.capacidade
+        self.atualizado_em = time.monotonic()
+        self.pausado_ate = 0.0
+        self._lock = asyncio.Lock()
+
+    def pausar(self, segundos: float):
+        """Para todos os envios por `segundos` (o Telegram pediu para esperar)."""
+        self.pausado_ate = max(self.pausado_ate, time.monotonic() + segundos)
+        self.fichas = 0.0
+
+    async def retirar(self):
+        async with self._lock:
+            while True:
+                agora = time.monotonic()
+                if agora < self.pausado_ate:
+                    await asyncio.sleep(self.pausado_ate - agora)
+                    continue
+                self.fichas = min(self.capacidade, self.fichas + (agora - self.atualizado_em) * self.taxa)
+                self.atualizado_em = agora
+                if self.fichas >= 1:
+                    self.fichas -= 1
+                    return
+                await asyncio.sleep((1 - self.fichas) / self.taxa)
+
+
+def _registrar_checkpoint(caminho: str, registro: Dict[str, Any]):
+    # Gravado (e sincronizado com o disco) logo após cada envio confirmado, antes de ir para o banco
+    with open(caminho, "a", encoding="utf-8") as arquivo:
+        arquivo.write(json.dumps(registro, ensure_ascii=False) + "\n")
+        arquivo.flush()
+        os.fsync(arquivo.fileno())
+
+
+def reprocessar_checkpoint(caminho: str, persistir: Callable[[List[Dict[str, Any]]], Any]) -> int:
+    """
+    Aplica no banco os envios confirmados que ficaram no checkpoint de uma execução interrompida
+    e apaga o arquivo. `persistir` precisa ser idempotente. Retorna quantos registros havia.
+    """
+    if not os.path.exists(caminho):
+        return 0
+    registros = []
+    with open(caminho, encoding="utf-8") as arquivo:
+        for linha in arquivo:
+            try:
+                registros.append(json.loads(linha))
+            except json.JSONDecodeError:
+                # Última linha cortada por uma queda no meio da escrita
+                logger.warning(f"Linha inválida ignorada no checkpoint {caminho}.")
+    if registros:
+        logger.info(f"Reaplicando {len(registros)} envio(s) confirmados do checkpoint {caminho}.")
+        persistir(registros)
+    os.remove(caminho)
+    return len(registros)
+
+
+async def enviar_mensagens(bot, envios: List[Dict[str, Any]], persistir: Callable[[List[Dict[str, Any]]], Any], checkpoint: Optional[str] = None) -> Dict[str, int]:
+    """
+    Envia as mensagens em paralelo respeitando os limites do Telegram: taxa global (token bucket),
+    intervalo mínimo por chat, número limitado de trabalhadores e novas tentativas em `RetryAfter`.
+
+    Cada envio é um dict com "chat_id" e "texto" (os demais campos são repassados a `persistir`).
+    Os envios confirmados vão para o checkpoint na hora e para o banco em lotes, via `persistir`.
+    """
+    balde = BaldeDeFichas(parcela(ENVIO_TAXA_GLOBAL))
+    fila: asyncio.Queue = asyncio.Queue()
+    for envio in envios:
+        fila.put_nowait(envio)
+    proximo_envio_por_chat: Dict[str, float] = {}
+    confirmados: List[Dict[str, Any]] = []
+    resultado = {"enviados": 0, "falhas": 0, "novas_tentativas": 0}
+
+    def descarregar():
+        if not confirmados:
+            return
+        persistir(list(confirmados))
+        confirmados.clear()
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+    async def enviar(envio: Dict[str, Any]) -> bool:
+        chat_id = str(envio["chat_id"])
+        for tentativa in range(1, ENVIO_MAX_TENTATIVAS + 1):
+            espera_chat = proximo_envio_por_chat.get(chat_id, 0.0) - time.monotonic()
+            if espera_chat > 0:
+                await asyncio.sleep(espera_chat)
+            await balde.retirar()
+            proximo_envio_por_chat[chat_id] = time.monotonic() + ENVIO_INTERVALO_POR_CHAT_S
+            try:
+                with medir("telegram", operacao="follow_up"):
+                    await bot.send_message(chat_id=chat_id, text=envio["texto"])
+                return True
+            except RetryAfter as e:
+                logger.warning(f"Limite do Telegram atingido; pausando os envios por {e.retry_after}s.")
+                balde.pausar(float(e.retry_after))
+            except (BadRequest, Forbidden) as e:
+                # Chat inexistente ou bot bloqueado pelo usuário: repetir não resolve
+                logger.error(f"     ❌ Envio para {chat_id} recusado: {e}")
+                return False
+            except TelegramError as e:
+                logger.warning(f"Falha temporária no envio para {chat_id} (tentativa {tentativa}): {e}")
+                await asyncio.sleep(min(2 ** tentativa, 30))
+            resultado["novas_tentativas"] += 1
+        logger.error(f"     ❌ Envio para {chat_id} desistido após {ENVIO_MAX_TENTATIVAS} tentativas.")
+        return False
+
+    async def trabalhador():
+        while True:
+            try:
+                envio = fila.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            if not await enviar(envio):
+                resultado["falhas"] += 1
+                continue
+            registro = {**envio, "enviado_em": datetime.now().isoformat()}
+            if checkpoint:
+                _registrar_checkpoint(checkpoint, registro)
+            confirmados.append(registro)
+            resultado["enviados"] += 1
+            if len(confirmados) >= ENVIO_LOTE_DB:
+                descarregar()
+
+    await asyncio.gather(*(trabalhador() for _ in range(max(1, min(ENVIO_TRABALHADORES, len(envios))))))
+    descarregar()
+    return resultado
@@ -0,0 +1,127 @@
+# extrator_nome.py
+import re
+from typing import Optional, Tuple, List
+
+from sarah_bot.texto import remover_acentos
+
+# Primeiros nomes mais comuns no Brasil (sem acento, minúsculos), para reconhecer respostas curtas
+NOMES_COMUNS = {
+    "adriana", "adriano", "alessandra", "alex", "alexandre", "aline", "amanda", "ana", "andre", "andrea",
+    "andreia", "angela", "antonio", "arthur", "beatriz", "bruna", "bruno", "caio", "camila", "carla",
+    "carlos", "carolina", "cesar", "claudia", "claudio", "cristiano", "cristina", "daniel", "daniela",
+    "danilo", "davi", "debora", "diego", "diogo", "douglas", "edson", "eduardo", "elaine", "eliane",
+    "elias", "elisa", "emerson", "enzo", "erica", "fabiana", "fabiano", "fabio", "felipe", "fernanda",
+    "fernando", "flavia", "flavio", "francisco", "gabriel", "gabriela", "geraldo", "gilberto", "giovana",
+    "guilherme", "gustavo", "helena", "heitor", "hugo", "igor", "isabel", "isabela", "ivan", "jaqueline",
+    "jefferson", "joana", "joao", "jorge", "jose", "josefa", "juliana", "juliano", "julio", "larissa",
+    "laura", "leandro", "leonardo", "leticia", "lucas", "lucia", "luciana", "luciano", "luis", "luiz",
+    "luiza", "manoel", "manuel", "marcela", "marcelo", "marcia", "marcio", "marco", "marcos", "maria",
+    "mariana", "mario", "marta", "mateus", "matheus", "mauricio", "miguel", "milena", "murilo", "natalia",
+    "nelson", "osvaldo", "otavio", "patricia", "paula", "paulo", "pedro", "rafael", "rafaela", "raimundo",
+    "raquel", "renan", "renata", "renato", "ricardo", "roberta", "roberto", "rodrigo", "rogerio", "ronaldo",
+    "rosa", "rosana", "samuel", "sandra", "sebastiao", "sergio", "silvia", "simone", "sonia", "tatiana",
+    "thiago", "tiago", "valdir", "valeria", "vanessa", "vinicius", "vitor", "vitoria", "wagner", "wellington",
+    "wesley", "willian",
+}
+
+# Palavras que nunca são nome (cumprimentos, respostas curtas, vocabulário do negócio)
+PALAVRAS_NAO_NOME = {
+    "oi", "ola", "opa", "bom", "boa", "dia", "tarde", "noite", "tudo", "bem", "sim", "nao", "ok", "obrigado",
+    "obrigada", "valeu", "certo", "claro", "beleza", "quero", "queria", "quanto", "custa", "preco", "valor",
+    "orcamento", "saf", "sistema", "alarme", "pivo", "pivos", "bomba", "bombas", "fazenda", "sitio", "produtor",
+    "produtora", "agricultor", "fazendeiro", "pecuarista", "gerente", "dono", "dona", "proprietario", "roubo",
+    "furto", "seguranca", "aqui", "eu", "voce", "ele", "ela", "interesse", "interessado", "interessada",
+    "informacao", "informacoes", "video", "ajuda", "duvida", "como", "que", "qual", "quem", "onde", "isso",
+    "esse", "essa", "de", "da", "do", "das", "dos", "e", "o", "a", "um", "uma", "so", "tambem", "mesmo",
+}
+
+# Tratamentos que podem anteceder o nome ("Seu João", "Dona Maria")
+TRATAMENTOS = {"seu", "sr", "sra", "senhor", "senhora", "dona", "dr", "dra", "doutor", "doutora"}
+
+PARTICULAS = {"de", "da", "do", "das", "dos"}
+
+_CUMPRIMENTO_INICIAL = re.compile(
+    r"^\s*(oi|ol[aá]|opa|e a[ií]|bom dia|boa tarde|boa noite|tudo bem)\b[\s,!.?]*", re.IGNORECASE
+)
+_PALAVRA = r"[A-Za-zÀ-ÖØ-öø-ÿ][A-Za-zÀ-ÖØ-öø-ÿ'\-]*"
+
+# Frases que anunciam o nome: o que vem logo depois é, com alta probabilidade, o nome
+_PADROES_APRESENTACAO = [
+    re.compile(rf"\b(?:meu nome [eé]|me chamo|pode(?:m)? (?:me )?chamar de|me chama de|aqui [eé] (?:o|a)|quem fala [eé] (?:o|a)|eu sou (?:o|a)|sou (?:o|a))\s+(?P<nome>{_PALAVRA}(?:\s+{_PALAVRA}){{0,3}})", re.IGNORECASE),
+    re.compile(rf"^(?P<nome>{_PALAVRA}(?:\s+{_PALAVRA}){{0,2}})\s+aqui\b", re.IGNORECASE),
+]
+# "sou X" sem artigo é ambíguo ("sou produtor", "sou de Goiás"): só vale com nome conhecido ou capitalizado
+_PADRAO_SOU = re.compile(rf"\b(?:eu )?sou\s+(?P<nome>{_PALAVRA}(?:\s+{_PALAVRA}){{0,3}})", re.IGNORECASE)
+
+
+def _chave(palavra: str) -> str:
+    return remover_acentos(palavra).lower()
+
+
+def _parece_nome(palavra: str) -> bool:
+    return _chave(palavra) in NOMES_COMUNS or palavra[:1].isupper()
+
+
+def _formatar(palavras: List[str]) -> str:
+    return " ".join(p.lower() if _chave(p) in PARTICULAS else p[:1].upper() + p[1:].lower() for p in palavras)
+
+
+def _recortar_nome(candidato: str, exigir_nome_conhecido: bool) -> Optional[str]:
+    """Pega as palavras que formam o nome e para na primeira que claramente não faz parte dele."""
+    palavras = candidato.split()
+    while palavras and _chave(palavras[0]) in TRATAMENTOS:
+        palavras = palavras[1:]
+    if not palavras or _chave(palavras[0]) in PALAVRAS_NAO_NOME:
+        return None
+    if exigir_nome_conhecido and not _parece_nome(palavras[0]):
+        return None
+
+    nome = [palavras[0]]
+    i = 1
+    while i < len(palavras) and len(nome) < 3:
+        palavra = palavras[i]
+        if _chave(palavra) in PARTICULAS and i + 1 < len(palavras) and palavras[i + 1][:1].isupper():
+            nome += [palavra, palavras[i + 1]]
+            i += 2
+            continue
+        if _chave(palavra) in PALAVRAS_NAO_NOME or not _parece_nome(palavra):
+            break
+        nome.append(palavra)
+        i += 1
+    return _formatar(nome)
+
+
+def extrair_nome_localmente(mensagem: str) -> Tuple[Optional[str], bool]:
+    """
+    Extrai o nome sem IA. Retorna (nome, confiante); quando `confiante` é False,
+    o chamador deve recorrer à IA.
+    """
+    texto = (mensagem or "").strip()
+    if not texto:
+        return None, False
+
+    for padrao in _PADROES_APRESENTACAO:
+        encontrado = padrao.search(texto)
+        if encontrado:
+            nome = _recortar_nome(encontrado.group("nome"), exigir_nome_conhecido=False)
+            return (nome, True) if nome else (None, False)
+
+    encontrado = _PADRAO_SOU.search(texto)
+    if encontrado:
+        nome = _recortar_nome(encontrado.group("nome"), exigir_nome_conhecido=True)
+        return (nome, True) if nome else (None, False)
+
+    # Resposta direta com o nome ("Marcela", "Oi, João Pedro")
+    resto = _CUMPRIMENTO_INICIAL.sub("", texto).strip(" .,!?")
+    palavras = resto.split()
+    while palavras and _chave(palavras[0]) in TRATAMENTOS:
+        palavras = palavras[1:]
+    if 1 <= len(palavras) <= 3 and all(re.fullmatch(_PALAVRA, p) for p in palavras):
+        if any(_chave(p) in PALAVRAS_NAO_NOME - PARTICULAS for p in palavras):
+            return None, False
+        conhecido = _chave(palavras[0]) in NOMES_COMUNS
+        capitalizado = all(p[:1].isupper() or _chave(p) in PARTICULAS for p in palavras) and not resto.isupper()
+        if conhecido or capitalizado:
+            return _formatar(palavras), True
+
+    return None, False
@@ -0,0 +1,11 @@
+# limites.py
+import os
+
+# Processos que atendem as conversas. Com 2 ou mais, um processo de entrada recebe os updates (webhook ou
+# polling) e manda cada cliente sempre para o mesmo processo; 0 ou 1 = tudo num processo só
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", 0))
+
+
+def parcela(limite: float) -> float:
+    """Parte de cada processo num limite que vale para o bot inteiro (taxa do Telegram, concorrência na OpenAI)."""
+    return limite / SHARD_WORKERS if SHARD_WORKERS > 1 else limite
@@ -0,0 +1,158 @@
+# manutencao.py
+import glob
+import logging
+import os
+try:
+    import fcntl
+except ImportError:  # Windows: sem a trava, a execução avulsa confia em quem a roda
+    fcntl = None
+from datetime import datetime, timedelta
+from typing import Dict, Any
+
+from sarah_bot import shard
+from sarah_bot.envio import enviar_mensagens, reprocessar_checkpoint
+from sarah_bot.metricas import cronometrar, medir
+from sarah_bot.memoria import (
+    DATA_DIR,
+    obter_acoes_vencidas,
+    aplicar_decaimento_score,
+    obter_clientes_para_follow_up,
+    registrar_follow_ups_enviados,
+    reagendar_clientes,
+)
+
+logger = logging.getLogger(__name__)
+
+PONTOS_DECAIMENTO_POR_DIA = int(os.getenv("PONTOS_DECAIMENTO_POR_DIA", 2))
+# De quanto em quanto tempo a agenda procura clientes com ação vencida
+MANUTENCAO_INTERVALO_S = float(os.getenv("MANUTENCAO_INTERVALO_S", 60))
+# Máximo de clientes processados por rodada (o restante fica para a próxima)
+MANUTENCAO_LOTE = int(os.getenv("MANUTENCAO_LOTE", 500))
+# Follow-up que não pôde ser enviado (ex.: bot bloqueado) só é tentado de novo depois deste intervalo
+MANUTENCAO_ADIAMENTO_FALHA_S = float(os.getenv("MANUTENCAO_ADIAMENTO_FALHA_S", 3600))
+
+# Envios já confirmados pelo Telegram e ainda não gravados no banco (reaplicados se a rotina cair no meio).
+# Com vários processos de atendimento, cada um tem o seu (follow_up_checkpoint.<índice>.jsonl)
+CHECKPOINT_FOLLOW_UP = os.path.join(DATA_DIR, "follow_up_checkpoint.jsonl")
+# Trava compartilhada pelos processos do bot enquanto estão no ar; a rodada avulsa (follow_up_bot.py) exige exclusividade
+TRAVA_MANUTENCAO = os.path.join(DATA_DIR, "manutencao.lock")
+
+# Mensagens de follow-up mais diretas e curtas
+MSG_FOLLOW_UP = {
+    1: "Olá, {nome}. Aqui é a Sarah, da Irricontrol. Conseguiu analisar a proposta do sistema SAF? Fico à disposição para esclarecer qualquer dúvida.",
+    2: "Olá, {nome}. Nossa agenda de instalação do SAF para sua região está bem movimentada para as próximas semanas. Ainda há interesse em proteger sua operação?",
+}
+
+_checkpoint_verificado = False
+_arquivo_trava = None
+
+
+def _travar(modo: int, esperar: bool = False) -> bool:
+    global _arquivo_trava
+    os.makedirs(DATA_DIR, exist_ok=True)
+    arquivo = open(TRAVA_MANUTENCAO, "a")
+    try:
+        fcntl.flock(arquivo.fileno(), modo if esperar else modo | fcntl.LOCK_NB)
+    except OSError:
+        arquivo.close()
+        return False
+    # Mantida aberta até o fim do processo (o sistema solta a trava se ele cair)
+    _arquivo_trava = arquivo
+    return True
+
+
+def travar_execucao_avulsa() -> bool:
+    """
+    Para a rodada avulsa: False se algum processo do bot estiver no ar. O cache de clientes do bot não veria
+    as escritas da rodada (e as gravaria por cima) e os dois poderiam mandar o mesmo follow-up.
+    """
+    return _travar(fcntl.LOCK_EX) if fcntl else True
+
+
+def _checkpoint_do_processo() -> str:
+    processo = shard.processo_atual()
+    if processo is None:
+        return CHECKPOINT_FOLLOW_UP
+    return CHECKPOINT_FOLLOW_UP.replace(".jsonl", f".{processo[0]}.jsonl")
+
+
+def _checkpoints_a_reprocessar() -> list:
+    """O checkpoint deste processo; o processo 0 também assume os que não têm mais dono."""
+    processo = shard.processo_atual()
+    if processo is None:
+        return [CHECKPOINT_FOLLOW_UP]
+    indice, total = processo
+    caminhos = [_checkpoint_do_processo()]
+    if indice == 0:
+        # Sobras de uma execução com um processo só ou com mais processos do que agora
+        caminhos.append(CHECKPOINT_FOLLOW_UP)
+        prefixo = CHECKPOINT_FOLLOW_UP.replace(".jsonl", ".")
+        for caminho in glob.glob(prefixo + "*.jsonl"):
+            sufixo = caminho[len(prefixo):-len(".jsonl")]
+            if sufixo.isdigit() and int(sufixo) >= total:
+                caminhos.append(caminho)
+    return caminhos
+
+
+@cronometrar("manutencao", etapa="rodada")
+async def executar_manutencao(bot) -> Dict[str, Any]:
+    """
+    Uma rodada da manutenção: só os clientes cuja próxima ação já venceu (pelo índice de
+    `proxima_acao_em`) recebem o decaimento do score e, se for o caso, o follow-up.
+    """
+    global _checkpoint_verificado
+    if not _checkpoint_verificado:
+        # Uma execução anterior interrompida: grava o que já foi enviado antes de escolher os próximos
+        for caminho in _checkpoints_a_reprocessar():
+            reprocessar_checkpoint(caminho, registrar_follow_ups_enviados)
+        _checkpoint_verificado = True
+
+    agora = datetime.now()
+    # Com vários processos de atendimento, cada um cuida só dos próprios clientes (o cache deles é local)
+    vencidos = [user_id for user_id in obter_acoes_vencidas(agora, MANUTENCAO_LOTE) if shard.pertence(user_id)]
+    resultado = {"vencidos": len(vencidos), "decaidos": 0, "follow_ups": 0, "falhas": 0}
+    if not vencidos:
+        return resultado
+
+    with medir("manutencao", etapa="decaimento"):
+        resultado["decaidos"] = aplicar_decaimento_score(vencidos, PONTOS_DECAIMENTO_POR_DIA, agora)
+
+    envios = []
+    for cliente in obter_clientes_para_follow_up(vencidos, agora):
+        nivel = cliente["nivel"]
+        logger.info(f"  -> Cliente {cliente['nome']} ({cliente['user_id']}) qualificado para Follow-up Nível {nivel}.")
+        envio = {"chat_id": cliente["user_id"], "nivel": nivel, "texto": MSG_FOLLOW_UP[nivel].format(nome=cliente['nome'])}
+        if nivel == 2:
+            envio["estado_conversa"] = "FOLLOW_UP_FINALIZADO"
+        envios.append(envio)
+    if envios:
+        with medir("manutencao", etapa="envio_follow_up"):
+            envio_resultado = await enviar_mensagens(bot, envios, registrar_follow_ups_enviados, _checkpoint_do_processo())
+        resultado["follow_ups"] = envio_resultado["enviados"]
+        resultado["falhas"] = envio_resultado["falhas"]
+
+    # Quem ficou com ação vencida (follow-up que falhou) volta para a fila só depois do adiamento
+    reagendar_clientes(vencidos, agora + timedelta(seconds=MANUTENCAO_ADIAMENTO_FALHA_S))
+    logger.info(
+        f"Manutenção: {resultado['vencidos']} clientes vencidos | {resultado['decaidos']} com score reduzido | "
+        f"{resultado['follow_ups']} follow-ups enviados | {resultado['falhas']} falhas"
+    )
+    return resultado
+
+
+async def _rodada_agendada(context):
+    try:
+        await executar_manutencao(context.bot)
+    except Exception as e:
+        logger.error(f"🚨 Erro na rotina de manutenção: {e}", exc_info=True)
+
+
+def agendar_manutencao(application):
+    """Registra a manutenção na job queue da Application (mesmo cliente HTTP e mesmo banco do bot)."""
+    if application.job_queue is None:
+        logger.error('JobQueue indisponível: instale "python-telegram-bot[job-queue]" para rodar follow-up e decaimento no bot.')
+        return
+    if fcntl is not None and _arquivo_trava is None and not _travar(fcntl.LOCK_SH):
+        logger.warning("Rodada avulsa de manutenção (follow_up_bot.py) em andamento; o bot aguarda ela terminar.")
+        _travar(fcntl.LOCK_SH, esperar=True)
+    application.job_queue.run_repeating(_rodada_agendada, interval=MANUTENCAO_INTERVALO_S, first=10, name="manutencao")
@@ -2,17 +2,96 @@
 import sqlite3
 import json
 import os
-from datetime import datetime
-from typing import Optional, Dict, Any, List
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List, Tuple
+
+from sarah_bot.metricas import cronometrar
+from sarah_bot.pontuacao import aplicar_eventos
+from sarah_bot.texto import extrair_termos
 
 # Caminho para o banco de dados
 DATA_DIR = "data"
 DB_PATH = os.path.join(DATA_DIR, "sarah_bot.db")
 
+# Ajustes do SQLite para bot, follow-up e dashboard acessando o mesmo arquivo ao mesmo tempo
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+SQLITE_CACHE_KB = int(os.getenv("SQLITE_CACHE_KB", 16384))
+
+# Quantas mensagens recentes acompanham o cliente em `get_cliente` (o histórico completo fica na tabela `mensagens`)
+JANELA_HISTORICO = 30
+
+# Cache LRU dos clientes em conversa ativa, usado pelas sessões (`sessao_cliente`)
+CACHE_CLIENTES_MAX = int(os.getenv("CACHE_CLIENTES_MAX", 1000))
+CACHE_CLIENTES_TTL_SEGUNDOS = float(os.getenv("CACHE_CLIENTES_TTL_SEGUNDOS", 300))
+
+# Uma conexão de longa duração por thread (sqlite3 não permite compartilhar entre threads)
+_conexoes = threading.local()
+
+_cache_clientes: "OrderedDict[str, tuple]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _abrir_conexao(caminho: str) -> sqlite3.Connection:
+    diretorio = os.path.dirname(caminho)
+    if diretorio:
+        os.makedirs(diretorio, exist_ok=True)
+    # isolation_level=None: as transações são abertas explicitamente em `_transacao`
+    conn = sqlite3.connect(caminho, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_KB}")
+    conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+def obter_conexao(caminho: str = None) -> sqlite3.Connection:
+    """Retorna a conexão persistente da thread atual para o banco (criando-a na primeira vez)."""
+    caminho = caminho or DB_PATH
+    por_caminho = getattr(_conexoes, "por_caminho", None)
+    if por_caminho is None:
+        por_caminho = _conexoes.por_caminho = {}
+    conn = por_caminho.get(caminho)
+    if conn is None:
+        conn = por_caminho[caminho] = _abrir_conexao(caminho)
+    return conn
+
+
+def fechar_conexoes():
+    """Fecha as conexões abertas pela thread atual (útil ao encerrar scripts)."""
+    por_caminho = getattr(_conexoes, "por_caminho", None) or {}
+    for conn in por_caminho.values():
+        conn.close()
+    por_caminho.clear()
+
+
+@contextmanager
+def _transacao(caminho: str = None):
+    """
+    Abre uma transação de escrita (BEGIN IMMEDIATE) na conexão da thread.
+    Chamadas aninhadas reaproveitam a transação externa.
+    """
+    conn = obter_conexao(caminho)
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
 def init_db():
     """Inicializa o banco de dados e cria/atualiza a tabela de clientes."""
     os.makedirs(DATA_DIR, exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
+    conn = obter_conexao()
     cursor = conn.cursor()
     
     # Cria a tabela se ela não existir, já com os novos campos
@@ -44,9 +123,210 @@ def init_db():
         cursor.execute("ALTER TABLE clientes ADD COLUMN nome_fazenda TEXT")
     if 'localizacao' not in colunas_existentes:
         cursor.execute("ALTER TABLE clientes ADD COLUMN localizacao TEXT")
-        
-    conn.commit()
-    conn.close()
+    if 'notificacao_enviada' not in colunas_existentes:
+        cursor.execute("ALTER TABLE clientes ADD COLUMN notificacao_enviada INTEGER DEFAULT 0")
+    if 'resumo_conversa' not in colunas_existentes:
+        # Resumo das mensagens antigas (até `resumo_ate_seq`), mantido por sarah_bot.resumo
+        cursor.execute("ALTER TABLE clientes ADD COLUMN resumo_conversa TEXT")
+        cursor.execute("ALTER TABLE clientes ADD COLUMN resumo_ate_seq INTEGER DEFAULT 0")
+    if 'lead_score_historico' not in colunas_existentes:
+        # Lista JSON de {"score", "timestamp"}, alimentada pelo decaimento do follow-up
+        cursor.execute("ALTER TABLE clientes ADD COLUMN lead_score_historico TEXT")
+    if 'proxima_acao_em' not in colunas_existentes:
+        # Agenda da manutenção (decaimento e follow-up) e dias de decaimento já descontados desde o último contato
+        cursor.execute("ALTER TABLE clientes ADD COLUMN proxima_acao_em TEXT")
+        cursor.execute("ALTER TABLE clientes ADD COLUMN decaimento_aplicado_dias INTEGER DEFAULT 0")
+
+    # Índices das consultas do follow-up (candidatos por estado + inatividade, e por nível de follow-up)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_clientes_estado_contato ON clientes (estado_conversa, data_ultimo_contato)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_clientes_follow_up ON clientes (follow_up_enviado)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_clientes_proxima_acao ON clientes (proxima_acao_em)")
+
+    # Histórico de conversa normalizado: uma linha por mensagem, agrupada por cliente
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS mensagens (
+        user_id TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT,
+        timestamp TEXT,
+        PRIMARY KEY (user_id, seq)
+    ) WITHOUT ROWID
+    """)
+
+    # Tags por cliente, com contador: consultas por tag viram buscas no índice em vez de decodificar JSON
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS cliente_tags (
+        user_id TEXT NOT NULL,
+        tag TEXT NOT NULL,
+        first_seen TEXT,
+        count INTEGER NOT NULL DEFAULT 1,
+        PRIMARY KEY (user_id, tag)
+    ) WITHOUT ROWID
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_cliente_tags_tag ON cliente_tags (tag)")
+
+    # Frequência dos termos da dor de cada cliente (nuvem de palavras do dashboard sem reprocessar os textos)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS dor_termos (
+        user_id TEXT NOT NULL,
+        termo TEXT NOT NULL,
+        quantidade INTEGER NOT NULL,
+        registrado_em TEXT,
+        PRIMARY KEY (user_id, termo)
+    ) WITHOUT ROWID
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_dor_termos_registrado ON dor_termos (registrado_em)")
+
+    # Eventos de score (só inserção): cada variação do lead score com o motivo; a soma dos deltas é o score atual
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS lead_score_eventos (
+        user_id TEXT NOT NULL,
+        ts TEXT NOT NULL,
+        delta INTEGER NOT NULL,
+        new_score INTEGER NOT NULL,
+        reason TEXT
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_lead_score_eventos_user_ts ON lead_score_eventos (user_id, ts)")
+
+    # Uso da IA: cada chamada (detalhe recente, podado após alguns dias) e agregados por dia e por cliente,
+    # atualizados junto com o detalhe, que não expiram
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS uso_llm (
+        ts TEXT NOT NULL,
+        user_id TEXT,
+        estado TEXT,
+        modelo TEXT,
+        operacao TEXT,
+        tokens_prompt INTEGER,
+        tokens_resposta INTEGER,
+        ms INTEGER,
+        resultado TEXT
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_uso_llm_ts ON uso_llm (ts)")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS uso_llm_diario (
+        dia TEXT NOT NULL,
+        modelo TEXT NOT NULL,
+        estado TEXT NOT NULL,
+        operacao TEXT NOT NULL,
+        chamadas INTEGER NOT NULL DEFAULT 0,
+        erros INTEGER NOT NULL DEFAULT 0,
+        acertos_cache INTEGER NOT NULL DEFAULT 0,
+        tokens_prompt INTEGER NOT NULL DEFAULT 0,
+        tokens_resposta INTEGER NOT NULL DEFAULT 0,
+        ms_total INTEGER NOT NULL DEFAULT 0,
+        ms_max INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (dia, modelo, estado, operacao)
+    ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS uso_llm_cliente (
+        user_id TEXT NOT NULL,
+        modelo TEXT NOT NULL,
+        chamadas INTEGER NOT NULL DEFAULT 0,
+        tokens_prompt INTEGER NOT NULL DEFAULT 0,
+        tokens_resposta INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, modelo)
+    ) WITHOUT ROWID
+    """)
+
+    # Contador de versão por conjunto de dados derivado: o dashboard só refaz o que ficou desatualizado
+    cursor.execute("CREATE TABLE IF NOT EXISTS versoes_dados (nome TEXT PRIMARY KEY, versao INTEGER NOT NULL)")
+
+    # Migrações de dados que rodam uma única vez, controladas pelo PRAGMA user_version
+    versao_schema = cursor.execute("PRAGMA user_version").fetchone()[0]
+    for versao, migracao in enumerate(_MIGRACOES, start=1):
+        if versao_schema < versao:
+            with _transacao() as conn:
+                migracao(conn)
+                conn.execute(f"PRAGMA user_version = {versao}")
+
+
+def _migrar_historico_json(conn: sqlite3.Connection):
+    """Move os históricos gravados em JSON em `clientes.historico_conversa` para a tabela `mensagens`."""
+    linhas = conn.execute(
+        "SELECT user_id, historico_conversa, data_ultimo_contato FROM clientes "
+        "WHERE historico_conversa IS NOT NULL AND historico_conversa NOT IN ('', '[]')"
+    ).fetchall()
+    for user_id, historico_json, data_ultimo_contato in linhas:
+        try:
+            historico = json.loads(historico_json)
+        except json.JSONDecodeError:
+            continue
+        conn.executemany(
+            "INSERT OR IGNORE INTO mensagens (user_id, seq, role, content, timestamp) VALUES (?, ?, ?, ?, ?)",
+            [(user_id, seq, msg.get("role"), msg.get("content"), data_ultimo_contato)
+             for seq, msg in enumerate(historico, start=1) if isinstance(msg, dict)],
+        )
+    conn.execute("UPDATE clientes SET historico_conversa = NULL WHERE historico_conversa IS NOT NULL")
+
+
+def _preencher_proxima_acao(conn: sqlite3.Connection):
+    """Agenda todos os clientes existentes e converte o decaimento já aplicado em dias (antes contado pelo histórico de score)."""
+    conn.execute("""
+        UPDATE clientes SET decaimento_aplicado_dias = MAX(0, CAST(
+            julianday(json_extract(lead_score_historico, '$[#-1].timestamp')) - julianday(data_ultimo_contato) AS INTEGER))
+        WHERE json_extract(lead_score_historico, '$[#-1].timestamp') > data_ultimo_contato
+    """)
+    conn.execute(f"UPDATE clientes SET proxima_acao_em = {_SQL_PROXIMA_ACAO}")
+
+
+def _preencher_cliente_tags(conn: sqlite3.Connection):
+    """Popula `cliente_tags` a partir das listas JSON em `clientes.tags_detectadas` (contagem inicial 1)."""
+    conn.execute("""
+        INSERT OR IGNORE INTO cliente_tags (user_id, tag, first_seen, count)
+        SELECT c.user_id, tag.value, c.data_criacao, 1
+        FROM clientes AS c, json_each(CASE WHEN json_valid(c.tags_detectadas) THEN c.tags_detectadas ELSE '[]' END) AS tag
+        WHERE tag.value IS NOT NULL
+    """)
+
+
+def _preencher_dor_termos(conn: sqlite3.Connection):
+    """Extrai os termos das dores já gravadas em `clientes.dor_mencionada`."""
+    clientes = conn.execute(
+        "SELECT user_id, dor_mencionada, COALESCE(data_ultimo_contato, data_criacao) FROM clientes "
+        "WHERE dor_mencionada IS NOT NULL AND dor_mencionada != ''"
+    ).fetchall()
+    for user_id, dor, quando in clientes:
+        _registrar_termos_dor(conn, user_id, dor, quando)
+
+
+def _migrar_historico_score(conn: sqlite3.Connection):
+    """
+    Converte as listas JSON de `clientes.lead_score_historico` em `lead_score_eventos` e registra o saldo
+    que faltava (pontos dados antes do log existir), para que a soma dos deltas bata com o score atual.
+    """
+    conn.execute("""
+        INSERT INTO lead_score_eventos (user_id, ts, delta, new_score, reason)
+        SELECT user_id, ts, score - LAG(score, 1, 0) OVER (PARTITION BY user_id ORDER BY ordem), score, 'HISTORICO'
+        FROM (
+            SELECT c.user_id, h.key AS ordem,
+                   json_extract(h.value, '$.timestamp') AS ts, json_extract(h.value, '$.score') AS score
+            FROM clientes AS c,
+                 json_each(CASE WHEN json_valid(c.lead_score_historico) THEN c.lead_score_historico ELSE '[]' END) AS h
+            WHERE json_extract(h.value, '$.timestamp') IS NOT NULL AND json_extract(h.value, '$.score') IS NOT NULL
+        )
+    """)
+    conn.execute("""
+        INSERT INTO lead_score_eventos (user_id, ts, delta, new_score, reason)
+        SELECT c.user_id, ?, COALESCE(c.lead_score, 0) - COALESCE(e.total, 0), COALESCE(c.lead_score, 0), 'SALDO_ANTERIOR'
+        FROM clientes AS c
+        LEFT JOIN (SELECT user_id, SUM(delta) AS total FROM lead_score_eventos GROUP BY user_id) AS e ON e.user_id = c.user_id
+        WHERE COALESCE(c.lead_score, 0) != COALESCE(e.total, 0)
+    """, (datetime.now().isoformat(),))
+    conn.execute("UPDATE clientes SET lead_score_historico = NULL WHERE lead_score_historico IS NOT NULL")
+
+
+_MIGRACOES = [
+    _migrar_historico_json,
+    _preencher_proxima_acao,
+    _preencher_cliente_tags,
+    _preencher_dor_termos,
+    _migrar_historico_score,
+]
 
 def dict_factory(cursor: sqlite3.Cursor, row: sqlite3.Row) -> Dict[str, Any]:
     # (código inalterado)
@@ -59,15 +339,13 @@ def get_cliente(user_id: str) -> Optional[Dict[str, Any]]:
     # (código inalterado)
     user_id_str = str(user_id)
     try:
-        conn = sqlite3.connect(DB_PATH, uri=True)
-        conn.row_factory = dict_factory
-        cursor = conn.cursor()
+        cursor = obter_conexao().cursor()
+        cursor.row_factory = dict_factory
         cursor.execute("SELECT * FROM clientes WHERE user_id = ?", (user_id_str,))
         cliente = cursor.fetchone()
-        conn.close()
         if cliente:
-            if cliente.get('historico_conversa'):
-                cliente['historico_conversa'] = json.loads(cliente['historico_conversa'])
+            # Só as mensagens que ainda não entraram no resumo
+            cliente['historico_conversa'] = obter_historico(user_id_str, JANELA_HISTORICO, cliente.get('resumo_ate_seq') or 0)
             if cliente.get('tags_detectadas'):
                 cliente['tags_detectadas'] = json.loads(cliente['tags_detectadas'])
         return cliente
@@ -75,13 +353,9 @@ def get_cliente(user_id: str) -> Optional[Dict[str, Any]]:
         return None
 
 
-def recuperar_ou_criar_cliente(user_id: str, nome_telegram: str) -> Dict[str, Any]:
-    """Busca um cliente. Se não existir, cria um registro e o retorna."""
-    cliente = get_cliente(user_id)
-    if cliente:
-        return cliente
-    
-    novo_cliente = {
+def _novo_cliente(user_id: str, nome_telegram: str) -> Dict[str, Any]:
+    agora = datetime.now().isoformat()
+    return {
         "user_id": str(user_id),
         "nome": nome_telegram,
         "nome_fazenda": None,
@@ -90,35 +364,40 @@ def recuperar_ou_criar_cliente(user_id: str, nome_telegram: str) -> Dict[str, An
         "pivos": 0,
         "bombas": 0,
         "estado_conversa": "INICIANTE",
-        "data_criacao": datetime.now().isoformat(),
-        "data_ultimo_contato": datetime.now().isoformat(),
+        "data_criacao": agora,
+        "data_ultimo_contato": agora,
         "dor_mencionada": None,
         "orcamento_enviado": 0.0,
         "follow_up_enviado": 0,
-        "historico_conversa": "[]",
-        "tags_detectadas": "[]",
+        "historico_conversa": [],
+        "tags_detectadas": [],
         "lead_score": 0,
         "video_enviado": 0,
+        "notificacao_enviada": 0,
+        "resumo_conversa": None,
+        "resumo_ate_seq": 0,
+        "proxima_acao_em": None,
+        "decaimento_aplicado_dias": 0,
     }
 
-    colunas = ', '.join(novo_cliente.keys())
-    placeholders = ', '.join(['?'] * len(novo_cliente))
-    
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(f"INSERT INTO clientes ({colunas}) VALUES ({placeholders})", tuple(novo_cliente.values()))
-    conn.commit()
-    conn.close()
+def _inserir_cliente(conn: sqlite3.Connection, cliente: Dict[str, Any]):
+    registro = {**cliente, "historico_conversa": None, "tags_detectadas": json.dumps(cliente.get("tags_detectadas", []), ensure_ascii=False)}
+    colunas = ', '.join(registro.keys())
+    placeholders = ', '.join(['?'] * len(registro))
+    conn.execute(f"INSERT INTO clientes ({colunas}) VALUES ({placeholders})", tuple(registro.values()))
+
+def recuperar_ou_criar_cliente(user_id: str, nome_telegram: str) -> Dict[str, Any]:
+    """Busca um cliente. Se não existir, cria um registro e o retorna."""
+    cliente = get_cliente(user_id)
+    if cliente:
+        return cliente
     
-    novo_cliente['historico_conversa'] = []
-    novo_cliente['tags_detectadas'] = []
+    novo_cliente = _novo_cliente(user_id, nome_telegram)
+    with _transacao() as conn:
+        _inserir_cliente(conn, novo_cliente)
     return novo_cliente
 
-def atualizar_cliente(user_id: str, dados_atualizados: Dict[str, Any]):
-    # (código inalterado)
-    user_id_str = str(user_id)
-    dados_atualizados["data_ultimo_contato"] = datetime.now().isoformat()
-    
+def _executar_update(conn: sqlite3.Connection, user_id: str, dados_atualizados: Dict[str, Any]):
     update_values = {}
     for key, value in dados_atualizados.items():
         if isinstance(value, (list, dict)):
@@ -127,41 +406,590 @@ def atualizar_cliente(user_id: str, dados_atualizados: Dict[str, Any]):
             update_values[key] = value
 
     update_fields = ", ".join([f"{key} = ?" for key in update_values])
-    values = list(update_values.values()) + [user_id_str]
-    
-    query = f"UPDATE clientes SET {update_fields} WHERE user_id = ?"
+    values = list(update_values.values()) + [user_id]
     
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute(query, tuple(values))
-        conn.commit()
+    conn.execute(f"UPDATE clientes SET {update_fields} WHERE user_id = ?", tuple(values))
+    if "dor_mencionada" in dados_atualizados:
+        quando = dados_atualizados.get("data_ultimo_contato") or datetime.now().isoformat()
+        _registrar_termos_dor(conn, user_id, dados_atualizados["dor_mencionada"], quando)
+
+@cronometrar("banco", operacao="atualizar_cliente")
+def atualizar_cliente(user_id: str, dados_atualizados: Dict[str, Any]):
+    user_id_str = str(user_id)
+    dados_atualizados["data_ultimo_contato"] = datetime.now().isoformat()
+    dados_atualizados["decaimento_aplicado_dias"] = 0
+    with _transacao() as conn:
+        _executar_update(conn, user_id_str, dados_atualizados)
+        _reagendar(conn, [user_id_str])
+    invalidar_cache_cliente(user_id_str)
 
 def adicionar_mensagem_historico(user_id: str, role: str, content: str):
-    # (código inalterado)
-    cliente = get_cliente(user_id)
-    if not cliente:
-        return
+    """Acrescenta uma mensagem ao histórico do cliente (um único INSERT, sem reescrever o histórico)."""
+    user_id_str = str(user_id)
+    with _transacao() as conn:
+        conn.execute("""
+            INSERT INTO mensagens (user_id, seq, role, content, timestamp)
+            SELECT ?, COALESCE((SELECT MAX(seq) FROM mensagens WHERE user_id = ?), 0) + 1, ?, ?, ?
+            WHERE EXISTS (SELECT 1 FROM clientes WHERE user_id = ?)
+        """, (user_id_str, user_id_str, role, content, datetime.now().isoformat(), user_id_str))
+    invalidar_cache_cliente(user_id_str)
 
-    historico = cliente.get("historico_conversa", [])
-    if not isinstance(historico, list):
-        historico = []
-        
-    historico.append({"role": role, "content": content})
-    
-    max_historico = 30
-    historico = historico[-max_historico:]
-    
-    atualizar_cliente(user_id, {"historico_conversa": historico})
+@cronometrar("banco", operacao="obter_historico")
+def obter_historico(user_id: str, limite: Optional[int] = JANELA_HISTORICO, apos_seq: int = 0) -> List[Dict[str, str]]:
+    """
+    Retorna as últimas `limite` mensagens do cliente em ordem cronológica (todas, se `limite` for None),
+    ignorando as de número até `apos_seq`.
+    """
+    query = "SELECT seq, role, content FROM mensagens WHERE user_id = ? AND seq > ? ORDER BY seq DESC"
+    params: tuple = (str(user_id), apos_seq)
+    if limite is not None:
+        query += " LIMIT ?"
+        params += (limite,)
+    linhas = obter_conexao().execute(query, params).fetchall()
+    return [{"role": role, "content": content} for _, role, content in reversed(linhas)]
+
+@cronometrar("banco", operacao="obter_mensagens_nao_resumidas")
+def obter_mensagens_nao_resumidas(user_id: str) -> Tuple[Optional[str], int, List[Dict[str, Any]]]:
+    """Retorna (resumo atual, seq até onde ele vai, mensagens posteriores com seus `seq`)."""
+    user_id_str = str(user_id)
+    conn = obter_conexao()
+    linha = conn.execute("SELECT resumo_conversa, COALESCE(resumo_ate_seq, 0) FROM clientes WHERE user_id = ?", (user_id_str,)).fetchone()
+    if linha is None:
+        return None, 0, []
+    resumo, ate_seq = linha
+    mensagens = conn.execute(
+        "SELECT seq, role, content FROM mensagens WHERE user_id = ? AND seq > ? ORDER BY seq", (user_id_str, ate_seq)
+    ).fetchall()
+    return resumo, ate_seq, [{"seq": seq, "role": role, "content": content} for seq, role, content in mensagens]
+
+@cronometrar("banco", operacao="salvar_resumo")
+def salvar_resumo(user_id: str, resumo: str, ate_seq: int, ate_seq_anterior: int) -> bool:
+    """
+    Grava o novo resumo da conversa. Só grava se ninguém atualizou o resumo desde a leitura
+    (`ate_seq_anterior`); retorna False nesse caso.
+    """
+    user_id_str = str(user_id)
+    with _transacao() as conn:
+        cursor = conn.execute(
+            "UPDATE clientes SET resumo_conversa = ?, resumo_ate_seq = ? WHERE user_id = ? AND COALESCE(resumo_ate_seq, 0) = ?",
+            (resumo, ate_seq, user_id_str, ate_seq_anterior),
+        )
+    invalidar_cache_cliente(user_id_str)
+    return cursor.rowcount > 0
 
 def deletar_cliente(user_id: str):
     # (código inalterado)
     user_id_str = str(user_id)
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM clientes WHERE user_id = ?", (user_id_str,))
-            conn.commit()
-            return cursor.rowcount > 0 
+        with _transacao() as conn:
+            conn.execute("DELETE FROM mensagens WHERE user_id = ?", (user_id_str,))
+            conn.execute("DELETE FROM cliente_tags WHERE user_id = ?", (user_id_str,))
+            conn.execute("DELETE FROM lead_score_eventos WHERE user_id = ?", (user_id_str,))
+            # O custo do cliente continua nos agregados por dia; só o detalhe ligado a ele sai
+            conn.execute("DELETE FROM uso_llm_cliente WHERE user_id = ?", (user_id_str,))
+            conn.execute("UPDATE uso_llm SET user_id = NULL WHERE user_id = ?", (user_id_str,))
+            if conn.execute("DELETE FROM dor_termos WHERE user_id = ?", (user_id_str,)).rowcount:
+                _incrementar_versao(conn, "dor_termos")
+            cursor = conn.execute("DELETE FROM clientes WHERE user_id = ?", (user_id_str,))
+        invalidar_cache_cliente(user_id_str)
+        return cursor.rowcount > 0
     except sqlite3.Error as e:
         print(f"Erro ao deletar cliente {user_id_str}: {e}")
-        return False
\ No newline at end of file
+        return False
+
+
+# --- CONSULTAS DO FOLLOW-UP E AGENDA DE MANUTENÇÃO ---
+
+# Estados de quem já recebeu o orçamento e pode receber follow-up
+ESTADOS_FOLLOW_UP = ("ORCAMENTO_APRESENTADO", "FOLLOW_UP_POS_ORCAMENTO")
+# Estados em que a conversa terminou: o score deixa de decair
+ESTADOS_ENCERRADOS = ("FOLLOW_UP_FINALIZADO", "FECHAMENTO")
+# Motivo gravado em `lead_score_eventos` para as reduções por falta de contato
+MOTIVO_DECAIMENTO = "DECAIMENTO"
+# Dias sem contato para cada nível de follow-up
+DIAS_FOLLOW_UP = {1: 3, 2: 7}
+
+def _lista_sql(valores) -> str:
+    return ", ".join(f"'{valor}'" for valor in valores)
+
+def _somar_dias_sql(dias: str) -> str:
+    return f"strftime('%Y-%m-%dT%H:%M:%f', data_ultimo_contato, '+' || ({dias}) || ' days')"
+
+# Quando o cliente precisa de manutenção de novo: o próximo dia de decaimento do score ou o próximo
+# follow-up, o que vier primeiro (NULL = nada agendado). Mantido em `proxima_acao_em`, indexado, para
+# que a agenda só leia os clientes vencidos.
+_SQL_PROXIMA_ACAO = f"""NULLIF(MIN(
+    CASE WHEN lead_score > 0 AND estado_conversa NOT IN ({_lista_sql(ESTADOS_ENCERRADOS)})
+         THEN {_somar_dias_sql("COALESCE(decaimento_aplicado_dias, 0) + 1")} ELSE '9999' END,
+    CASE WHEN estado_conversa NOT IN ({_lista_sql(ESTADOS_FOLLOW_UP)}) THEN '9999'
+         WHEN COALESCE(follow_up_enviado, 0) = 0 THEN {_somar_dias_sql(DIAS_FOLLOW_UP[1])}
+         WHEN COALESCE(follow_up_enviado, 0) = 1 THEN {_somar_dias_sql(DIAS_FOLLOW_UP[2])}
+         ELSE '9999' END
+), '9999')"""
+
+def _reagendar(conn: sqlite3.Connection, user_ids: List[str], nao_antes_de: Optional[str] = None):
+    """Recalcula `proxima_acao_em`; com `nao_antes_de`, ações que continuariam vencidas são adiadas até lá."""
+    expressao = f"MAX({_SQL_PROXIMA_ACAO}, :nao_antes_de)" if nao_antes_de else _SQL_PROXIMA_ACAO
+    conn.execute(
+        f"UPDATE clientes SET proxima_acao_em = {expressao} WHERE user_id IN (SELECT value FROM json_each(:ids))",
+        {"ids": json.dumps([str(u) for u in user_ids]), "nao_antes_de": nao_antes_de},
+    )
+
+def obter_clientes_ativos(dias_sem_contato: int = 0) -> List[Dict[str, Any]]:
+    """Clientes com score positivo, em conversa não encerrada e sem contato há pelo menos `dias_sem_contato` dias."""
+    limite = (datetime.now() - timedelta(days=dias_sem_contato)).isoformat()
+    marcadores = ", ".join("?" * len(ESTADOS_ENCERRADOS))
+    cursor = obter_conexao().cursor()
+    cursor.row_factory = dict_factory
+    return cursor.execute(
+        f"SELECT user_id, nome, estado_conversa, lead_score, data_ultimo_contato FROM clientes "
+        f"WHERE lead_score > 0 AND estado_conversa NOT IN ({marcadores}) AND data_ultimo_contato <= ?",
+        (*ESTADOS_ENCERRADOS, limite),
+    ).fetchall()
+
+@cronometrar("banco", operacao="obter_acoes_vencidas")
+def obter_acoes_vencidas(agora: Optional[datetime] = None, limite: int = 500) -> List[str]:
+    """IDs dos clientes cuja próxima ação já venceu, dos mais atrasados para os mais recentes (lê só o índice)."""
+    agora_iso = (agora or datetime.now()).isoformat()
+    linhas = obter_conexao().execute(
+        "SELECT user_id FROM clientes WHERE proxima_acao_em <= ? ORDER BY proxima_acao_em LIMIT ?", (agora_iso, limite)
+    ).fetchall()
+    return [user_id for (user_id,) in linhas]
+
+@cronometrar("banco", operacao="obter_clientes_para_follow_up")
+def obter_clientes_para_follow_up(user_ids: List[str], agora: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """
+    Entre os clientes informados, os que devem receber follow-up agora, já com o `nivel` a enviar:
+    orçamento apresentado e sem contato há `DIAS_FOLLOW_UP[nivel]` dias ou mais.
+    """
+    agora = agora or datetime.now()
+    cursor = obter_conexao().cursor()
+    cursor.row_factory = dict_factory
+    return cursor.execute(
+        f"""SELECT user_id, nome, estado_conversa, data_ultimo_contato, COALESCE(follow_up_enviado, 0) + 1 AS nivel
+        FROM clientes
+        WHERE user_id IN (SELECT value FROM json_each(:ids))
+          AND estado_conversa IN ({_lista_sql(ESTADOS_FOLLOW_UP)})
+          AND ((COALESCE(follow_up_enviado, 0) = 0 AND data_ultimo_contato <= :limite_1)
+            OR (COALESCE(follow_up_enviado, 0) = 1 AND data_ultimo_contato <= :limite_2))
+        ORDER BY data_ultimo_contato""",
+        {
+            "ids": json.dumps([str(u) for u in user_ids]),
+            "limite_1": (agora - timedelta(days=DIAS_FOLLOW_UP[1])).isoformat(),
+            "limite_2": (agora - timedelta(days=DIAS_FOLLOW_UP[2])).isoformat(),
+        },
+    ).fetchall()
+
+@cronometrar("banco", operacao="aplicar_decaimento_score")
+def aplicar_decaimento_score(user_ids: List[str], pontos_por_dia: int, agora: Optional[datetime] = None) -> int:
+    """
+    Reduz o score dos clientes informados em um único UPDATE, calculado no próprio SQLite.
+    Idempotente: cada dia completo sem contato é descontado uma única vez (`decaimento_aplicado_dias`
+    guarda quantos já foram), não importa quantas vezes a rotina rode. Cada redução entra em
+    `lead_score_eventos` na mesma transação. Retorna quantos clientes tiveram o score reduzido.
+    """
+    agora = agora or datetime.now()
+    params = {"agora": agora.isoformat(), "pontos": pontos_por_dia, "ids": json.dumps([str(u) for u in user_ids]), "motivo": MOTIVO_DECAIMENTO}
+    decaimento = f"""
+        SELECT user_id, lead_score, dias, MAX(0, lead_score - :pontos * (dias - COALESCE(decaimento_aplicado_dias, 0))) AS novo_score
+        FROM (
+            SELECT user_id, lead_score, decaimento_aplicado_dias,
+                   CAST(julianday(:agora) - julianday(data_ultimo_contato) AS INTEGER) AS dias
+            FROM clientes
+            WHERE user_id IN (SELECT value FROM json_each(:ids))
+              AND lead_score > 0 AND estado_conversa NOT IN ({_lista_sql(ESTADOS_ENCERRADOS)})
+        )
+        WHERE dias > COALESCE(decaimento_aplicado_dias, 0)
+    """
+    with _transacao() as conn:
+        # Os eventos saem da mesma conta do UPDATE, feita antes dele (ainda com o score anterior)
+        conn.execute(f"""
+            INSERT INTO lead_score_eventos (user_id, ts, delta, new_score, reason)
+            SELECT user_id, :agora, novo_score - lead_score, novo_score, :motivo FROM ({decaimento}) WHERE novo_score != lead_score
+        """, params)
+        alterados = conn.execute(f"""
+            UPDATE clientes SET lead_score = d.novo_score, decaimento_aplicado_dias = d.dias
+            FROM ({decaimento}) AS d
+            WHERE clientes.user_id = d.user_id
+            RETURNING clientes.user_id
+        """, params).fetchall()
+    for (user_id,) in alterados:
+        invalidar_cache_cliente(user_id)
+    return len(alterados)
+
+@cronometrar("banco", operacao="reagendar_clientes")
+def reagendar_clientes(user_ids: List[str], nao_antes_de: Optional[datetime] = None):
+    """Recalcula a próxima ação dos clientes processados (sem deixar nenhuma vencida antes de `nao_antes_de`)."""
+    with _transacao() as conn:
+        _reagendar(conn, user_ids, nao_antes_de.isoformat() if nao_antes_de else None)
+
+@cronometrar("banco", operacao="registrar_follow_ups_enviados")
+def registrar_follow_ups_enviados(registros: List[Dict[str, Any]]) -> int:
+    """
+    Grava um lote de follow-ups enviados numa única transação. Cada registro tem "chat_id",
+    "nivel", "texto", "enviado_em" e, opcionalmente, "estado_conversa".
+
+    Idempotente: um registro só é aplicado se o cliente ainda estiver num nível de follow-up
+    anterior, então reaplicar o mesmo lote (ex.: a partir do checkpoint) não duplica nada.
+    Retorna quantos registros foram aplicados.
+    """
+    aplicados = []
+    with _transacao() as conn:
+        for registro in registros:
+            user_id = str(registro["chat_id"])
+            cursor = conn.execute(
+                "UPDATE clientes SET follow_up_enviado = ?, estado_conversa = COALESCE(?, estado_conversa), data_ultimo_contato = ?, decaimento_aplicado_dias = 0 "
+                "WHERE user_id = ? AND COALESCE(follow_up_enviado, 0) < ?",
+                (registro["nivel"], registro.get("estado_conversa"), registro["enviado_em"], user_id, registro["nivel"]),
+            )
+            if cursor.rowcount:
+                conn.execute("""
+                    INSERT INTO mensagens (user_id, seq, role, content, timestamp)
+                    SELECT ?, COALESCE((SELECT MAX(seq) FROM mensagens WHERE user_id = ?), 0) + 1, 'assistant', ?, ?
+                """, (user_id, user_id, f"[FOLLOW-UP AUTOMÁTICO]\n{registro['texto']}", registro["enviado_em"]))
+                aplicados.append(user_id)
+        _reagendar(conn, aplicados)
+    for user_id in aplicados:
+        invalidar_cache_cliente(user_id)
+    return len(aplicados)
+
+
+# --- TAGS ---
+
+def _registrar_tags(conn: sqlite3.Connection, user_id: str, tags: List[str], quando: str):
+    conn.executemany("""
+        INSERT INTO cliente_tags (user_id, tag, first_seen, count) VALUES (?, ?, ?, 1)
+        ON CONFLICT (user_id, tag) DO UPDATE SET count = count + 1
+    """, [(user_id, tag, quando) for tag in tags])
+
+def obter_clientes_por_tag(tag: str, limite: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Clientes que já tiveram a tag (ex.: "DOR_FURTO_PROPRIO"), do maior score para o menor."""
+    query = """
+        SELECT c.user_id, c.nome, c.estado_conversa, c.lead_score, t.first_seen, t.count
+        FROM cliente_tags AS t JOIN clientes AS c ON c.user_id = t.user_id
+        WHERE t.tag = ? ORDER BY c.lead_score DESC
+    """
+    params: tuple = (tag,)
+    if limite is not None:
+        query += " LIMIT ?"
+        params += (limite,)
+    cursor = obter_conexao().cursor()
+    cursor.row_factory = dict_factory
+    return cursor.execute(query, params).fetchall()
+
+def contar_tags_por_performance(limite_lead_quente: int) -> List[Dict[str, Any]]:
+    """
+    Por tag, separado entre leads quentes (score >= `limite_lead_quente`) e frios:
+    quantos clientes tiveram a tag e quantas vezes ela apareceu no total.
+    """
+    cursor = obter_conexao().cursor()
+    cursor.row_factory = dict_factory
+    return cursor.execute("""
+        SELECT t.tag AS tag,
+               CASE WHEN c.lead_score >= ? THEN 'Lead Quente' ELSE 'Lead Frio' END AS tipo,
+               COUNT(*) AS clientes,
+               SUM(t.count) AS ocorrencias
+        FROM cliente_tags AS t JOIN clientes AS c ON c.user_id = t.user_id
+        GROUP BY t.tag, tipo
+        ORDER BY clientes DESC
+    """, (limite_lead_quente,)).fetchall()
+
+
+# --- EVENTOS DE SCORE ---
+
+def _inserir_eventos_score(conn: sqlite3.Connection, user_id: str, eventos: List[Tuple[str, int, int]], quando: str):
+    conn.executemany(
+        "INSERT INTO lead_score_eventos (user_id, ts, delta, new_score, reason) VALUES (?, ?, ?, ?, ?)",
+        [(user_id, quando, delta, novo_score, motivo) for motivo, delta, novo_score in eventos],
+    )
+
+def obter_eventos_score(user_id: str, desde: Optional[datetime] = None, ate: Optional[datetime] = None,
+                        max_pontos: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Série temporal do score do cliente ({"ts", "delta", "new_score", "reason"}), em ordem, lida por faixa
+    no índice (user_id, ts). Com `max_pontos`, leads antigos são reduzidos a no máximo esse número de
+    pontos, espaçados por igual (o último evento sempre entra, para a série terminar no score atual).
+    """
+    condicoes = "user_id = ? AND ts >= ? AND ts <= ?"
+    params = [str(user_id), desde.isoformat() if desde else "", ate.isoformat() if ate else "9999"]
+    conn = obter_conexao()
+    passo = 1
+    if max_pontos:
+        total = conn.execute(f"SELECT COUNT(*) FROM lead_score_eventos WHERE {condicoes}", params).fetchone()[0]
+        passo = max(1, -(-total // max_pontos))
+    cursor = conn.cursor()
+    cursor.row_factory = dict_factory
+    if passo == 1:
+        return cursor.execute(
+            f"SELECT ts, delta, new_score, reason FROM lead_score_eventos WHERE {condicoes} ORDER BY ts, rowid", params
+        ).fetchall()
+    return cursor.execute(f"""
+        SELECT ts, delta, new_score, reason FROM (
+            SELECT ts, delta, new_score, reason, ROW_NUMBER() OVER (ORDER BY ts, rowid) AS n, COUNT(*) OVER () AS total
+            FROM lead_score_eventos WHERE {condicoes}
+        ) WHERE (total - n) % ? = 0 ORDER BY n
+    """, params + [passo]).fetchall()
+
+def calcular_score_por_eventos(user_id: str) -> int:
+    """Score do cliente recalculado a partir dos eventos (soma dos deltas)."""
+    return obter_conexao().execute(
+        "SELECT COALESCE(SUM(delta), 0) FROM lead_score_eventos WHERE user_id = ?", (str(user_id),)
+    ).fetchone()[0]
+
+
+# --- USO DA IA ---
+
+@cronometrar("banco", operacao="registrar_uso_llm")
+def registrar_uso_llm(registros: List[Dict[str, Any]]):
+    """
+    Grava um lote de chamadas à IA ({"ts", "user_id", "estado", "modelo", "operacao", "tokens_prompt",
+    "tokens_resposta", "ms", "resultado"}) e soma cada uma nos agregados por dia e por cliente.
+    """
+    if not registros:
+        return
+    linhas = [{**r, "estado": r.get("estado") or "", "dia": r["ts"][:10]} for r in registros]
+    with _transacao() as conn:
+        conn.executemany("""
+            INSERT INTO uso_llm (ts, user_id, estado, modelo, operacao, tokens_prompt, tokens_resposta, ms, resultado)
+            VALUES (:ts, :user_id, :estado, :modelo, :operacao, :tokens_prompt, :tokens_resposta, :ms, :resultado)
+        """, linhas)
+        conn.executemany("""
+            INSERT INTO uso_llm_diario AS d (dia, modelo, estado, operacao, chamadas, erros, acertos_cache, tokens_prompt, tokens_resposta, ms_total, ms_max)
+            VALUES (:dia, :modelo, :estado, :operacao, 1, :resultado = 'erro', :resultado = 'cache', :tokens_prompt, :tokens_resposta, :ms, :ms)
+            ON CONFLICT (dia, modelo, estado, operacao) DO UPDATE SET
+                chamadas = d.chamadas + 1,
+                erros = d.erros + excluded.erros,
+                acertos_cache = d.acertos_cache + excluded.acertos_cache,
+                tokens_prompt = d.tokens_prompt + excluded.tokens_prompt,
+                tokens_resposta = d.tokens_resposta + excluded.tokens_resposta,
+                ms_total = d.ms_total + excluded.ms_total,
+                ms_max = MAX(d.ms_max, excluded.ms_max)
+        """, linhas)
+        conn.executemany("""
+            INSERT INTO uso_llm_cliente AS c (user_id, modelo, chamadas, tokens_prompt, tokens_resposta)
+            VALUES (:user_id, :modelo, 1, :tokens_prompt, :tokens_resposta)
+            ON CONFLICT (user_id, modelo) DO UPDATE SET
+                chamadas = c.chamadas + 1,
+                tokens_prompt = c.tokens_prompt + excluded.tokens_prompt,
+                tokens_resposta = c.tokens_resposta + excluded.tokens_resposta
+        """, [linha for linha in linhas if linha["user_id"] and linha["resultado"] != "cache"])
+
+def podar_uso_llm(antes_de: datetime) -> int:
+    """Apaga o detalhe das chamadas anteriores a `antes_de` (os agregados ficam). Retorna quantas saíram."""
+    with _transacao() as conn:
+        return conn.execute("DELETE FROM uso_llm WHERE ts < ?", (antes_de.isoformat(),)).rowcount
+
+
+# --- TERMOS DAS DORES ---
+
+def _incrementar_versao(conn: sqlite3.Connection, nome: str):
+    conn.execute(
+        "INSERT INTO versoes_dados (nome, versao) VALUES (?, 1) ON CONFLICT (nome) DO UPDATE SET versao = versao + 1",
+        (nome,),
+    )
+
+def obter_versao_dados(nome: str) -> int:
+    """Versão atual de um conjunto de dados derivado (ex.: "dor_termos"); muda a cada gravação nele."""
+    linha = obter_conexao().execute("SELECT versao FROM versoes_dados WHERE nome = ?", (nome,)).fetchone()
+    return linha[0] if linha else 0
+
+def _registrar_termos_dor(conn: sqlite3.Connection, user_id: str, dor: Optional[str], quando: str):
+    # A dor do cliente é substituída por inteiro: os termos da versão anterior saem
+    conn.execute("DELETE FROM dor_termos WHERE user_id = ?", (user_id,))
+    frequencias = Counter(extrair_termos(dor or ""))
+    conn.executemany(
+        "INSERT INTO dor_termos (user_id, termo, quantidade, registrado_em) VALUES (?, ?, ?, ?)",
+        [(user_id, termo, quantidade, quando) for termo, quantidade in frequencias.items()],
+    )
+    _incrementar_versao(conn, "dor_termos")
+
+def obter_frequencias_dores(desde: Optional[datetime] = None, localizacao: Optional[str] = None, limite: int = 200) -> Dict[str, int]:
+    """
+    Frequência de cada termo nas dores dos clientes, opcionalmente só das registradas a partir de
+    `desde` e/ou de uma localização. Os `limite` termos mais frequentes, do maior para o menor.
+    """
+    query = "SELECT t.termo, SUM(t.quantidade) AS total FROM dor_termos AS t"
+    condicoes, params = [], []
+    if localizacao:
+        query += " JOIN clientes AS c ON c.user_id = t.user_id"
+        condicoes.append("c.localizacao = ?")
+        params.append(localizacao)
+    if desde is not None:
+        condicoes.append("t.registrado_em >= ?")
+        params.append(desde.isoformat())
+    if condicoes:
+        query += " WHERE " + " AND ".join(condicoes)
+    query += " GROUP BY t.termo ORDER BY total DESC LIMIT ?"
+    params.append(limite)
+    return dict(obter_conexao().execute(query, params).fetchall())
+
+
+# --- CACHE DE CLIENTES E SESSÃO (UNIDADE DE TRABALHO) ---
+
+def _copiar_cliente(cliente: Dict[str, Any]) -> Dict[str, Any]:
+    copia = dict(cliente)
+    copia["historico_conversa"] = list(cliente.get("historico_conversa") or [])
+    copia["tags_detectadas"] = list(cliente.get("tags_detectadas") or [])
+    return copia
+
+def _cache_obter(user_id: str) -> Tuple[Optional[tuple], Optional[Dict[str, Any]]]:
+    """(entrada do cache, cópia do cliente); a entrada serve de versão para `_cache_guardar(..., esperado=)`."""
+    with _cache_lock:
+        entrada = _cache_clientes.get(user_id)
+        if entrada is None:
+            return None, None
+        guardado_em, cliente = entrada
+        if time.monotonic() - guardado_em > CACHE_CLIENTES_TTL_SEGUNDOS:
+            del _cache_clientes[user_id]
+            return None, None
+        _cache_clientes.move_to_end(user_id)
+        return entrada, _copiar_cliente(cliente)
+
+_SEM_VERIFICACAO = object()
+
+def _cache_guardar(cliente: Dict[str, Any], esperado=_SEM_VERIFICACAO) -> Optional[tuple]:
+    """
+    Guarda o cliente no cache e retorna a entrada criada. Com `esperado`, só guarda se a entrada atual
+    ainda for essa: se o cliente foi invalidado no meio do caminho, a cópia de quem chama está velha.
+    """
+    if CACHE_CLIENTES_MAX <= 0:
+        return None
+    with _cache_lock:
+        if esperado is not _SEM_VERIFICACAO and _cache_clientes.get(cliente["user_id"]) is not esperado:
+            _cache_clientes.pop(cliente["user_id"], None)
+            return None
+        entrada = (time.monotonic(), _copiar_cliente(cliente))
+        _cache_clientes[cliente["user_id"]] = entrada
+        _cache_clientes.move_to_end(cliente["user_id"])
+        while len(_cache_clientes) > CACHE_CLIENTES_MAX:
+            _cache_clientes.popitem(last=False)
+        return entrada
+
+def invalidar_cache_cliente(user_id: str):
+    """Remove o cliente do cache (chamado em toda escrita feita fora de uma sessão e no /reset)."""
+    with _cache_lock:
+        _cache_clientes.pop(str(user_id), None)
+
+
+class SessaoCliente:
+    """
+    Unidade de trabalho de um update: o cliente é carregado uma vez, as alterações de
+    campos e as novas mensagens ficam em memória e `salvar()` grava tudo em uma única transação.
+    """
+
+    def __init__(self, cliente: Dict[str, Any], novo: bool = False, entrada_cache: Optional[tuple] = None):
+        self.cliente = cliente
+        self._novo = novo
+        # Entrada do cache de onde o cliente veio: se ela sumir (resumo, decaimento...), a cópia da sessão está velha
+        self._entrada_cache = entrada_cache
+        self._alteracoes: Dict[str, Any] = {}
+        self._mensagens: List[tuple] = []
+        self._tags: List[str] = []
+        self._eventos_score: List[Tuple[str, int]] = []
+        self._score_inicial = cliente.get("lead_score") or 0
+        # Nível de follow-up visto ao abrir: se mudar até o salvar(), a manutenção mexeu no cliente no meio do update
+        self._follow_up_inicial = cliente.get("follow_up_enviado") or 0
+
+    @property
+    def user_id(self) -> str:
+        return self.cliente["user_id"]
+
+    def atualizar(self, dados: Dict[str, Any]):
+        self._alteracoes.update(dados)
+        self.cliente.update(dados)
+
+    def adicionar_mensagem(self, role: str, content: str):
+        self._mensagens.append((role, content, datetime.now().isoformat()))
+        # Nova lista (e não append): quem guardou o histórico anterior continua vendo-o intacto
+        self.cliente["historico_conversa"] = (self.cliente["historico_conversa"] + [{"role": role, "content": content}])[-JANELA_HISTORICO:]
+
+    def registrar_tags(self, tags):
+        """Tags detectadas nesta mensagem: somam 1 no contador de cada uma em `cliente_tags`."""
+        self._tags.extend(tags)
+
+    def registrar_eventos_score(self, eventos: List[Tuple[str, int]]):
+        """
+        Pontos da mensagem (motivo, pontos), aplicados já ao score em memória. Em `salvar()` eles são
+        reaplicados sobre o score gravado no banco, que pode ter mudado (decaimento) desde que a sessão abriu.
+        """
+        self._eventos_score.extend(eventos)
+        aplicados = aplicar_eventos(self.cliente.get("lead_score") or 0, eventos)
+        if aplicados:
+            self.cliente["lead_score"] = aplicados[-1][2]
+
+    @cronometrar("banco", operacao="salvar_sessao")
+    def salvar(self):
+        if not (self._novo or self._alteracoes or self._mensagens or self._tags or self._eventos_score):
+            return
+        agora = datetime.now().isoformat()
+        with _transacao() as conn:
+            if self._novo:
+                # Score de antes dos eventos pendentes, que são aplicados logo abaixo
+                _inserir_cliente(conn, {**self.cliente, "lead_score": self._score_inicial})
+            if self._alteracoes or self._mensagens or self._eventos_score:
+                # Novo contato: o decaimento do score volta a contar do zero
+                self.atualizar({"data_ultimo_contato": agora, "decaimento_aplicado_dias": 0})
+                # A manutenção (decaimento e follow-up) roda na job queue, fora do lock do usuário:
+                # score e estado são conferidos contra o banco, e não contra a cópia da sessão
+                score_atual, estado_atual, follow_up_atual = conn.execute(
+                    "SELECT lead_score, estado_conversa, COALESCE(follow_up_enviado, 0) FROM clientes WHERE user_id = ?", (self.user_id,)
+                ).fetchone()
+                if follow_up_atual != self._follow_up_inicial:
+                    # Follow-up gravado durante o update: o estado que ele definiu prevalece sobre o da sessão
+                    self._alteracoes.pop("estado_conversa", None)
+                    self.cliente.update({"estado_conversa": estado_atual, "follow_up_enviado": follow_up_atual})
+                if self._eventos_score:
+                    aplicados = aplicar_eventos(score_atual or 0, self._eventos_score)
+                    if aplicados:
+                        _inserir_eventos_score(conn, self.user_id, aplicados, agora)
+                        self.atualizar({"lead_score": aplicados[-1][2]})
+                    else:
+                        self.cliente["lead_score"] = score_atual or 0
+                _executar_update(conn, self.user_id, self._alteracoes)
+                _reagendar(conn, [self.user_id])
+            if self._mensagens:
+                ultimo_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM mensagens WHERE user_id = ?", (self.user_id,)).fetchone()[0]
+                conn.executemany(
+                    "INSERT INTO mensagens (user_id, seq, role, content, timestamp) VALUES (?, ?, ?, ?, ?)",
+                    [(self.user_id, ultimo_seq + i, role, content, ts) for i, (role, content, ts) in enumerate(self._mensagens, start=1)],
+                )
+            if self._tags:
+                _registrar_tags(conn, self.user_id, self._tags, agora)
+        self._novo = False
+        self._alteracoes = {}
+        self._mensagens = []
+        self._tags = []
+        self._eventos_score = []
+        self._score_inicial = self.cliente.get("lead_score") or 0
+        self._follow_up_inicial = self.cliente.get("follow_up_enviado") or 0
+        self._entrada_cache = _cache_guardar(self.cliente, esperado=self._entrada_cache)
+
+
+@cronometrar("banco", operacao="abrir_sessao")
+def abrir_sessao(user_id: str, nome_telegram: str) -> SessaoCliente:
+    """Carrega o cliente (do cache, se estiver quente) ou prepara um novo registro, sem gravar nada ainda."""
+    user_id_str = str(user_id)
+    entrada, cliente = _cache_obter(user_id_str)
+    if cliente is None:
+        cliente = get_cliente(user_id_str)
+        if cliente is not None:
+            cliente["tags_detectadas"] = cliente.get("tags_detectadas") or []
+            entrada = _cache_guardar(cliente)
+    if cliente is None:
+        return SessaoCliente(_novo_cliente(user_id_str, nome_telegram), novo=True)
+    return SessaoCliente(cliente, entrada_cache=entrada)
+
+
+@contextmanager
+def sessao_cliente(user_id: str, nome_telegram: str):
+    """
+    Abre uma sessão para o cliente e grava as alterações ao final do bloco.
+    Se o bloco falhar, nada é gravado e o cliente sai do cache.
+    """
+    sessao = abrir_sessao(user_id, nome_telegram)
+    try:
+        yield sessao
+    except BaseException:
+        invalidar_cache_cliente(sessao.user_id)
+        raise
+    sessao.salvar()
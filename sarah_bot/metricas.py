@@ -0,0 +1,259 @@
+# metricas.py
+import asyncio
+import bisect
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Dict, Any, List, Tuple, Callable, Iterable
+
+logger = logging.getLogger(__name__)
+
+# Porta do endpoint de métricas no formato do Prometheus (GET /metrics). 0 = desligado
+METRICAS_PORTA = int(os.getenv("METRICAS_PORTA", 0))
+METRICAS_HOST = os.getenv("METRICAS_HOST", "127.0.0.1")
+# Arquivo JSONL com uma linha por update (etapas e tempos); vazio = desligado
+METRICAS_LOG_JSON = os.getenv("METRICAS_LOG_JSON", "")
+
+# Limites (segundos) dos buckets dos histogramas, do SQLite (ms) às chamadas à IA (dezenas de segundos)
+LIMITES_SEGUNDOS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class _Histograma:
+    __slots__ = ("buckets", "soma", "contagem")
+
+    def __init__(self):
+        self.buckets = [0] * (len(LIMITES_SEGUNDOS) + 1)
+        self.soma = 0.0
+        self.contagem = 0
+
+
+_histogramas: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], _Histograma] = {}
+# Contadores que os módulos já mantêm (filas, cache da IA, alertas...), lidos só quando o /metrics é consultado
+_fontes: Dict[str, Tuple[Callable[[], Dict[str, Any]], frozenset, Optional[str]]] = {}
+_lock = threading.Lock()
+# Rastro do update em andamento (etapas e rótulos), herdado pelas tarefas criadas durante o update
+_rastro_atual: ContextVar[Optional[Dict[str, Any]]] = ContextVar("rastro_update", default=None)
+
+_log_updates: Optional[logging.Logger] = None
+if METRICAS_LOG_JSON:
+    _log_updates = logging.getLogger(f"{__name__}.updates")
+    _log_updates.setLevel(logging.INFO)
+    _log_updates.propagate = False
+    os.makedirs(os.path.dirname(METRICAS_LOG_JSON) or ".", exist_ok=True)
+    _handler_json = logging.FileHandler(METRICAS_LOG_JSON, encoding="utf-8")
+    _handler_json.setFormatter(logging.Formatter("%(message)s"))
+    _log_updates.addHandler(_handler_json)
+
+
+def observar(nome: str, duracao: float, **rotulos):
+    """Registra uma duração (segundos) no histograma `nome` com os rótulos dados."""
+    chave = (nome, tuple(sorted((k, str(v)) for k, v in rotulos.items())))
+    with _lock:
+        histograma = _histogramas.get(chave)
+        if histograma is None:
+            histograma = _histogramas[chave] = _Histograma()
+        histograma.buckets[bisect.bisect_left(LIMITES_SEGUNDOS, duracao)] += 1
+        histograma.soma += duracao
+        histograma.contagem += 1
+
+
+class Trecho:
+    """
+    Mede um trecho de código (`with medir(...) as trecho:`). Os rótulos podem ser completados
+    dentro do bloco (ex.: `trecho.rotulos["resultado"] = "cache"`); saída por exceção vira resultado "erro".
+    """
+    __slots__ = ("nome", "rotulos", "inicio")
+
+    def __init__(self, nome: str, rotulos: Dict[str, Any]):
+        self.nome = nome
+        self.rotulos = rotulos
+        self.inicio = 0.0
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, tipo_erro, erro, rastreamento):
+        duracao = time.perf_counter() - self.inicio
+        if tipo_erro is None:
+            self.rotulos.setdefault("resultado", "ok")
+        else:
+            # Cancelamento (ex.: resposta especulativa descartada) não é falha
+            cancelado = issubclass(tipo_erro, (asyncio.CancelledError, GeneratorExit))
+            self.rotulos.setdefault("resultado", "cancelado" if cancelado else "erro")
+        observar(self.nome, duracao, **self.rotulos)
+        rastro = _rastro_atual.get()
+        if rastro is not None:
+            rastro["etapas"].append({"nome": self.nome, **self.rotulos, "ms": round(duracao * 1000, 2)})
+        return False
+
+
+def medir(nome: str, **rotulos) -> Trecho:
+    return Trecho(nome, rotulos)
+
+
+def cronometrar(nome: str, **rotulos):
+    """Decorador: mede cada chamada da função (síncrona ou assíncrona) no histograma `nome`."""
+    def decorador(funcao):
+        if inspect.iscoroutinefunction(funcao):
+            @functools.wraps(funcao)
+            async def medida_async(*args, **kwargs):
+                with Trecho(nome, dict(rotulos)):
+                    return await funcao(*args, **kwargs)
+            return medida_async
+
+        @functools.wraps(funcao)
+        def medida(*args, **kwargs):
+            with Trecho(nome, dict(rotulos)):
+                return funcao(*args, **kwargs)
+        return medida
+    return decorador
+
+
+def rotular_update(**rotulos):
+    """Acrescenta rótulos (ex.: estado da conversa) ao update em andamento."""
+    rastro = _rastro_atual.get()
+    if rastro is not None:
+        rastro["rotulos"].update(rotulos)
+
+
+def rastrear_update(handler):
+    """
+    Decorador dos handlers do bot: mede o update inteiro (histograma "update"), junta as etapas
+    medidas durante ele e, com METRICAS_LOG_JSON, grava uma linha JSON por update.
+    """
+    @functools.wraps(handler)
+    async def rastreado(update, context, *args, **kwargs):
+        rastro = {"rotulos": {}, "etapas": []}
+        token = _rastro_atual.set(rastro)
+        inicio = time.perf_counter()
+        resultado = "erro"
+        try:
+            retorno = await handler(update, context, *args, **kwargs)
+            resultado = "ok"
+            return retorno
+        finally:
+            _rastro_atual.reset(token)
+            duracao = time.perf_counter() - inicio
+            observar("update", duracao, **rastro["rotulos"], resultado=resultado)
+            if _log_updates is not None:
+                usuario = getattr(update, "effective_user", None)
+                _log_updates.info(json.dumps({
+                    "ts": time.time(),
+                    "user_id": getattr(usuario, "id", None),
+                    **rastro["rotulos"],
+                    "resultado": resultado,
+                    "ms": round(duracao * 1000, 2),
+                    "etapas": rastro["etapas"],
+                }, ensure_ascii=False, default=str))
+    return rastreado
+
+
+def registrar_fonte(nome: str, obter: Callable[[], Dict[str, Any]], contadores: Iterable[str] = (), rotulo: Optional[str] = None):
+    """
+    Publica no /metrics os números de `obter()` como `sarah_<nome>_<chave>`: as chaves em `contadores`
+    saem como counter (`..._total`), as demais como gauge. Com `rotulo`, `obter()` retorna
+    {valor do rótulo: {chave: número}} (ex.: tokens do prompt por estado da conversa).
+    """
+    _fontes[nome] = (obter, frozenset(contadores), rotulo)
+
+
+def obter_fontes() -> Dict[str, Dict[str, Any]]:
+    """Retrato atual de todas as fontes registradas, por nome."""
+    return {nome: obter() for nome, (obter, _, _) in sorted(_fontes.items())}
+
+
+def _formatar_fontes() -> List[str]:
+    series: Dict[str, Tuple[str, List[str]]] = {}
+    for nome, (obter, contadores, rotulo) in sorted(_fontes.items()):
+        try:
+            valores = obter()
+        except Exception as e:
+            logger.warning(f"Falha ao ler as estatísticas de '{nome}': {e}")
+            continue
+        grupos = valores.items() if rotulo else [(None, valores)]
+        for valor_rotulo, numeros in grupos:
+            base = f'{{{rotulo}="{_escapar(str(valor_rotulo))}"}}' if rotulo else ""
+            for chave, numero in numeros.items():
+                if isinstance(numero, bool) or not isinstance(numero, (int, float)):
+                    continue
+                contador = chave in contadores
+                metrica = f"sarah_{nome}_{chave}" + ("_total" if contador else "")
+                series.setdefault(metrica, ("counter" if contador else "gauge", []))[1].append(f"{metrica}{base} {numero}")
+    linhas: List[str] = []
+    for metrica, (tipo, amostras) in series.items():
+        linhas.append(f"# TYPE {metrica} {tipo}")
+        linhas.extend(amostras)
+    return linhas
+
+
+def _escapar(valor: str) -> str:
+    return valor.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def formatar_prometheus() -> str:
+    """Todos os histogramas (`sarah_<nome>_segundos`) e as fontes registradas no formato texto do Prometheus."""
+    with _lock:
+        copia = [(chave, list(h.buckets), h.soma, h.contagem) for chave, h in _histogramas.items()]
+    linhas: List[str] = []
+    tipos_declarados = set()
+    for (nome, rotulos), buckets, soma, contagem in sorted(copia):
+        metrica = f"sarah_{nome}_segundos"
+        if metrica not in tipos_declarados:
+            linhas.append(f"# TYPE {metrica} histogram")
+            tipos_declarados.add(metrica)
+        base = ",".join(f'{chave}="{_escapar(valor)}"' for chave, valor in rotulos)
+        separador = "," if base else ""
+        acumulado = 0
+        for limite, quantidade in zip(LIMITES_SEGUNDOS, buckets):
+            acumulado += quantidade
+            linhas.append(f'{metrica}_bucket{{{base}{separador}le="{limite}"}} {acumulado}')
+        linhas.append(f'{metrica}_bucket{{{base}{separador}le="+Inf"}} {contagem}')
+        linhas.append(f"{metrica}_sum{{{base}}} {soma}")
+        linhas.append(f"{metrica}_count{{{base}}} {contagem}")
+    linhas.extend(_formatar_fontes())
+    return "\n".join(linhas) + "\n"
+
+
+def obter_estatisticas() -> Dict[str, Dict[str, Any]]:
+    """Contagem e tempo médio de cada histograma, por nome e rótulos."""
+    with _lock:
+        return {
+            f"{nome}{{{','.join(f'{k}={v}' for k, v in rotulos)}}}": {
+                "contagem": h.contagem, "soma_s": h.soma, "media_s": h.soma / h.contagem if h.contagem else 0.0,
+            }
+            for (nome, rotulos), h in _histogramas.items()
+        }
+
+
+class _HandlerMetricas(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        corpo = formatar_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, formato, *args):
+        pass
+
+
+def iniciar_servidor(porta: int = METRICAS_PORTA, host: str = METRICAS_HOST) -> Optional[ThreadingHTTPServer]:
+    """Sobe o endpoint /metrics numa thread à parte (fora do loop do bot). Sem porta configurada, não faz nada."""
+    if not porta:
+        return None
+    servidor = ThreadingHTTPServer((host, porta), _HandlerMetricas)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name="metricas", daemon=True).start()
+    logger.info(f"Métricas disponíveis em http://{host}:{porta}/metrics")
+    return servidor
@@ -0,0 +1,228 @@
+# notificacoes.py
+import asyncio
+import logging
+import os
+import time
+from typing import Optional, Dict, Any, List
+
+from dotenv import load_dotenv
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+
+from sarah_bot.metricas import cronometrar, medir, registrar_fonte
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+GERENTE_CHAT_ID = os.getenv("GERENTE_CHAT_ID")
+# O mesmo alerta (cliente + motivo) não é repetido dentro desta janela
+NOTIFICACAO_JANELA_DEDUP_S = float(os.getenv("NOTIFICACAO_JANELA_DEDUP_S", 6 * 3600))
+# Alertas de lead quente que chegam dentro desta janela viram uma única mensagem (0 = envia um a um)
+NOTIFICACAO_RESUMO_S = float(os.getenv("NOTIFICACAO_RESUMO_S", 0))
+NOTIFICACAO_MAX_TENTATIVAS = int(os.getenv("NOTIFICACAO_MAX_TENTATIVAS", 5))
+
+MOTIVO_LEAD_QUENTE = "LEAD QUENTE"
+MOTIVO_FECHAMENTO = "FECHAMENTO"
+
+_FIM = object()  # sinal para o trabalhador esvaziar a fila e encerrar
+
+_fila: "asyncio.Queue" = asyncio.Queue()
+_bot = None
+_trabalhador: Optional[asyncio.Task] = None
+_ultimos_alertas: Dict[tuple, float] = {}
+
+_estatisticas = {"enfileirados": 0, "duplicados_ignorados": 0, "enviados": 0, "resumos": 0, "novas_tentativas": 0, "falhas": 0}
+
+
+def escape_markdown(text: str) -> str:
+    """
+    Escapa caracteres especiais para o modo MarkdownV2 do Telegram.
+    Isso previne o erro '400 Bad Request' por formatação inválida.
+    """
+    if not isinstance(text, str):
+        return ""
+    # Caracteres que precisam ser escapados no modo MarkdownV2
+    escape_chars = r'_*[]()~`>#+-=|{}.!'
+    return "".join(f'\\{char}' if char in escape_chars else char for char in text)
+
+
+def formatar_alerta(cliente: Dict[str, Any], motivo: str = MOTIVO_LEAD_QUENTE) -> str:
+    """Monta a mensagem de alerta (MarkdownV2) de um cliente para o gerente."""
+    titulo = "🔥 ALERTA DE LEAD QUENTE\\! 🔥"
+    acao_recomendada = "Ação recomendada: Entrar em contato com o cliente\\."
+    if motivo == MOTIVO_FECHAMENTO:
+        titulo = "✅ CLIENTE PRONTO PARA FECHAR\\! ✅"
+        acao_recomendada = "Ação recomendada: Entrar em contato IMEDIATAMENTE para finalizar o contrato\\."
+
+    # Usando escape_markdown para garantir que a mensagem não quebre
+    nome_cliente = escape_markdown(cliente.get('nome', 'N/A'))
+    nome_fazenda = escape_markdown(cliente.get('nome_fazenda', 'N/A'))
+    localizacao = escape_markdown(cliente.get('localizacao', 'N/A'))
+    dor_mencionada = escape_markdown(cliente.get('dor_mencionada', 'Não informada'))
+    tags_str = escape_markdown(", ".join(cliente.get('tags_detectadas', [])))
+
+    return (
+        f"*{titulo}*\n\n"
+        f"👤 *Cliente:* {nome_cliente} \\(ID: {cliente.get('user_id')}\\)\n"
+        f"🏡 *Propriedade:* {nome_fazenda} em {localizacao}\n"
+        f"⭐ *Score:* {cliente.get('lead_score')}\n"
+        f"🎯 *Tags:* `{tags_str}`\n"
+        f"😟 *Principal Dor:* {dor_mencionada}\n\n"
+        f"_{acao_recomendada}_"
+    )
+
+
+def formatar_resumo(clientes: List[Dict[str, Any]]) -> str:
+    """Uma única mensagem (MarkdownV2) com vários leads quentes, do maior score para o menor."""
+    linhas = [f"*🔥 {len(clientes)} LEADS QUENTES\\! 🔥*", ""]
+    for cliente in sorted(clientes, key=lambda c: c.get('lead_score') or 0, reverse=True):
+        nome_cliente = escape_markdown(cliente.get('nome', 'N/A'))
+        localizacao = escape_markdown(cliente.get('localizacao') or 'N/A')
+        dor_mencionada = escape_markdown(cliente.get('dor_mencionada') or 'Não informada')
+        linhas.append(
+            f"👤 *{nome_cliente}* \\(ID: {cliente.get('user_id')}\\) · ⭐ {cliente.get('lead_score')} · 📍 {localizacao}\n"
+            f"   😟 {dor_mencionada}"
+        )
+    linhas += ["", "_Ação recomendada: Entrar em contato com os clientes\\._"]
+    return "\n".join(linhas)
+
+
+def _duplicado(user_id, motivo: str, agora: float) -> bool:
+    if len(_ultimos_alertas) > 10000:
+        for chave in [c for c, t in _ultimos_alertas.items() if agora - t > NOTIFICACAO_JANELA_DEDUP_S]:
+            del _ultimos_alertas[chave]
+    ultimo = _ultimos_alertas.get((str(user_id), motivo))
+    if ultimo is not None and agora - ultimo < NOTIFICACAO_JANELA_DEDUP_S:
+        return True
+    _ultimos_alertas[(str(user_id), motivo)] = agora
+    return False
+
+
+@cronometrar("notificacao", operacao="enfileirar")
+def notificar_vendedor_humano(cliente: Dict[str, Any], motivo: str = MOTIVO_LEAD_QUENTE) -> bool:
+    """
+    Coloca o alerta para o gerente na fila e retorna na hora (o envio é feito em segundo plano).
+    Retorna False quando o alerta é descartado (sem GERENTE_CHAT_ID ou repetido dentro da janela).
+    """
+    if not GERENTE_CHAT_ID:
+        logger.warning("GERENTE_CHAT_ID não definido. Não é possível enviar alerta.")
+        return False
+    if _duplicado(cliente.get('user_id'), motivo, time.monotonic()):
+        _estatisticas["duplicados_ignorados"] += 1
+        logger.info(f"Alerta de '{motivo}' para o cliente {cliente.get('user_id')} já enviado recentemente; ignorado.")
+        return False
+    # Cópia do estado atual: o cliente continua mudando enquanto o alerta espera na fila
+    instantaneo = {**cliente, "tags_detectadas": list(cliente.get('tags_detectadas') or [])}
+    _fila.put_nowait((motivo, instantaneo))
+    _estatisticas["enfileirados"] += 1
+    return True
+
+
+async def _enviar(texto: str, descricao: str):
+    for tentativa in range(1, NOTIFICACAO_MAX_TENTATIVAS + 1):
+        try:
+            with medir("telegram", operacao="alerta"):
+                await _bot.send_message(chat_id=GERENTE_CHAT_ID, text=texto, parse_mode=ParseMode.MARKDOWN_V2)
+            _estatisticas["enviados"] += 1
+            logger.info(f"Alerta de {descricao} enviado com sucesso.")
+            return
+        except RetryAfter as e:
+            espera = float(e.retry_after)
+        except (BadRequest, Forbidden) as e:
+            # Erro de formatação ou de chat: repetir não resolve
+            logger.error(f"Falha ao enviar notificação de {descricao}: {e}")
+            _estatisticas["falhas"] += 1
+            return
+        except TelegramError as e:
+            espera = min(2 ** tentativa, 60)
+            logger.warning(f"Falha temporária ao enviar notificação de {descricao} (tentativa {tentativa}): {e}")
+        if tentativa < NOTIFICACAO_MAX_TENTATIVAS:
+            _estatisticas["novas_tentativas"] += 1
+            await asyncio.sleep(espera)
+    _estatisticas["falhas"] += 1
+    logger.error(f"Notificação de {descricao} descartada após {NOTIFICACAO_MAX_TENTATIVAS} tentativas.")
+
+
+async def _enviar_alerta(cliente: Dict[str, Any], motivo: str):
+    descricao = f"'{motivo}' para o cliente {cliente.get('user_id')}"
+    try:
+        await _enviar(formatar_alerta(cliente, motivo), descricao)
+    except Exception as e:
+        # Erro inesperado (ex.: dado do cliente que a formatação não previa): o trabalhador da fila segue vivo
+        _estatisticas["falhas"] += 1
+        logger.error(f"🚨 Erro inesperado na notificação de {descricao}: {e}", exc_info=True)
+
+
+async def _enviar_resumo(pendentes: List[Dict[str, Any]]):
+    if len(pendentes) == 1:
+        await _enviar_alerta(pendentes[0], MOTIVO_LEAD_QUENTE)
+        return
+    _estatisticas["resumos"] += 1
+    descricao = f"resumo com {len(pendentes)} leads quentes"
+    try:
+        await _enviar(formatar_resumo(pendentes), descricao)
+    except Exception as e:
+        _estatisticas["falhas"] += 1
+        logger.error(f"🚨 Erro inesperado na notificação de {descricao}: {e}", exc_info=True)
+
+
+async def _processar_fila():
+    loop = asyncio.get_running_loop()
+    pendentes: List[Dict[str, Any]] = []  # leads quentes aguardando o resumo
+    prazo_resumo = None
+    while True:
+        espera = None if prazo_resumo is None else max(0.0, prazo_resumo - loop.time())
+        try:
+            item = await asyncio.wait_for(_fila.get(), espera)
+        except asyncio.TimeoutError:
+            item = None
+
+        if item is _FIM:
+            if pendentes:
+                await _enviar_resumo(pendentes)
+            return
+        if item is not None:
+            motivo, cliente = item
+            if motivo == MOTIVO_LEAD_QUENTE and NOTIFICACAO_RESUMO_S > 0:
+                pendentes.append(cliente)
+                if prazo_resumo is None:
+                    prazo_resumo = loop.time() + NOTIFICACAO_RESUMO_S
+            else:
+                # Fechamento nunca espera pelo resumo
+                await _enviar_alerta(cliente, motivo)
+
+        if pendentes and loop.time() >= prazo_resumo:
+            await _enviar_resumo(pendentes)
+            pendentes, prazo_resumo = [], None
+
+
+async def iniciar(bot):
+    """Inicia o envio dos alertas usando o cliente do próprio bot (chamar no `post_init` da Application)."""
+    global _bot, _trabalhador
+    _bot = bot
+    if _trabalhador is None or _trabalhador.done():
+        _trabalhador = asyncio.create_task(_processar_fila())
+
+
+async def encerrar(timeout: float = 10.0):
+    """Envia o que ainda está na fila (inclusive resumos pendentes) e para o trabalhador."""
+    global _trabalhador
+    if _trabalhador is None:
+        return
+    _fila.put_nowait(_FIM)
+    try:
+        await asyncio.wait_for(_trabalhador, timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"Encerrando com {_fila.qsize()} alerta(s) não enviados.")
+    _trabalhador = None
+
+
+def obter_estatisticas() -> Dict[str, Any]:
+    """Volume de alertas enfileirados, enviados, deduplicados, resumidos e com falha."""
+    return {**_estatisticas, "na_fila": _fila.qsize()}
+
+
+registrar_fonte(
+    "alertas", obter_estatisticas, contadores=["enfileirados", "duplicados_ignorados", "enviados", "resumos", "novas_tentativas", "falhas"]
+)
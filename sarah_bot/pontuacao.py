@@ -0,0 +1,66 @@
+# pontuacao.py
+import os
+from typing import Iterable, List, Tuple
+
+# Pesos para o cálculo do Lead Score
+TAG_WEIGHTS = {
+    # PESOS POSITIVOS
+    "INTENCAO_FECHAMENTO": 50,
+    "DOR_FURTO_PROPRIO": 25,
+    "PEDIDO_ORCAMENTO": 20,
+    "DOR_INSEGURANCA_REGIAO": 15,
+    "INFORMOU_QUANTIDADE": 10,
+    "OBJECÃO_PRECO": 10,
+    "PEDIDO_INFORMACOES_GERAIS": 5,
+    "PEDIDO_VIDEO": 5,
+    "OBJECÃO_ADIAMENTO": 2,
+    "SAUDACAO": 1,
+    # Tags emitidas pela análise de mensagens (sarah_bot.vendedora / sarah_bot.classificador)
+    "INTENCAO_ORCAMENTO": 20,
+    "INTENCAO_PEDIR_VIDEO": 5,
+    "INTENCAO_EXPLICACAO_SAF": 5,
+    "INTENCAO_ADIAR_DECISAO": 2,
+    
+    # PESOS NEGATIVOS
+    "APENAS_CURIOSIDADE": -15,
+    "CONCORRENTE_MENCIONADO": -5,
+    "FORA_DE_ESCOPO": -20,
+}
+# Peso das tags que não estão na tabela acima
+PESO_TAG_PADRAO = int(os.getenv("PESO_TAG_PADRAO", 5))
+# Pontos somados quando o orçamento é apresentado ao cliente
+PONTOS_ORCAMENTO_APRESENTADO = int(os.getenv("PONTOS_ORCAMENTO_APRESENTADO", 25))
+
+MOTIVO_ORCAMENTO = "ORCAMENTO_APRESENTADO"
+
+
+def peso_tag(tag: str) -> int:
+    return TAG_WEIGHTS.get(tag, PESO_TAG_PADRAO)
+
+
+def eventos_da_mensagem(tags: Iterable[str], orcamento_apresentado: bool = False) -> List[Tuple[str, int]]:
+    """Pontos que uma mensagem rende, como (motivo, pontos): um por tag detectada e um pelo orçamento apresentado."""
+    eventos = [(tag, peso_tag(tag)) for tag in sorted(tags)]
+    if orcamento_apresentado:
+        eventos.append((MOTIVO_ORCAMENTO, PONTOS_ORCAMENTO_APRESENTADO))
+    return [(motivo, pontos) for motivo, pontos in eventos if pontos]
+
+
+def aplicar_eventos(score: int, eventos: Iterable[Tuple[str, int]]) -> List[Tuple[str, int, int]]:
+    """
+    Aplica os eventos em sequência a partir de `score` (que nunca fica negativo).
+    Retorna (motivo, variação efetiva, novo score) de cada evento que mudou o score.
+    """
+    aplicados = []
+    for motivo, pontos in eventos:
+        novo_score = max(0, score + pontos)
+        if novo_score != score:
+            aplicados.append((motivo, novo_score - score, novo_score))
+            score = novo_score
+    return aplicados
+
+
+def calcular_score(eventos: Iterable[Tuple[str, int]]) -> int:
+    """Score de um lead a partir da sequência completa de (motivo, pontos) desde o primeiro contato."""
+    aplicados = aplicar_eventos(0, eventos)
+    return aplicados[-1][2] if aplicados else 0
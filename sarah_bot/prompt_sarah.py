@@ -1,88 +1,191 @@
-# prompt_sarah.py (v13.0 - Roteiro de Vendas Otimizado)
+# prompt_sarah.py (v14.0 - Prompt Compilado)
+import logging
+import os
 from textwrap import dedent
 from typing import List, Dict, Any
 
-def construir_prompt_sarah(pergunta: str, cliente_info: Dict[str, Any], estado_conversa: str, historico_conversa: List[Dict[str, str]], perfil_cliente="neutro", tags_detectadas=None):
-    """
-    Constrói o prompt dinâmico para a IA da Sarah, seguindo o roteiro de vendas consultivas.
-    """
-    if tags_detectadas is None:
-        tags_detectadas = []
+from sarah_bot import metricas
 
-    historico_formatado = "\n".join(
-        [f"{'Cliente' if msg['role'] == 'user' else 'Sarah'}: {msg['content']}" for msg in historico_conversa[-10:]]
-    )
-    
-    nome_cliente = cliente_info.get('nome', 'cliente')
+try:
+    import tiktoken
+except ImportError:  # opcional: sem ele, os tokens são estimados pelo tamanho do texto
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Quantos tokens do histórico entram no prompt (as mensagens mais recentes primeiro)
+PROMPT_MAX_TOKENS_HISTORICO = int(os.getenv("PROMPT_MAX_TOKENS_HISTORICO", 1500))
+
+# Marcador usado no texto fixo no lugar do nome do cliente; o nome real vai só no fim do prompt
+MARCADOR_NOME = "[NOME]"
+
+# --- DEFINIÇÃO DA PERSONA E REGRAS GERAIS ---
+# Compilado uma vez, igual para todos os clientes: é o prefixo que o provedor consegue reaproveitar em cache
+PERSONA = dedent(f"""
+Você é Sarah, uma vendedora especialista de elite em segurança para o agronegócio com 15 anos de experiência. Sua missão é ser uma consultora estratégica que fecha vendas através da criação de VALOR, e não da venda de um produto.
+
+**REGRAS DE OURO (NÃO QUEBRE NUNCA):**
+1.  **SEJA HUMANA:** Use o nome do cliente de forma natural. Evite saudações repetitivas.
+2.  **FOCO NA DOR:** Sempre conecte os benefícios do SAF à dor ou preocupação que o cliente mencionou.
+3.  **PERGUNTE, NÃO AFIRME:** Termine suas mensagens com perguntas abertas para manter o controle da conversa.
+4.  **VENDA VALOR, NÃO PREÇO:** O SAF não é um custo, é um investimento que previne prejuízos muito maiores.
+
+Nos exemplos abaixo, {MARCADOR_NOME} representa o nome do cliente, informado no contexto ao final da conversa. Nunca escreva "{MARCADOR_NOME}" na resposta.
+""").strip()
+
+# --- ESTRATÉGIA DETALHADA POR ESTADO DA CONVERSA ---
+ESTRATEGIA_POR_ESTADO = {
+    "AGUARDANDO_DOR": dedent(f"""
+    **Missão Atual:** Investigar a dor do cliente.
+    **Sua Tarefa:** Faça a pergunta-chave para descobrir a principal preocupação de segurança do cliente.
+    **Exemplo de Resposta:** "Para que eu possa ser o mais útil possível, {MARCADOR_NOME}, me conta: qual é a sua maior preocupação hoje com a segurança da sua produção?"
+    """),
+
+    "CONFIRMANDO_INTERESSE": dedent(f"""
+    **Missão Atual:** Conectar a dor do cliente a uma solução e criar curiosidade.
+    **Sua Tarefa:** Valide o sentimento do cliente, pinte um quadro da solução (a "cura") e peça permissão para apresentar o SAF.
+    **Exemplo de Resposta:** "Entendo perfeitamente, {MARCADOR_NOME}. Esse é um problema que tira o sono de muitos produtores. Imagina a tranquilidade de saber exatamente onde seus equipamentos estão, 24 horas por dia... Posso mostrar como funciona a solução que está a resolver isso?"
+    """),
+
+    "APRESENTANDO_SOLUCAO": dedent("""
+    **Missão Atual:** Explicar o SAF de forma clara e focada em benefícios, e preparar para o envio do vídeo.
+    **Sua Tarefa:** Gere o texto de apresentação do SAF e dos seus benefícios. O bot enviará o vídeo em seguida.
+    **Exemplo de Resposta:** "Ótimo! O SAF (Sistema Antifurto para Fazendas) é como um guardião digital para os seus equipamentos mais valiosos.\\n\\nDe forma simples:\\n✅ **Instalamos um dispositivo discreto** no seu pivô ou casa de bombas.\\n✅ **Ele monitoriza tudo via satélite**, mesmo onde não há sinal de telemóvel.\\n✅ **Qualquer movimento suspeito, você é alertado na hora** no seu telemóvel.\\n\\nPara ver a robustez do sistema em ação, preparei este vídeo rápido:"
+    """),
+
+    "ORCAMENTO_APRESENTADO": dedent(f"""
+    **Missão Atual:** O orçamento completo foi enviado. Agora, o objetivo é fechar ou quebrar objeções.
+    **Sua Tarefa:** Faça a pergunta de fecho estratégico para levar o cliente à reflexão.
+    **Exemplo de Resposta:** "{MARCADOR_NOME}, considerando o prejuízo que o roubo de um único pivô pode causar, tanto no equipamento quanto nos dias de produção perdidos, como é que esta solução se encaixa na sua realidade hoje?"
+    """),
+
+    "INTENCAO_ADIAR_DECISAO": dedent(f"""
+    **Missão Atual:** Quebrar a objeção "vou pensar".
+    **Sua Tarefa:** Use gatilhos de perda e prova social. Ofereça mais valor para manter o cliente engajado.
+    **Exemplo de Resposta:** "Claro, {MARCADOR_NOME}. A decisão é sua. Apenas partilho o que ouço de outros produtores: muitos dos que decidiram 'pensar' acabaram por pagar o preço mais caro, que foi o prejuízo de um novo roubo. O SAF não é um custo, é um seguro contra um prejuízo quase certo. Se quiser, posso preparar uma simulação do retorno sobre este investimento para a sua área. O que me diz?"
+    """),
+
+    "OBJECÃO_PRECO": dedent(f"""
+    **Missão Atual:** Quebrar a objeção de preço.
+    **Sua Tarefa:** Reenquadre a conversa do CUSTO para o VALOR. Compare o investimento com o prejuízo de um roubo.
+    **Exemplo de Resposta:** "Eu compreendo a sua análise, {MARCADOR_NOME}. É um investimento importante. Mas se colocarmos na balança, o valor de um único conjunto de cabos de um pivô, ou os dias de irrigação perdidos, já ultrapassam em muito o valor do SAF. Este sistema não é um gasto, é a garantia de que a sua operação não para."
+    """),
+}
+
+ESTRATEGIA_PADRAO = "Sua missão é entender a necessidade do cliente e responder de forma consultiva e empática, seguindo as regras de ouro."
+
+# Mensagem de sistema pronta para cada estado: persona + estratégia, montadas uma única vez
+_SISTEMA_POR_ESTADO = {
+    estado: f"{PERSONA}\n\n--- SUA MISSÃO E ESTRATÉGIA ---\n{estrategia.strip()}"
+    for estado, estrategia in ESTRATEGIA_POR_ESTADO.items()
+}
+_SISTEMA_PADRAO = f"{PERSONA}\n\n--- SUA MISSÃO E ESTRATÉGIA ---\n{ESTRATEGIA_PADRAO}"
+
+# Tokens fixos que cada mensagem adiciona no formato de chat da OpenAI
+_TOKENS_POR_MENSAGEM = 4
+
+_codificador = None
+if tiktoken is not None:
+    try:
+        _codificador = tiktoken.encoding_for_model(os.getenv("OPENAI_MODEL", "gpt-4o"))
+    except KeyError:
+        _codificador = tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning(f"tiktoken indisponível ({e}); estimando tokens pelo tamanho do texto.")
+
+_estatisticas_por_estado: Dict[str, Dict[str, int]] = {}
 
-    # --- DEFINIÇÃO DA PERSONA E REGRAS GERAIS ---
-    persona = dedent(f"""
-    Você é Sarah, uma vendedora especialista de elite em segurança para o agronegócio com 15 anos de experiência. Sua missão é ser uma consultora estratégica que fecha vendas através da criação de VALOR, e não da venda de um produto.
-
-    **REGRAS DE OURO (NÃO QUEBRE NUNCA):**
-    1.  **SEJA HUMANA:** Use o nome do cliente ({nome_cliente}) de forma natural. Evite saudações repetitivas.
-    2.  **FOCO NA DOR:** Sempre conecte os benefícios do SAF à dor ou preocupação que o cliente mencionou.
-    3.  **PERGUNTE, NÃO AFIRME:** Termine suas mensagens com perguntas abertas para manter o controle da conversa.
-    4.  **VENDA VALOR, NÃO PREÇO:** O SAF não é um custo, é um investimento que previne prejuízos muito maiores.
-    """)
-
-    # --- ESTRATÉGIA DETALHADA POR ESTADO DA CONVERSA ---
-    estrategia_por_estado = {
-        "AGUARDANDO_DOR": dedent(f"""
-        **Missão Atual:** Investigar a dor do cliente.
-        **Sua Tarefa:** Faça a pergunta-chave para descobrir a principal preocupação de segurança do cliente.
-        **Exemplo de Resposta:** "Para que eu possa ser o mais útil possível, {nome_cliente}, me conta: qual é a sua maior preocupação hoje com a segurança da sua produção?"
-        """),
-        
-        "CONFIRMANDO_INTERESSE": dedent(f"""
-        **Missão Atual:** Conectar a dor do cliente a uma solução e criar curiosidade.
-        **Sua Tarefa:** Valide o sentimento do cliente, pinte um quadro da solução (a "cura") e peça permissão para apresentar o SAF.
-        **Exemplo de Resposta:** "Entendo perfeitamente, {nome_cliente}. Esse é um problema que tira o sono de muitos produtores. Imagina a tranquilidade de saber exatamente onde seus equipamentos estão, 24 horas por dia... Posso mostrar como funciona a solução que está a resolver isso?"
-        """),
-
-        "APRESENTANDO_SOLUCAO": dedent(f"""
-        **Missão Atual:** Explicar o SAF de forma clara e focada em benefícios, e preparar para o envio do vídeo.
-        **Sua Tarefa:** Gere o texto de apresentação do SAF e dos seus benefícios. O bot enviará o vídeo em seguida.
-        **Exemplo de Resposta:** "Ótimo! O SAF (Sistema Antifurto para Fazendas) é como um guardião digital para os seus equipamentos mais valiosos.\\n\\nDe forma simples:\\n✅ **Instalamos um dispositivo discreto** no seu pivô ou casa de bombas.\\n✅ **Ele monitoriza tudo via satélite**, mesmo onde não há sinal de telemóvel.\\n✅ **Qualquer movimento suspeito, você é alertado na hora** no seu telemóvel.\\n\\nPara ver a robustez do sistema em ação, preparei este vídeo rápido:"
-        """),
-
-        "ORCAMENTO_APRESENTADO": dedent(f"""
-        **Missão Atual:** O orçamento completo foi enviado. Agora, o objetivo é fechar ou quebrar objeções.
-        **Sua Tarefa:** Faça a pergunta de fecho estratégico para levar o cliente à reflexão.
-        **Exemplo de Resposta:** "{nome_cliente}, considerando o prejuízo que o roubo de um único pivô pode causar, tanto no equipamento quanto nos dias de produção perdidos, como é que esta solução se encaixa na sua realidade hoje?"
-        """),
-
-        "INTENCAO_ADIAR_DECISAO": dedent(f"""
-        **Missão Atual:** Quebrar a objeção "vou pensar".
-        **Sua Tarefa:** Use gatilhos de perda e prova social. Ofereça mais valor para manter o cliente engajado.
-        **Exemplo de Resposta:** "Claro, {nome_cliente}. A decisão é sua. Apenas partilho o que ouço de outros produtores: muitos dos que decidiram 'pensar' acabaram por pagar o preço mais caro, que foi o prejuízo de um novo roubo. O SAF não é um custo, é um seguro contra um prejuízo quase certo. Se quiser, posso preparar uma simulação do retorno sobre este investimento para a sua área. O que me diz?"
-        """),
-
-        "OBJECÃO_PRECO": dedent(f"""
-        **Missão Atual:** Quebrar a objeção de preço.
-        **Sua Tarefa:** Reenquadre a conversa do CUSTO para o VALOR. Compare o investimento com o prejuízo de um roubo.
-        **Exemplo de Resposta:** "Eu compreendo a sua análise, {nome_cliente}. É um investimento importante. Mas se colocarmos na balança, o valor de um único conjunto de cabos de um pivô, ou os dias de irrigação perdidos, já ultrapassam em muito o valor do SAF. Este sistema não é um gasto, é a garantia de que a sua operação não para."
-        """),
-    }
 
-    # --- CONSTRUÇÃO DO PROMPT FINAL ---
-    instrucao_especifica = estrategia_por_estado.get(estado_conversa, "Sua missão é entender a necessidade do cliente e responder de forma consultiva e empática, seguindo as regras de ouro.")
+def contar_tokens(texto: str) -> int:
+    """Tokens de um texto (exato com tiktoken; sem ele, ~4 caracteres por token)."""
+    if _codificador is not None:
+        return len(_codificador.encode(texto))
+    return (len(texto) + 3) // 4
 
-    return dedent(f"""
-    {persona}
 
+def _tokens_mensagem(mensagem: Dict[str, str]) -> int:
+    return contar_tokens(mensagem["content"]) + _TOKENS_POR_MENSAGEM
+
+
+def contar_tokens_mensagens(mensagens: List[Dict[str, str]]) -> int:
+    """Tokens de prompt de uma lista de mensagens de chat."""
+    return sum(_tokens_mensagem(m) for m in mensagens)
+
+
+def recortar_historico(historico_conversa: List[Dict[str, str]], max_tokens: int = PROMPT_MAX_TOKENS_HISTORICO) -> List[Dict[str, str]]:
+    """Mantém as mensagens mais recentes que cabem no orçamento de tokens, na ordem original."""
+    selecionadas = []
+    total = 0
+    for mensagem in reversed(historico_conversa):
+        tokens = _tokens_mensagem(mensagem)
+        if total + tokens > max_tokens:
+            break
+        selecionadas.append({"role": mensagem["role"], "content": mensagem["content"]})
+        total += tokens
+    selecionadas.reverse()
+    return selecionadas
+
+
+def construir_mensagens_sarah(pergunta: str, cliente_info: Dict[str, Any], estado_conversa: str, historico_conversa: List[Dict[str, str]], perfil_cliente="neutro", tags_detectadas=None) -> List[Dict[str, str]]:
+    """
+    Monta as mensagens de chat da Sarah, seguindo o roteiro de vendas consultivas.
+
+    Ordem pensada para o cache de prompt do provedor: primeiro o texto fixo (persona + estratégia
+    do estado), depois o resumo das mensagens antigas e o histórico recente e, por último, o que
+    muda a cada cliente e a cada mensagem.
+    """
+    nome_cliente = cliente_info.get('nome', 'cliente')
+    sistema = _SISTEMA_POR_ESTADO.get(estado_conversa, _SISTEMA_PADRAO)
+
+    # O histórico já termina com a mensagem atual do cliente; ela vai no fim, junto do contexto
+    historico = list(historico_conversa or [])
+    if historico and historico[-1]["role"] == "user" and historico[-1]["content"] == pergunta:
+        historico = historico[:-1]
+    historico = recortar_historico(historico)
+
+    contexto = dedent(f"""
     --- CONTEXTO ATUAL DA CONVERSA ---
-    - **Cliente:** {nome_cliente}
+    - **Cliente ({MARCADOR_NOME}):** {nome_cliente}
     - **Perfil Detectado:** {perfil_cliente}
     - **Estágio da Conversa:** {estado_conversa}
 
-    --- SUA MISSÃO E ESTRATÉGIA ---
-    {instrucao_especifica}
-
-    --- HISTÓRICO RECENTE ---
-    {historico_formatado}
-    
     --- TAREFA ---
     Com base em todo o contexto, gere a próxima resposta da Sarah para a última mensagem do cliente.
     **Última Mensagem do Cliente:** "{pergunta}"
-    """)
\ No newline at end of file
+    """).strip()
+
+    mensagens = [{"role": "system", "content": sistema}]
+    resumo = cliente_info.get('resumo_conversa')
+    if resumo:
+        # Muda só quando o resumo é refeito, então não atrapalha o cache do que vem antes
+        mensagens.append({"role": "system", "content": f"--- RESUMO DA CONVERSA ATÉ AQUI ---\n{resumo}"})
+    mensagens += [*historico, {"role": "user", "content": contexto}]
+    _registrar_tokens(estado_conversa, mensagens)
+    return mensagens
+
+
+def _registrar_tokens(estado_conversa: str, mensagens: List[Dict[str, str]]):
+    tokens_fixos = _tokens_mensagem(mensagens[0])
+    tokens_total = sum(_tokens_mensagem(m) for m in mensagens)
+    estatisticas = _estatisticas_por_estado.setdefault(
+        estado_conversa or "PADRAO", {"chamadas": 0, "tokens_prompt": 0, "tokens_prefixo_fixo": 0, "tokens_prompt_max": 0}
+    )
+    estatisticas["chamadas"] += 1
+    estatisticas["tokens_prompt"] += tokens_total
+    estatisticas["tokens_prefixo_fixo"] += tokens_fixos
+    estatisticas["tokens_prompt_max"] = max(estatisticas["tokens_prompt_max"], tokens_total)
+
+
+def obter_estatisticas() -> Dict[str, Dict[str, Any]]:
+    """Tokens de prompt por estado da conversa: média, máximo e quanto disso é prefixo fixo (cacheável)."""
+    return {
+        estado: {
+            **valores,
+            "tokens_prompt_medio": valores["tokens_prompt"] / valores["chamadas"],
+            "fracao_prefixo_fixo": valores["tokens_prefixo_fixo"] / valores["tokens_prompt"] if valores["tokens_prompt"] else 0.0,
+        }
+        for estado, valores in _estatisticas_por_estado.items()
+    }
+
+
+metricas.registrar_fonte("prompt", obter_estatisticas, contadores=["chamadas", "tokens_prompt", "tokens_prefixo_fixo"], rotulo="estado")
@@ -0,0 +1,106 @@
+# resumo.py
+import asyncio
+import logging
+import os
+from typing import Dict, Any, List, Set
+
+from sarah_bot.memoria import obter_mensagens_nao_resumidas, salvar_resumo
+from sarah_bot import uso_llm
+from sarah_bot import metricas
+from sarah_bot.metricas import medir
+from sarah_bot.vendedora import async_client, modelo_analise, _semaforo_openai
+
+logger = logging.getLogger(__name__)
+
+# Quando o cliente acumula mais que isso de mensagens fora do resumo, as mais antigas são resumidas
+RESUMO_LIMIAR_MENSAGENS = int(os.getenv("RESUMO_LIMIAR_MENSAGENS", 20))
+# Quantas mensagens recentes continuam literais no prompt depois de cada resumo
+RESUMO_JANELA_RECENTE = int(os.getenv("RESUMO_JANELA_RECENTE", 8))
+
+PROMPT_RESUMO = """
+    Você mantém o resumo de uma conversa de vendas entre Sarah (vendedora do sistema antifurto SAF, da Irricontrol) e um produtor rural.
+
+    Resumo atual (pode estar vazio):
+    {resumo_atual}
+
+    Novas mensagens a incorporar:
+    {mensagens}
+
+    Reescreva o resumo incorporando as novas mensagens, em português, com no máximo 120 palavras.
+    Preserve SEMPRE os fatos concretos: nome, fazenda, região, quantidade de pivôs e de bombas, a dor ou
+    preocupação principal, orçamentos e valores enviados, objeções levantadas e o que ficou combinado.
+    Descarte cumprimentos e repetições. Responda apenas com o texto do resumo.
+    """
+
+_em_andamento: Set[str] = set()
+_tarefas: Set[asyncio.Task] = set()
+
+_estatisticas = {"resumos": 0, "mensagens_resumidas": 0, "falhas": 0, "descartados_por_concorrencia": 0}
+
+
+def precisa_resumir(cliente: Dict[str, Any]) -> bool:
+    """Verificação barata, feita a cada mensagem: o histórico carregado já passou do limiar?"""
+    return len(cliente.get("historico_conversa") or []) > RESUMO_LIMIAR_MENSAGENS
+
+
+def _formatar_mensagens(mensagens: List[Dict[str, Any]]) -> str:
+    return "\n".join(f"{'Cliente' if msg['role'] == 'user' else 'Sarah'}: {msg['content']}" for msg in mensagens)
+
+
+async def atualizar_resumo(user_id: str) -> bool:
+    """Incorpora ao resumo as mensagens antigas do cliente, deixando as `RESUMO_JANELA_RECENTE` últimas de fora."""
+    resumo_atual, ate_seq_anterior, mensagens = obter_mensagens_nao_resumidas(user_id)
+    if len(mensagens) <= RESUMO_LIMIAR_MENSAGENS:
+        return False
+    a_resumir = mensagens[:-RESUMO_JANELA_RECENTE] if RESUMO_JANELA_RECENTE else mensagens
+
+    prompt = PROMPT_RESUMO.format(resumo_atual=resumo_atual or "(vazio)", mensagens=_formatar_mensagens(a_resumir))
+    try:
+        async with _semaforo_openai:
+            with medir("openai", operacao="resumo"), uso_llm.chamada(modelo_analise, "resumo") as chamada:
+                resposta = await async_client.chat.completions.create(
+                    model=modelo_analise,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=0.2,
+                    max_tokens=350,
+                )
+                chamada.usage = resposta.usage
+        novo_resumo = resposta.choices[0].message.content.strip()
+    except Exception as e:
+        _estatisticas["falhas"] += 1
+        logger.error(f"🚨 Erro ao resumir a conversa do cliente {user_id}: {e}")
+        return False
+
+    if not salvar_resumo(user_id, novo_resumo, a_resumir[-1]["seq"], ate_seq_anterior):
+        _estatisticas["descartados_por_concorrencia"] += 1
+        return False
+    _estatisticas["resumos"] += 1
+    _estatisticas["mensagens_resumidas"] += len(a_resumir)
+    logger.info(f"Resumo da conversa do cliente {user_id} atualizado ({len(a_resumir)} mensagens incorporadas).")
+    return True
+
+
+async def _atualizar_resumo_agendado(user_id: str):
+    try:
+        await atualizar_resumo(user_id)
+    finally:
+        _em_andamento.discard(user_id)
+
+
+def agendar_resumo(user_id: str):
+    """Atualiza o resumo em segundo plano, fora do caminho da resposta (no máximo um por cliente de cada vez)."""
+    user_id = str(user_id)
+    if user_id in _em_andamento:
+        return
+    _em_andamento.add(user_id)
+    tarefa = asyncio.create_task(_atualizar_resumo_agendado(user_id))
+    _tarefas.add(tarefa)
+    tarefa.add_done_callback(_tarefas.discard)
+
+
+def obter_estatisticas() -> Dict[str, Any]:
+    """Resumos gravados, mensagens incorporadas e falhas."""
+    return {**_estatisticas, "em_andamento": len(_em_andamento)}
+
+
+metricas.registrar_fonte("resumo", obter_estatisticas, contadores=["resumos", "mensagens_resumidas", "falhas", "descartados_por_concorrencia"])
@@ -0,0 +1,202 @@
+# shard.py
+import asyncio
+import bisect
+import hashlib
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+from typing import Optional, Dict, Any, Callable, List, Tuple
+
+from telegram import Bot, Update
+from telegram.error import NetworkError
+
+from sarah_bot import metricas, webhook
+from sarah_bot.limites import SHARD_WORKERS
+
+logger = logging.getLogger(__name__)
+
+ATIVO = SHARD_WORKERS > 1
+
+# Pontos de cada processo no anel: mais pontos, divisão mais uniforme dos clientes
+REPLICAS_POR_TRABALHADOR = 160
+# De quanto em quanto tempo a entrada confere se os processos continuam vivos
+INTERVALO_SUPERVISAO_S = 5
+# Tempo para os processos terminarem os updates já recebidos ao encerrar
+TEMPO_ENCERRAMENTO_S = 60
+
+# (índice, total, anel) do processo atual; None fora do modo com vários processos (tudo pertence a ele)
+_dono: Optional[tuple] = None
+
+
+def _hash(chave: str) -> int:
+    # hash() do Python muda a cada processo; o anel precisa dar o mesmo resultado em todos
+    return int.from_bytes(hashlib.blake2b(chave.encode(), digest_size=8).digest(), "big")
+
+
+class AnelConsistente:
+    """Hash consistente: mudar o número de processos só troca de dono ~1/N dos clientes."""
+
+    def __init__(self, nos: int, replicas: int = REPLICAS_POR_TRABALHADOR):
+        pontos = sorted((_hash(f"{no}:{replica}"), no) for no in range(nos) for replica in range(replicas))
+        self._hashes = [h for h, _ in pontos]
+        self._nos = [no for _, no in pontos]
+
+    def no_de(self, chave) -> int:
+        i = bisect.bisect(self._hashes, _hash(str(chave)))
+        return self._nos[i % len(self._nos)]
+
+
+def chave_do_update(dados: Dict[str, Any]) -> str:
+    """Quem mandou o update (JSON cru do Telegram): usuário, senão o chat, senão o próprio update_id."""
+    for campo, valor in dados.items():
+        if campo == "update_id" or not isinstance(valor, dict):
+            continue
+        usuario = valor.get("from") or valor.get("user")
+        if usuario:
+            return str(usuario["id"])
+        chat = valor.get("chat") or (valor.get("message") or {}).get("chat")
+        if chat:
+            return str(chat["id"])
+    return str(dados.get("update_id"))
+
+
+def pertence(user_id) -> bool:
+    """Se o cliente é atendido por este processo (rotinas agendadas só mexem nos próprios clientes)."""
+    if _dono is None:
+        return True
+    indice, _, anel = _dono
+    return anel.no_de(user_id) == indice
+
+
+def processo_atual() -> Optional[Tuple[int, int]]:
+    """(índice, total) deste processo de atendimento; None fora do modo com vários processos."""
+    return None if _dono is None else _dono[:2]
+
+
+# --- PROCESSOS DE ATENDIMENTO ---
+
+async def _atender(application, fila_entrada):
+    loop = asyncio.get_running_loop()
+    async with webhook.aplicacao_em_execucao(application) as fila:
+        while True:
+            dados = await loop.run_in_executor(None, fila_entrada.get)
+            if dados is None:
+                break
+            # Com a fila local cheia, a fila entre processos também enche e a entrada passa a recusar (503)
+            await fila.fila.put(dados)
+
+
+def _trabalhador(criar_aplicacao: Callable, indice: int, total: int, fila_entrada):
+    global _dono
+    # Quem encerra os processos é a entrada (um None na fila), depois de parar de receber updates
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    _dono = (indice, total, AnelConsistente(total))
+    if metricas.METRICAS_PORTA:
+        metricas.iniciar_servidor(porta=metricas.METRICAS_PORTA + 1 + indice)
+    logger.info(f"Processo de atendimento {indice + 1}/{total} no ar (pid {os.getpid()}).")
+    asyncio.run(_atender(criar_aplicacao(com_updater=False), fila_entrada))
+
+
+# --- PROCESSO DE ENTRADA ---
+
+async def _consultar_telegram(bot: Bot, aceitar: Callable[[Dict[str, Any]], bool], parar: asyncio.Event):
+    """Long polling só para distribuir os updates (desenvolvimento local, sem WEBHOOK_URL)."""
+    await bot.delete_webhook()
+    offset = None
+    try:
+        while not parar.is_set():
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=10, read_timeout=15, allowed_updates=Update.ALL_TYPES)
+            except NetworkError as e:
+                logger.warning(f"Falha ao buscar updates no Telegram: {e}")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                dados = update.to_dict()
+                # No polling não há quem reenvie: com a fila cheia, espera
+                while not aceitar(dados):
+                    await asyncio.sleep(0.05)
+                offset = update.update_id + 1
+    finally:
+        if offset is not None:
+            # Confirma ao Telegram os updates já distribuídos
+            try:
+                await bot.get_updates(offset=offset, timeout=0)
+            except NetworkError:
+                pass
+
+
+def _iniciar_trabalhador(contexto, criar_aplicacao, indice: int, total: int, fila_entrada):
+    processo = contexto.Process(
+        target=_trabalhador, args=(criar_aplicacao, indice, total, fila_entrada), name=f"sarah_shard_{indice}"
+    )
+    processo.start()
+    return processo
+
+
+async def _supervisionar(processos: List, iniciar: Callable[[int], Any], parar: asyncio.Event):
+    while not parar.is_set():
+        await asyncio.sleep(INTERVALO_SUPERVISAO_S)
+        for indice, processo in enumerate(processos):
+            if not processo.is_alive() and not parar.is_set():
+                logger.error(f"🚨 Processo de atendimento {indice} caiu (código {processo.exitcode}); reiniciando.")
+                processos[indice] = iniciar(indice)
+
+
+async def _rodar(criar_aplicacao: Callable, token: str, trabalhadores: int):
+    # spawn: cada processo começa limpo (sem conexões SQLite, threads ou loop herdados da entrada)
+    contexto = multiprocessing.get_context("spawn")
+    filas = [contexto.Queue(maxsize=webhook.FILA_UPDATES_MAX) for _ in range(trabalhadores)]
+    processos = [_iniciar_trabalhador(contexto, criar_aplicacao, i, trabalhadores, filas[i]) for i in range(trabalhadores)]
+    anel = AnelConsistente(trabalhadores)
+
+    def aceitar(dados: Dict[str, Any]) -> bool:
+        try:
+            filas[anel.no_de(chave_do_update(dados))].put_nowait(dados)
+        except queue.Full:
+            return False
+        return True
+
+    parar = webhook.evento_de_parada()
+    supervisao = asyncio.create_task(
+        _supervisionar(processos, lambda i: _iniciar_trabalhador(contexto, criar_aplicacao, i, trabalhadores, filas[i]), parar)
+    )
+    try:
+        async with Bot(token) as bot:
+            if webhook.ATIVO:
+                servidor = await webhook.iniciar_servidor(aceitar)
+                try:
+                    await webhook.registrar_webhook(bot)
+                    await parar.wait()
+                finally:
+                    servidor.close()
+                    await servidor.wait_closed()
+            else:
+                consulta = asyncio.create_task(_consultar_telegram(bot, aceitar, parar))
+                await parar.wait()
+                consulta.cancel()
+                await asyncio.gather(consulta, return_exceptions=True)
+    finally:
+        parar.set()
+        supervisao.cancel()
+        loop = asyncio.get_running_loop()
+        for fila in filas:
+            await loop.run_in_executor(None, fila.put, None)
+        for processo in processos:
+            await loop.run_in_executor(None, processo.join, TEMPO_ENCERRAMENTO_S)
+            if processo.is_alive():
+                logger.warning(f"Processo {processo.name} não terminou em {TEMPO_ENCERRAMENTO_S}s; encerrando à força.")
+                processo.kill()
+
+
+def rodar(criar_aplicacao: Callable, token: str, trabalhadores: int = SHARD_WORKERS):
+    """
+    Modo com vários processos: este processo só recebe os updates e os distribui por hash consistente do
+    cliente; cada um dos `trabalhadores` processos roda `criar_aplicacao(com_updater=False)`. Todos
+    compartilham o mesmo banco SQLite, e cada cliente fica sempre no mesmo processo (ordem e cache preservados).
+    """
+    logger.info(f"Modo com {trabalhadores} processos de atendimento ({'webhook' if webhook.ATIVO else 'polling'}).")
+    asyncio.run(_rodar(criar_aplicacao, token, trabalhadores))
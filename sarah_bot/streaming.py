@@ -0,0 +1,121 @@
+# streaming.py
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Optional, Dict, Any
+
+from telegram.constants import ChatAction
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+from sarah_bot.metricas import medir, observar
+
+logger = logging.getLogger(__name__)
+
+# O Telegram tolera por volta de 1 edição por segundo em cada chat
+STREAMING_INTERVALO_EDICAO_S = float(os.getenv("STREAMING_INTERVALO_EDICAO_S", 1.0))
+TEXTO_PROVISORIO = "✍️ ..."
+LIMITE_TELEGRAM = 4096
+
+# Métrica principal de latência: do recebimento da mensagem até o cliente ver o início da resposta
+_tempos_primeiro_texto = deque(maxlen=1000)
+_estatisticas = {"respostas": 0, "edicoes": 0, "edicoes_adiadas_por_limite": 0}
+
+
+def _percentil(valores, p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(p * len(ordenados)))]
+
+
+def obter_estatisticas() -> Dict[str, Any]:
+    """Tempo até o primeiro texto visível (p50/p95/máx., últimas 1000 respostas) e volume de edições."""
+    tempos = list(_tempos_primeiro_texto)
+    return {
+        **_estatisticas,
+        "primeiro_texto_p50_s": _percentil(tempos, 0.50),
+        "primeiro_texto_p95_s": _percentil(tempos, 0.95),
+        "primeiro_texto_max_s": max(tempos, default=0.0),
+    }
+
+
+def _dividir(texto: str):
+    return [texto[i:i + LIMITE_TELEGRAM] for i in range(0, len(texto), LIMITE_TELEGRAM)] or [""]
+
+
+async def _editar(mensagem, texto: str, parse_mode: Optional[str] = None) -> bool:
+    try:
+        with medir("telegram", operacao="editar"):
+            await mensagem.edit_text(texto, parse_mode=parse_mode)
+        _estatisticas["edicoes"] += 1
+        return True
+    except BadRequest as e:
+        if "not modified" in str(e).lower():
+            return True
+        if parse_mode:
+            # Markdown inválido na resposta da IA: manda sem formatação em vez de falhar
+            logger.warning(f"Falha ao aplicar Markdown na resposta final ({e}); enviando sem formatação.")
+            return await _editar(mensagem, texto)
+        raise
+
+
+async def enviar_resposta_em_stream(update, context, geracao, prefixo: str = "", inicio: Optional[float] = None) -> str:
+    """
+    Envia a resposta da Sarah enquanto ela é gerada: mensagem provisória + "digitando" na hora,
+    edições espaçadas (respeitando o limite de edição do Telegram) e, no fim, a versão final em Markdown.
+    Retorna o texto final completo (é ele que deve ir para o histórico).
+    """
+    inicio = inicio or time.monotonic()
+    prefixo = f"{prefixo}\n\n" if prefixo else ""
+    with medir("telegram", operacao="acao"):
+        await context.bot.send_chat_action(chat_id=update.effective_chat.id, action=ChatAction.TYPING)
+    with medir("telegram", operacao="enviar"):
+        mensagem = await update.message.reply_text(prefixo + TEXTO_PROVISORIO)
+    # Com prefixo (ex.: o orçamento), o cliente já vê conteúdo real na mensagem provisória
+    tempo_primeiro_texto = time.monotonic() - inicio if prefixo else None
+
+    acumulado = ""
+    ultima_edicao = 0.0  # os primeiros tokens aparecem assim que chegam; daí em diante, edições espaçadas
+    pode_editar_em = 0.0
+    async for trecho in geracao.trechos():
+        acumulado += trecho
+        agora = time.monotonic()
+        if agora - ultima_edicao < STREAMING_INTERVALO_EDICAO_S or agora < pode_editar_em:
+            continue
+        parcial = (prefixo + acumulado)[:LIMITE_TELEGRAM]
+        try:
+            await _editar(mensagem, parcial + " ▌")
+        except RetryAfter as e:
+            _estatisticas["edicoes_adiadas_por_limite"] += 1
+            pode_editar_em = agora + float(e.retry_after)
+            continue
+        except TelegramError as e:
+            logger.warning(f"Falha em edição intermediária da resposta: {e}")
+            continue
+        ultima_edicao = time.monotonic()
+        if tempo_primeiro_texto is None:
+            tempo_primeiro_texto = ultima_edicao - inicio
+
+    texto_final = (prefixo + acumulado.strip()).strip()
+    partes = _dividir(texto_final)
+    espera = pode_editar_em - time.monotonic()
+    if espera > 0:
+        await asyncio.sleep(espera)
+    try:
+        await _editar(mensagem, partes[0], parse_mode="Markdown")
+    except RetryAfter as e:
+        await asyncio.sleep(float(e.retry_after))
+        await _editar(mensagem, partes[0], parse_mode="Markdown")
+    for parte in partes[1:]:
+        with medir("telegram", operacao="enviar"):
+            await update.message.reply_text(parte)
+
+    if tempo_primeiro_texto is None:
+        tempo_primeiro_texto = time.monotonic() - inicio
+    _tempos_primeiro_texto.append(tempo_primeiro_texto)
+    observar("primeiro_texto", tempo_primeiro_texto)
+    _estatisticas["respostas"] += 1
+    logger.info(f"Resposta em stream para {update.effective_user.id}: primeiro texto em {tempo_primeiro_texto:.2f}s, total {time.monotonic() - inicio:.2f}s.")
+    return texto_final
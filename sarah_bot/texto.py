@@ -0,0 +1,40 @@
+# texto.py
+import re
+import unicodedata
+from typing import List
+
+_NAO_ALFANUMERICO = re.compile(r"[^a-z0-9]+")
+
+
+def remover_acentos(texto: str) -> str:
+    """'Orçamento' -> 'Orcamento' (mantém maiúsculas/minúsculas)."""
+    decomposto = unicodedata.normalize("NFKD", texto)
+    return "".join(c for c in decomposto if not unicodedata.combining(c))
+
+
+def normalizar_texto(texto: str) -> str:
+    """
+    Forma canônica para comparar mensagens: minúsculas, sem acentos, sem pontuação
+    e com espaços simples. Ex.: 'Quanto CUSTA o SAF?!' -> 'quanto custa o saf'.
+    """
+    if not isinstance(texto, str):
+        return ""
+    return _NAO_ALFANUMERICO.sub(" ", remover_acentos(texto).lower()).strip()
+
+
+# Palavras sem conteúdo (já sem acentos), ignoradas nas estatísticas de termos das dores
+STOPWORDS_PT = frozenset("""
+a ao aos aquela aquelas aquele aqueles aquilo as ate com como da das de dela dele deles demais depois do dos e ela elas ele eles em entre era eram essa essas esse esses esta estamos estao estas estava estavam este estes estou eu foi fomos for foram ha isso isto ja la lhe lhes mais mas me mesmo meu meus minha minhas muito muita muitos muitas na nao nas nem no nos nossa nossas nosso nossos num numa o os ou para pela pelas pelo pelos por pra pro qual quando que quem se sem ser seu seus so sua suas tambem te tem tenho ter teu tua um uma umas uns vai vou voce voces
+aqui ai ali bem coisa coisas hoje agora ainda sim tipo gente acho fica ficar fazer faz sobre tudo todo toda todos todas cada outro outra outros outras
+""".split())
+
+
+def extrair_termos(texto: str, tamanho_minimo: int = 3) -> List[str]:
+    """
+    Termos relevantes de um texto livre, normalizados (minúsculas, sem acentos) e sem stopwords.
+    Ex.: 'Tenho medo de roubarem os cabos do pivô' -> ['medo', 'roubarem', 'cabos', 'pivo'].
+    """
+    return [
+        termo for termo in normalizar_texto(texto).split()
+        if len(termo) >= tamanho_minimo and termo not in STOPWORDS_PT and not termo.isdigit()
+    ]
@@ -0,0 +1,118 @@
+# uso_llm.py
+import asyncio
+import logging
+import os
+import time
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List, Tuple
+
+from sarah_bot.memoria import registrar_uso_llm, podar_uso_llm
+from sarah_bot.prompt_sarah import contar_tokens, contar_tokens_mensagens
+
+logger = logging.getLogger(__name__)
+
+# As chamadas ficam em memória e vão para o banco em lotes (ou a cada USO_LLM_INTERVALO_S pela job queue)
+USO_LLM_LOTE = int(os.getenv("USO_LLM_LOTE", 200))
+USO_LLM_INTERVALO_S = float(os.getenv("USO_LLM_INTERVALO_S", 60))
+# Dias em que o detalhe de cada chamada é mantido (os agregados por dia e por cliente não expiram)
+USO_LLM_RETENCAO_DIAS = int(os.getenv("USO_LLM_RETENCAO_DIAS", 14))
+
+# (user_id, estado_conversa) a quem as chamadas à IA são atribuídas; herdado pelas tarefas em segundo plano
+_atribuicao: ContextVar[Tuple[Optional[str], Optional[str]]] = ContextVar("atribuicao_llm", default=(None, None))
+_pendentes: List[Dict[str, Any]] = []
+
+
+def atribuir(user_id, estado_conversa: Optional[str]):
+    """Define o cliente e o estado da conversa responsáveis pelas próximas chamadas à IA neste contexto."""
+    _atribuicao.set((str(user_id) if user_id is not None else None, estado_conversa))
+
+
+class Chamada:
+    """
+    Uma chamada à IA (`with uso_llm.chamada(modelo, "analise") as chamada:`). Os tokens vêm do `usage`
+    da resposta; nos streams, que não trazem `usage`, são estimados a partir do prompt e do texto gerado.
+    """
+    __slots__ = ("modelo", "operacao", "inicio", "usage", "_mensagens", "_partes")
+
+    def __init__(self, modelo: str, operacao: str):
+        self.modelo = modelo
+        self.operacao = operacao
+        self.inicio = 0.0
+        self.usage = None
+        self._mensagens = None
+        self._partes = None
+
+    def estimar_tokens(self, mensagens: List[Dict[str, str]], partes: List[str]):
+        """Para streams: os tokens são contados na saída, com o que já tiver chegado em `partes`."""
+        self._mensagens = mensagens
+        self._partes = partes
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, tipo_erro, erro, rastreamento):
+        ms = int((time.perf_counter() - self.inicio) * 1000)
+        if self.usage is not None:
+            tokens_prompt, tokens_resposta = self.usage.prompt_tokens, self.usage.completion_tokens
+        elif self._mensagens is not None:
+            tokens_prompt, tokens_resposta = contar_tokens_mensagens(self._mensagens), contar_tokens("".join(self._partes))
+        else:
+            tokens_prompt = tokens_resposta = 0
+        if tipo_erro is None:
+            resultado = "ok"
+        else:
+            resultado = "cancelado" if issubclass(tipo_erro, (asyncio.CancelledError, GeneratorExit)) else "erro"
+        _registrar(self.modelo, self.operacao, tokens_prompt, tokens_resposta, ms, resultado)
+        return False
+
+
+def chamada(modelo: str, operacao: str) -> Chamada:
+    return Chamada(modelo, operacao)
+
+
+def registrar_acerto_cache(modelo: str, operacao: str):
+    """Chamada evitada pelo cache de respostas (conta para a taxa de acerto, sem tokens)."""
+    _registrar(modelo, operacao, 0, 0, 0, "cache")
+
+
+def _registrar(modelo: str, operacao: str, tokens_prompt: int, tokens_resposta: int, ms: int, resultado: str):
+    user_id, estado = _atribuicao.get()
+    _pendentes.append({
+        "ts": datetime.now().isoformat(timespec="seconds"), "user_id": user_id, "estado": estado,
+        "modelo": modelo, "operacao": operacao, "tokens_prompt": tokens_prompt,
+        "tokens_resposta": tokens_resposta, "ms": ms, "resultado": resultado,
+    })
+    if len(_pendentes) >= USO_LLM_LOTE:
+        descarregar()
+
+
+def descarregar() -> int:
+    """Grava no banco as chamadas pendentes. Retorna quantas foram gravadas."""
+    global _pendentes
+    if not _pendentes:
+        return 0
+    lote, _pendentes = _pendentes, []
+    try:
+        registrar_uso_llm(lote)
+    except Exception as e:
+        # O registro de uso não pode derrubar a conversa: o lote é descartado
+        logger.error(f"🚨 Erro ao gravar o uso da IA ({len(lote)} chamadas descartadas): {e}")
+        return 0
+    return len(lote)
+
+
+async def _rodada_agendada(context):
+    descarregar()
+    podadas = podar_uso_llm(datetime.now() - timedelta(days=USO_LLM_RETENCAO_DIAS))
+    if podadas:
+        logger.info(f"Uso da IA: {podadas} chamadas com mais de {USO_LLM_RETENCAO_DIAS} dias removidas do detalhe.")
+
+
+def agendar_consolidacao(application):
+    """Grava o uso pendente e poda o detalhe antigo periodicamente, na job queue da Application."""
+    if application.job_queue is None:
+        logger.error('JobQueue indisponível: o uso da IA só será gravado a cada lote de chamadas.')
+        return
+    application.job_queue.run_repeating(_rodada_agendada, interval=USO_LLM_INTERVALO_S, first=USO_LLM_INTERVALO_S, name="uso_llm")
@@ -3,21 +3,48 @@ import os
 import json
 import logging
 import re
+import asyncio
+import random
+import time
+import httpx
 from dotenv import load_dotenv
-from openai import OpenAI, OpenAIError
+from openai import OpenAI, AsyncOpenAI, OpenAIError
 from typing import Optional, List, Dict, Any
-from sarah_bot.prompt_sarah import construir_prompt_sarah
+from sarah_bot.prompt_sarah import construir_mensagens_sarah
+from sarah_bot import classificador, cache_respostas, uso_llm
+from sarah_bot.limites import parcela
+from sarah_bot.metricas import medir, observar
+from sarah_bot.extrator_nome import extrair_nome_localmente
 
 # Configuração
 load_dotenv()
 api_key = os.getenv("OPENAI_API_KEY")
 modelo_principal = os.getenv("OPENAI_MODEL", "gpt-4o")
 modelo_analise = os.getenv("OPENAI_ANALYSIS_MODEL", "gpt-3.5-turbo")
+# Limite global de chamadas simultâneas à OpenAI (todas as conversas somadas; com SHARD_WORKERS, dividido entre os processos)
+max_concorrencia = max(1, int(parcela(int(os.getenv("OPENAI_MAX_CONCORRENCIA", 20)))))
+timeout_segundos = float(os.getenv("OPENAI_TIMEOUT_SEGUNDOS", 60))
+# Fração das mensagens resolvidas pelo classificador local que também vão à IA, só para medir a concordância
+amostra_validacao_classificador = float(os.getenv("CLASSIFICADOR_AMOSTRA_VALIDACAO", 0.05))
 
 if not api_key:
     raise Exception("🚨 OPENAI_API_KEY não foi carregada. Verifique o .env!")
 
 client = OpenAI(api_key=api_key)
+
+# Cliente assíncrono usado pelo bot: um único pool de conexões HTTP compartilhado
+# entre todas as conversas, dimensionado pelo limite de concorrência.
+async_client = AsyncOpenAI(
+    api_key=api_key,
+    timeout=timeout_segundos,
+    http_client=httpx.AsyncClient(
+        timeout=timeout_segundos,
+        limits=httpx.Limits(max_connections=max_concorrencia, max_keepalive_connections=max_concorrencia),
+    ),
+)
+_semaforo_openai = asyncio.Semaphore(max_concorrencia)
+# Referências às tarefas disparadas em segundo plano (evita que sejam coletadas antes de terminar)
+_tarefas_em_segundo_plano = set()
 logger = logging.getLogger(__name__)
 
 
@@ -34,9 +61,7 @@ def extrair_quantidade_da_mensagem(mensagem: str) -> int:
     logger.info("Nenhuma quantidade numérica encontrada na mensagem via regex.")
     return 0
 
-def extrair_nome_da_mensagem(mensagem_usuario: str) -> Optional[str]:
-    """Usa a IA para extrair apenas o nome próprio de uma frase."""
-    prompt = f"""
+PROMPT_EXTRAIR_NOME = """
     Analise a frase a seguir e extraia APENAS o nome próprio da pessoa.
     Frase: "{mensagem_usuario}"
     
@@ -48,30 +73,70 @@ def extrair_nome_da_mensagem(mensagem_usuario: str) -> Optional[str]:
     - Frase: "Marcela" -> {{"nome": "Marcela"}}
     - Frase: "Quanto custa o produto?" -> {{"nome": null}}
     """
+
+def _prompt_extrair_nome(mensagem_usuario: str) -> str:
+    return PROMPT_EXTRAIR_NOME.format(mensagem_usuario=mensagem_usuario)
+
+def _processar_nome_extraido(mensagem_usuario: str, conteudo: str) -> Optional[str]:
+    resultado = json.loads(conteudo)
+    nome = resultado.get("nome")
+    if nome:
+        logger.info(f"Nome extraído da mensagem '{mensagem_usuario}': '{nome}'")
+        return nome.strip().title()
+    logger.warning(f"Nenhum nome encontrado na mensagem via IA: '{mensagem_usuario}'")
+    return None
+
+def extrair_nome_da_mensagem(mensagem_usuario: str) -> Optional[str]:
+    """Usa a IA para extrair apenas o nome próprio de uma frase."""
     try:
         resposta = client.chat.completions.create(
             model=modelo_analise,
-            messages=[{"role": "user", "content": prompt}],
+            messages=[{"role": "user", "content": _prompt_extrair_nome(mensagem_usuario)}],
             temperature=0.0,
             response_format={"type": "json_object"}
         )
-        resultado = json.loads(resposta.choices[0].message.content)
-        nome = resultado.get("nome")
-        if nome:
-            logger.info(f"Nome extraído da mensagem '{mensagem_usuario}': '{nome}'")
-            return nome.strip().title()
-        logger.warning(f"Nenhum nome encontrado na mensagem via IA: '{mensagem_usuario}'")
+        return _processar_nome_extraido(mensagem_usuario, resposta.choices[0].message.content)
+    except Exception as e:
+        logger.error(f"🚨 Erro ao extrair nome com IA: {e}")
         return None
+
+async def extrair_nome_da_mensagem_async(mensagem_usuario: str) -> Optional[str]:
+    """Versão não bloqueante de `extrair_nome_da_mensagem`, usada pelo bot (com cache de respostas)."""
+    chave = cache_respostas.chave_cache(modelo_analise, PROMPT_EXTRAIR_NOME, mensagem_usuario)
+    em_cache = cache_respostas.obter(chave)
+    if em_cache is not None:
+        uso_llm.registrar_acerto_cache(modelo_analise, "nome")
+        return _processar_nome_extraido(mensagem_usuario, json.dumps(em_cache))
+    try:
+        async with _semaforo_openai:
+            with medir("openai", operacao="nome"), uso_llm.chamada(modelo_analise, "nome") as chamada:
+                resposta = await async_client.chat.completions.create(
+                    model=modelo_analise,
+                    messages=[{"role": "user", "content": _prompt_extrair_nome(mensagem_usuario)}],
+                    temperature=0.0,
+                    response_format={"type": "json_object"}
+                )
+                chamada.usage = resposta.usage
+        conteudo = resposta.choices[0].message.content
+        nome = _processar_nome_extraido(mensagem_usuario, conteudo)
+        cache_respostas.guardar(chave, json.loads(conteudo))
+        return nome
     except Exception as e:
         logger.error(f"🚨 Erro ao extrair nome com IA: {e}")
         return None
 
+async def extrair_nome_async(mensagem_usuario: str) -> Optional[str]:
+    """Extrai o nome localmente (regras + lista de nomes) e só consulta a IA quando o extrator local não tem certeza."""
+    nome, confiante = extrair_nome_localmente(mensagem_usuario)
+    if confiante:
+        logger.info(f"Nome extraído localmente da mensagem '{mensagem_usuario}': '{nome}'")
+        return nome
+    return await extrair_nome_da_mensagem_async(mensagem_usuario)
 
-def analisar_mensagem_com_ia(mensagem_usuario: str, historico_conversa: list) -> dict:
-    historico_resumido = json.dumps(historico_conversa[-5:])
-    
-    prompt_analise = f"""
+
+PROMPT_ANALISE = """
     Analise a seguinte mensagem de um cliente em potencial para um sistema de segurança no agronegócio.
+    Resumo do que já foi conversado antes: {resumo_conversa}
     Histórico recente da conversa para contexto: {historico_resumido}
     Mensagem do Cliente: "{mensagem_usuario}"
 
@@ -94,10 +159,16 @@ def analisar_mensagem_com_ia(mensagem_usuario: str, historico_conversa: list) ->
     3.  **Extração de Números:** Extraia 'qtd_pivos' ou 'qtd_bombas' APENAS se o cliente mencionar um número junto de um pedido de ORÇAMENTO.
     4.  **Prioridade de Objeção:** Se detectar 'OBJECÃO_PRECO' ou 'INTENCAO_ADIAR_DECISAO', não extraia nenhuma outra tag de intenção. O foco é a objeção.
     """
+
+def _prompt_analise(mensagem_usuario: str, historico_conversa: list, resumo_conversa: Optional[str] = None) -> str:
+    historico_resumido = json.dumps(historico_conversa[-5:])
+    return PROMPT_ANALISE.format(resumo_conversa=resumo_conversa or "Nenhum", historico_resumido=historico_resumido, mensagem_usuario=mensagem_usuario)
+
+def analisar_mensagem_com_ia(mensagem_usuario: str, historico_conversa: list, resumo_conversa: Optional[str] = None) -> dict:
     try:
         resposta = client.chat.completions.create(
             model=modelo_analise,
-            messages=[{"role": "user", "content": prompt_analise}],
+            messages=[{"role": "user", "content": _prompt_analise(mensagem_usuario, historico_conversa, resumo_conversa)}],
             temperature=0.0,
             response_format={"type": "json_object"}
         )
@@ -108,13 +179,71 @@ def analisar_mensagem_com_ia(mensagem_usuario: str, historico_conversa: list) ->
         logger.error(f"🚨 Erro na análise com IA: {e}", exc_info=True)
         return {}
 
+async def analisar_mensagem_com_ia_async(mensagem_usuario: str, historico_conversa: list, resumo_conversa: Optional[str] = None) -> dict:
+    """Versão não bloqueante de `analisar_mensagem_com_ia`, usada pelo bot (com cache de respostas)."""
+    contexto = historico_conversa[-5:] + ([{"role": "resumo", "content": resumo_conversa}] if resumo_conversa else [])
+    chave = cache_respostas.chave_cache(modelo_analise, PROMPT_ANALISE, mensagem_usuario, contexto)
+    em_cache = cache_respostas.obter(chave)
+    if em_cache is not None:
+        logger.info(f"Análise da IA obtida do cache: {em_cache}")
+        uso_llm.registrar_acerto_cache(modelo_analise, "analise")
+        return em_cache
+    try:
+        async with _semaforo_openai:
+            with medir("openai", operacao="analise"), uso_llm.chamada(modelo_analise, "analise") as chamada:
+                resposta = await async_client.chat.completions.create(
+                    model=modelo_analise,
+                    messages=[{"role": "user", "content": _prompt_analise(mensagem_usuario, historico_conversa, resumo_conversa)}],
+                    temperature=0.0,
+                    response_format={"type": "json_object"}
+                )
+                chamada.usage = resposta.usage
+        analise = json.loads(resposta.choices[0].message.content)
+        logger.info(f"Análise da IA bem-sucedida: {analise}")
+        cache_respostas.guardar(chave, analise)
+        return analise
+    except Exception as e:
+        logger.error(f"🚨 Erro na análise com IA: {e}", exc_info=True)
+        return {}
+
+
+async def _validar_classificacao_local(mensagem_usuario: str, historico_conversa: list, tags_locais: list, resumo_conversa: Optional[str] = None):
+    analise_ia = await analisar_mensagem_com_ia_async(mensagem_usuario, historico_conversa, resumo_conversa)
+    if analise_ia:
+        classificador.registrar_concordancia(tags_locais, analise_ia.get("tags_relevantes", []))
+
+async def analisar_mensagem_async(mensagem_usuario: str, historico_conversa: list, estado_conversa: Optional[str] = None, resumo_conversa: Optional[str] = None,
+                                  local: Optional[Dict[str, Any]] = None) -> dict:
+    """
+    Análise da mensagem com caminho rápido: o classificador local de regras resolve as mensagens
+    óbvias ("quanto custa?", "vou pensar", "fechado"...) e só o restante vai para a IA.
+    `local` é o resultado de `classificar_mensagem` quando quem chama já o calculou.
+    """
+    if local is None:
+        local = classificador.classificar_mensagem(mensagem_usuario, estado_conversa)
+    if local["confiante"]:
+        classificador.registrar_decisao(local=True)
+        logger.info(f"Análise local (sem IA) para '{mensagem_usuario}': {local['tags_relevantes']}")
+        if random.random() < amostra_validacao_classificador:
+            # Validação em segundo plano: não atrasa a resposta ao cliente
+            tarefa = asyncio.create_task(_validar_classificacao_local(mensagem_usuario, historico_conversa, local["tags_relevantes"], resumo_conversa))
+            _tarefas_em_segundo_plano.add(tarefa)
+            tarefa.add_done_callback(_tarefas_em_segundo_plano.discard)
+        return {"tags_relevantes": local["tags_relevantes"], "entidades_extraidas": local["entidades_extraidas"], "origem": "regras"}
+
+    classificador.registrar_decisao(local=False)
+    analise = await analisar_mensagem_com_ia_async(mensagem_usuario, historico_conversa, resumo_conversa)
+    if analise and local["tags_relevantes"]:
+        classificador.registrar_concordancia(local["tags_relevantes"], analise.get("tags_relevantes", []))
+    return analise
+
 
 def gerar_resposta_sarah(pergunta: str, cliente_info: Dict[str, Any], estado_conversa: str, historico_conversa: List[Dict[str, str]], perfil_cliente="neutro", tags_detectadas=None):
-    prompt = construir_prompt_sarah(pergunta, cliente_info, estado_conversa, historico_conversa, perfil_cliente, tags_detectadas)
+    mensagens = construir_mensagens_sarah(pergunta, cliente_info, estado_conversa, historico_conversa, perfil_cliente, tags_detectadas)
     try:
         resposta = client.chat.completions.create(
             model=modelo_principal,
-            messages=[{"role": "user", "content": prompt}],
+            messages=mensagens,
             temperature=0.75,
             max_tokens=450,
         )
@@ -125,3 +254,118 @@ def gerar_resposta_sarah(pergunta: str, cliente_info: Dict[str, Any], estado_con
     except Exception as e:
         logger.error(f"🚨 Erro inesperado ao gerar resposta: {e}", exc_info=True)
         return "Ops, tive um problema técnico aqui. Pode reformular sua pergunta, por favor?"
+
+
+async def gerar_resposta_sarah_async(pergunta: str, cliente_info: Dict[str, Any], estado_conversa: str, historico_conversa: List[Dict[str, str]], perfil_cliente="neutro", tags_detectadas=None):
+    """Versão não bloqueante de `gerar_resposta_sarah`, usada pelo bot."""
+    mensagens = construir_mensagens_sarah(pergunta, cliente_info, estado_conversa, historico_conversa, perfil_cliente, tags_detectadas)
+    try:
+        async with _semaforo_openai:
+            with medir("openai", operacao="resposta"), uso_llm.chamada(modelo_principal, "resposta") as chamada:
+                resposta = await async_client.chat.completions.create(
+                    model=modelo_principal,
+                    messages=mensagens,
+                    temperature=0.75,
+                    max_tokens=450,
+                )
+                chamada.usage = resposta.usage
+        return resposta.choices[0].message.content.strip()
+    except OpenAIError as e:
+        logger.error(f"🚨 Erro na API da OpenAI ao gerar resposta: {e}", exc_info=True)
+        return f"Peço desculpas, {cliente_info.get('nome', 'cliente')}. Estou com uma instabilidade em meu sistema. Poderia, por gentileza, enviar sua mensagem novamente em alguns instantes? 🙏"
+    except Exception as e:
+        logger.error(f"🚨 Erro inesperado ao gerar resposta: {e}", exc_info=True)
+        return "Ops, tive um problema técnico aqui. Pode reformular sua pergunta, por favor?"
+
+
+async def _stream_resposta_sarah(pergunta: str, cliente_info: Dict[str, Any], estado_conversa: str, historico_conversa: List[Dict[str, str]], perfil_cliente="neutro", tags_detectadas=None):
+    """Gera a resposta da Sarah como stream de trechos de texto (tokens) à medida que a OpenAI os produz."""
+    mensagens = construir_mensagens_sarah(pergunta, cliente_info, estado_conversa, historico_conversa, perfil_cliente, tags_detectadas)
+    produziu_texto = False
+    gerado: List[str] = []
+    try:
+        async with _semaforo_openai:
+            with medir("openai", operacao="resposta_stream"), uso_llm.chamada(modelo_principal, "resposta_stream") as chamada:
+                # O stream não traz `usage`: os tokens são estimados pelo prompt e pelo que foi gerado
+                chamada.estimar_tokens(mensagens, gerado)
+                inicio = time.perf_counter()
+                stream = await async_client.chat.completions.create(
+                    model=modelo_principal,
+                    messages=mensagens,
+                    temperature=0.75,
+                    max_tokens=450,
+                    stream=True,
+                )
+                async for pedaco in stream:
+                    if pedaco.choices and pedaco.choices[0].delta.content:
+                        if not produziu_texto:
+                            observar("openai_primeiro_token", time.perf_counter() - inicio)
+                        produziu_texto = True
+                        gerado.append(pedaco.choices[0].delta.content)
+                        yield pedaco.choices[0].delta.content
+    except OpenAIError as e:
+        logger.error(f"🚨 Erro na API da OpenAI ao gerar resposta (stream): {e}", exc_info=True)
+        if not produziu_texto:
+            yield f"Peço desculpas, {cliente_info.get('nome', 'cliente')}. Estou com uma instabilidade em meu sistema. Poderia, por gentileza, enviar sua mensagem novamente em alguns instantes? 🙏"
+    except Exception as e:
+        logger.error(f"🚨 Erro inesperado ao gerar resposta (stream): {e}", exc_info=True)
+        if not produziu_texto:
+            yield "Ops, tive um problema técnico aqui. Pode reformular sua pergunta, por favor?"
+
+
+class GeracaoSarah:
+    """
+    Resposta da Sarah em andamento. A geração começa na criação do objeto e os trechos
+    são acumulados assim que chegam, mesmo antes de alguém consumi-los; depois podem ser
+    lidos progressivamente com `trechos()` ou de uma vez com `texto()`.
+    """
+
+    def __init__(self, pergunta: str, cliente_info: Dict[str, Any], estado_conversa: str, historico_conversa: List[Dict[str, str]], streaming: bool = True):
+        self.estado_conversa = estado_conversa
+        self.partes: List[str] = []
+        self.concluida = False
+        self.inicio = time.monotonic()
+        self.fim: Optional[float] = None
+        self._novidade = asyncio.Event()
+        self._tarefa = asyncio.create_task(self._gerar(pergunta, cliente_info, estado_conversa, historico_conversa, streaming))
+
+    async def _gerar(self, pergunta, cliente_info, estado_conversa, historico_conversa, streaming):
+        try:
+            if streaming:
+                async for trecho in _stream_resposta_sarah(pergunta, cliente_info, estado_conversa, historico_conversa):
+                    self.partes.append(trecho)
+                    self._novidade.set()
+            else:
+                self.partes.append(await gerar_resposta_sarah_async(pergunta, cliente_info, estado_conversa, historico_conversa))
+        finally:
+            self.concluida = True
+            self.fim = time.monotonic()
+            self._novidade.set()
+
+    def duracao(self) -> float:
+        """Tempo de geração até agora (ou total, se já terminou)."""
+        return (self.fim or time.monotonic()) - self.inicio
+
+    async def trechos(self):
+        """Itera sobre os trechos desde o início, esperando pelos que ainda não chegaram."""
+        lidos = 0
+        while True:
+            while lidos < len(self.partes):
+                yield self.partes[lidos]
+                lidos += 1
+            if self.concluida:
+                return
+            self._novidade.clear()
+            await self._novidade.wait()
+
+    async def texto(self) -> str:
+        await self._tarefa
+        return "".join(self.partes).strip()
+
+    def cancelar(self):
+        self._tarefa.cancel()
+
+
+def iniciar_geracao_sarah(pergunta: str, cliente_info: Dict[str, Any], estado_conversa: str, historico_conversa: List[Dict[str, str]], streaming: bool = True) -> GeracaoSarah:
+    """Dispara a geração da resposta em segundo plano e devolve o objeto que acompanha o progresso."""
+    return GeracaoSarah(pergunta, cliente_info, estado_conversa, historico_conversa, streaming)
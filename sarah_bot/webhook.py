@@ -0,0 +1,229 @@
+# webhook.py
+import asyncio
+import contextlib
+import hmac
+import json
+import logging
+import os
+import signal
+from typing import Dict, Any, Callable, Awaitable, List
+
+from telegram import Update
+
+from sarah_bot.metricas import medir
+
+logger = logging.getLogger(__name__)
+
+# URL pública (https) registrada no Telegram. Vazio = long polling (desenvolvimento local)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+# Endereço, porta e caminho em que o servidor local escuta (normalmente atrás de um proxy reverso com TLS)
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8443))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+# Enviado pelo Telegram no cabeçalho X-Telegram-Bot-Api-Secret-Token (1 a 256 caracteres: A-Z, a-z, 0-9, _ e -)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# Conexões simultâneas que o Telegram pode abrir para entregar updates (1 a 100)
+WEBHOOK_MAX_CONEXOES = int(os.getenv("WEBHOOK_MAX_CONEXOES", 40))
+# Updates aceitos e ainda não processados. Com a fila cheia o servidor responde 503 e o Telegram reenvia depois
+FILA_UPDATES_MAX = int(os.getenv("FILA_UPDATES_MAX", 1000))
+
+ATIVO = bool(WEBHOOK_URL)
+
+CABECALHO_SEGREDO = "x-telegram-bot-api-secret-token"
+# Updates do Telegram têm poucos KB; acima disso a requisição é recusada sem ser lida
+TAMANHO_MAX_CORPO = 1024 * 1024
+# Conexões keep-alive sem nenhuma requisição por este tempo são fechadas
+TEMPO_OCIOSO_S = 75
+
+_STATUS = {
+    200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+    405: "Method Not Allowed", 413: "Payload Too Large", 503: "Service Unavailable",
+}
+
+
+class FilaUpdates:
+    """
+    Fila limitada entre o servidor do webhook e o processamento dos updates. `trabalhadores` tarefas
+    consomem a fila; `aceitar` nunca espera: devolve False com a fila cheia (o servidor responde 503).
+    """
+
+    def __init__(self, processar: Callable[[Dict[str, Any]], Awaitable[None]], trabalhadores: int, tamanho: int = FILA_UPDATES_MAX):
+        self.processar = processar
+        self.trabalhadores = max(1, trabalhadores)
+        self.fila: asyncio.Queue = asyncio.Queue(maxsize=tamanho)
+        self.recusados = 0
+        self.maior_tamanho = 0
+        self._tarefas: List[asyncio.Task] = []
+        self._cheia = False
+
+    def aceitar(self, dados: Dict[str, Any]) -> bool:
+        try:
+            self.fila.put_nowait(dados)
+        except asyncio.QueueFull:
+            self.recusados += 1
+            if not self._cheia:
+                logger.warning(f"Fila de updates cheia ({self.fila.maxsize}): novos updates recebem 503 até ela esvaziar.")
+                self._cheia = True
+            return False
+        self._cheia = False
+        self.maior_tamanho = max(self.maior_tamanho, self.fila.qsize())
+        return True
+
+    async def _consumir(self):
+        while True:
+            dados = await self.fila.get()
+            try:
+                await self.processar(dados)
+            except Exception as e:
+                logger.error(f"🚨 Erro ao processar o update {dados.get('update_id')}: {e}", exc_info=True)
+            finally:
+                self.fila.task_done()
+
+    def iniciar(self):
+        self._tarefas = [asyncio.create_task(self._consumir(), name=f"fila_updates_{i}") for i in range(self.trabalhadores)]
+
+    async def encerrar(self, tempo_limite: float = 30.0):
+        """Espera os updates já aceitos serem processados (até `tempo_limite` segundos) e para os trabalhadores."""
+        try:
+            await asyncio.wait_for(self.fila.join(), tempo_limite)
+        except asyncio.TimeoutError:
+            # Já foram confirmados ao Telegram (200): não serão reenviados
+            logger.warning(f"{self.fila.qsize()} updates ainda na fila ao encerrar foram descartados.")
+        for tarefa in self._tarefas:
+            tarefa.cancel()
+        await asyncio.gather(*self._tarefas, return_exceptions=True)
+
+
+def _avaliar(metodo: str, caminho: str, cabecalhos: Dict[str, str], corpo: bytes, caminho_esperado: str,
+             segredo: str, aceitar: Callable[[Dict[str, Any]], bool]) -> int:
+    if caminho.split("?", 1)[0] != caminho_esperado:
+        return 404
+    if metodo != "POST":
+        return 405
+    if segredo and not hmac.compare_digest(cabecalhos.get(CABECALHO_SEGREDO, "").encode(), segredo.encode()):
+        return 403
+    try:
+        dados = json.loads(corpo)
+    except ValueError:
+        return 400
+    if not isinstance(dados, dict) or not isinstance(dados.get("update_id"), int):
+        return 400
+    return 200 if aceitar(dados) else 503
+
+
+async def iniciar_servidor(aceitar: Callable[[Dict[str, Any]], bool], host: str = WEBHOOK_LISTEN, porta: int = WEBHOOK_PORT,
+                           caminho: str = WEBHOOK_PATH, segredo: str = WEBHOOK_SECRET) -> asyncio.AbstractServer:
+    """
+    Sobe o servidor HTTP do webhook no loop atual. Cada POST válido em `caminho` vira `aceitar(update_json)`;
+    as conexões ficam abertas (keep-alive) para o Telegram reaproveitá-las.
+    """
+    async def atender(leitor: asyncio.StreamReader, escritor: asyncio.StreamWriter):
+        try:
+            while True:
+                linha = await asyncio.wait_for(leitor.readline(), TEMPO_OCIOSO_S)
+                if not linha:
+                    break
+                with medir("webhook") as trecho:
+                    metodo, alvo, versao = linha.decode("latin-1").rstrip("\r\n").split(" ", 2)
+                    cabecalhos: Dict[str, str] = {}
+                    while True:
+                        linha = await leitor.readline()
+                        if linha in (b"\r\n", b"\n", b""):
+                            break
+                        nome, _, valor = linha.decode("latin-1").partition(":")
+                        cabecalhos[nome.strip().lower()] = valor.strip()
+                    tamanho = int(cabecalhos.get("content-length") or 0)
+                    if tamanho > TAMANHO_MAX_CORPO:
+                        status, manter_aberta = 413, False
+                    else:
+                        corpo = await leitor.readexactly(tamanho) if tamanho else b""
+                        status = _avaliar(metodo, alvo, cabecalhos, corpo, caminho, segredo, aceitar)
+                        conexao = cabecalhos.get("connection", "").lower()
+                        manter_aberta = conexao == "keep-alive" if versao == "HTTP/1.0" else conexao != "close"
+                    trecho.rotulos["status"] = status
+                extras = "Retry-After: 1\r\n" if status == 503 else ""
+                escritor.write(
+                    f"HTTP/1.1 {status} {_STATUS[status]}\r\nContent-Length: 0\r\n{extras}"
+                    f"Connection: {'keep-alive' if manter_aberta else 'close'}\r\n\r\n".encode()
+                )
+                await escritor.drain()
+                if not manter_aberta:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            escritor.close()
+
+    servidor = await asyncio.start_server(atender, host, porta, backlog=1024)
+    logger.info(f"Webhook ouvindo em http://{host}:{porta}{caminho}")
+    return servidor
+
+
+def evento_de_parada() -> asyncio.Event:
+    """Evento ligado por SIGINT/SIGTERM no loop atual."""
+    parar = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sinal in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sinal, parar.set)
+        except NotImplementedError:
+            pass
+    return parar
+
+
+async def registrar_webhook(bot):
+    if not WEBHOOK_SECRET:
+        logger.warning("WEBHOOK_SECRET vazio: o webhook aceita updates de qualquer origem.")
+    await bot.set_webhook(
+        url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET or None,
+        max_connections=WEBHOOK_MAX_CONEXOES, allowed_updates=Update.ALL_TYPES,
+    )
+    logger.info(f"Webhook registrado no Telegram: {WEBHOOK_URL}")
+
+
+@contextlib.asynccontextmanager
+async def aplicacao_em_execucao(application):
+    """
+    Sobe a Application sem Updater (mesma sequência do `run_polling`, com post_init/post_shutdown) e entrega
+    a FilaUpdates que a alimenta. Na saída, os updates já aceitos são processados antes de a Application parar.
+    """
+    fila = FilaUpdates(
+        lambda dados: application.process_update(Update.de_json(dados, application.bot)),
+        trabalhadores=application.concurrent_updates,
+    )
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    fila.iniciar()
+    try:
+        yield fila
+    finally:
+        await fila.encerrar()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+async def _rodar(application):
+    parar = evento_de_parada()
+    async with aplicacao_em_execucao(application) as fila:
+        servidor = await iniciar_servidor(fila.aceitar)
+        try:
+            await registrar_webhook(application.bot)
+            await parar.wait()
+        finally:
+            # Para de aceitar updates antes de esvaziar a fila
+            servidor.close()
+            await servidor.wait_closed()
+
+
+def rodar(application):
+    """
+    Alternativa ao `run_polling`: recebe os updates pelo webhook (ver WEBHOOK_*) até SIGINT/SIGTERM.
+    A Application deve ser criada sem Updater (`ApplicationBuilder().updater(None)`).
+    """
+    asyncio.run(_rodar(application))